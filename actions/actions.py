@@ -12,6 +12,7 @@ import enum
 from numpy.lib.function_base import diff
 
 from flow.game_state import GameState, MainState, Skill, SkillState, SkillsState
+from flow.waits import Wait, WaitForNewFrame, WaitForScreenChange, WaitForScreenSettle, WaitForSpec, WaitSecs
 from device import device_controller
 from actions.base_action import BaseAction, ActionRunningContext, ImageFindResult
 from collections import deque
@@ -34,7 +35,7 @@ class ActionCaptureScreenshot(BaseAction):
             if context.device.last_captured_screenshot is not None:
                 break
 
-            yield None  # call me back later
+            yield WaitForNewFrame(1.0)
 
         context.image_find_results.clear()
 
@@ -61,7 +62,7 @@ class ActionClickPosition(BaseAction):
 class ActionRetreat(BaseAction):
     def run(self, context: ActionRunningContext) -> Iterable[BaseAction]:
         context.device.tap(200, 54)
-        time.sleep(1)  # allow game to switch window
+        yield WaitSecs(1)  # allow game to switch window
         yield from ()
 
 
@@ -82,18 +83,44 @@ class ActionMoveGrids(BaseAction):
         self.__steps = steps
 
     def run(self, context: ActionRunningContext) -> Iterable[BaseAction]:
-        for (x1, y1, x2, y2) in self.__steps:
-            context.device.drag(
-                *board_image_parser.get_grid_center(x1,y1),
-                *board_image_parser.get_grid_center(x2,y2)
-            )
-            time.sleep(0.3)
+        context.device.drag_all([
+            (*board_image_parser.get_grid_center(x1,y1), *board_image_parser.get_grid_center(x2,y2))
+            for (x1, y1, x2, y2) in self.__steps
+        ], 0.3)
+        context.logger.log("input: {}".format(context.device.get_input_stats()))
 
         yield from ()
 
 
 
 class ActionParseGameState(BaseAction):
+    oneofs = {
+        "enter_open_pvp": MainState.CHOOSE_PVP,
+        "enter_pvp_battle": MainState.ENTER_PVP,
+        "enter_pvp_battle_with_token": MainState.ENTER_PVP_WITH_TOKEN,
+        "battle_waiting_action": MainState.IN_BATTLE,
+        "exit_battle_result": MainState.BATTLE_RESULT,
+        "retreat_in_battle_detail_view": MainState.BATTLE_DETAIL_VIEW,
+        "retreat_confirm": MainState.RETREAT_CONFIRM,
+        "find_opponent": MainState.PVP_FIND_OPPONENT,
+        "choose_altar": MainState.CHOOSE_ALTAR,
+        "rest_and_recover": MainState.REST_AND_RECOVER,
+        "dungeon_marks_confirm": MainState.DUNGEON_MARKS_CONFIRM,
+        "battle_result_chest_full": MainState.BATTLE_RESULT_CHEST_FULL,
+        "revive_window": MainState.REVIVE_WINDOW,
+        "dungeon_battle": MainState.QUEST_BATTLE,
+        "quest_battle": MainState.QUEST_BATTLE,
+        "quest_begin": MainState.QUEST_BEGIN,
+        "quest_collect": MainState.QUEST_COLLECT,
+        "quest_skip": MainState.QUEST_SKIP,
+        "quest_talk": MainState.QUEST_TALK,
+        "side_quest_battle": MainState.SIDE_QUEST_BATTLE,
+        "side_quest_begin": MainState.SIDE_QUEST_BEGIN,
+        "side_quest_collect": MainState.SIDE_QUEST_COLLECT,
+        "challenge_start_dungeon": MainState.CHALLENGE_START_DUNGEON,
+        "challenge_start_skirmish": MainState.CHALLENGE_START_SKIRMISH,
+    }
+
     def run(self, context: ActionRunningContext) -> Iterable[BaseAction]:
         yield ActionCaptureScreenshot()
         yield from self.__parse(context)
@@ -103,49 +130,21 @@ class ActionParseGameState(BaseAction):
         context.update_state.emit(str(context.game_state))
 
     def __parse(self, context: ActionRunningContext) -> Iterable[BaseAction]:
-        oneofs = dict()
-        oneofs["enter_open_pvp"] = lambda : self.__set_game_main_state(context, MainState.CHOOSE_PVP)
-        oneofs["enter_pvp_battle"] = lambda: self.__set_game_main_state(context, MainState.ENTER_PVP)
-        oneofs["enter_pvp_battle_with_token"] = lambda: self.__set_game_main_state(context, MainState.ENTER_PVP_WITH_TOKEN)
-        oneofs["battle_waiting_action"] = lambda: self.__parse_in_battle(context)
-        oneofs["exit_battle_result"] = lambda: self.__parse_battle_result(context)
-        oneofs["retreat_in_battle_detail_view"] = lambda: self.__set_game_main_state(context, MainState.BATTLE_DETAIL_VIEW)
-        oneofs["retreat_confirm"] = lambda: self.__set_game_main_state(context, MainState.RETREAT_CONFIRM)
-        oneofs["find_opponent"] = lambda: self.__set_game_main_state(context, MainState.PVP_FIND_OPPONENT)
-        oneofs["choose_altar"] = lambda: self.__set_game_main_state(context, MainState.CHOOSE_ALTAR)
-        oneofs["rest_and_recover"] = lambda: self.__set_game_main_state(context, MainState.REST_AND_RECOVER)
-        oneofs["dungeon_marks_confirm"] = lambda: self.__set_game_main_state(context, MainState.DUNGEON_MARKS_CONFIRM)
-        oneofs["battle_result_chest_full"] = lambda: self.__set_game_main_state(context, MainState.BATTLE_RESULT_CHEST_FULL)
-        oneofs["revive_window"] = lambda: self.__set_game_main_state(context, MainState.REVIVE_WINDOW)
-        oneofs["dungeon_battle"] = lambda: self.__set_game_main_state(context, MainState.QUEST_BATTLE)
-        oneofs["quest_battle"] = lambda: self.__set_game_main_state(context, MainState.QUEST_BATTLE)
-        oneofs["quest_begin"] = lambda: self.__set_game_main_state(context, MainState.QUEST_BEGIN)
-        oneofs["quest_collect"] = lambda: self.__set_game_main_state(context, MainState.QUEST_COLLECT)
-        oneofs["quest_skip"] = lambda: self.__set_game_main_state(context, MainState.QUEST_SKIP)
-        oneofs["quest_talk"] = lambda: self.__set_game_main_state(context, MainState.QUEST_TALK)
-        oneofs["side_quest_battle"] = lambda: self.__set_game_main_state(context, MainState.SIDE_QUEST_BATTLE)
-        oneofs["side_quest_begin"] = lambda: self.__set_game_main_state(context, MainState.SIDE_QUEST_BEGIN)
-        oneofs["side_quest_collect"] = lambda: self.__set_game_main_state(context, MainState.SIDE_QUEST_COLLECT)
-        oneofs["challenge_start_dungeon"] = lambda: self.__set_game_main_state(context, MainState.CHALLENGE_START_DUNGEON)
-        oneofs["challenge_start_skirmish"] = lambda: self.__set_game_main_state(context, MainState.CHALLENGE_START_SKIRMISH)
-
-        start_time = time.time()
-        self.__find_specs(oneofs.keys(), context)
-
-        found_spec = None
-        for spec in oneofs.keys():
-            result = context.image_find_results[spec]
-            if result.found:
-                if found_spec is not None:
-                    context.logger.log(
-                        "WARNING: cannot determine game state strongly. should be one-of")
-                found_spec = spec
-        context.logger.log("find spec takes {:.1f} seconds".format(time.time()-start_time))
+        (main_state, found_spec) = context.game_state_classifier.classify(
+            context.device.last_captured_screenshot, context.image_find_results)
+        (last_latency, avg_latency, max_latency) = context.game_state_classifier.get_latency_stats()
+        context.logger.log("find spec '{}' takes {:.3f} seconds (avg {:.3f}, max {:.3f})".format(
+            found_spec, last_latency, avg_latency, max_latency))
 
         context.game_state.main_state = MainState.UNKNOWN
+        context.game_state.main_state_spec = found_spec
         context.game_state.skills_state = SkillsState.UNKNOWN
-        if found_spec is not None:
-            yield from oneofs[found_spec]()
+        if main_state == MainState.IN_BATTLE:
+            yield from self.__parse_in_battle(context)
+        elif main_state == MainState.BATTLE_RESULT:
+            yield from self.__parse_battle_result(context)
+        else:
+            yield from self.__set_game_main_state(context, main_state)
 
     def __set_game_main_state(self, context: ActionRunningContext, state) -> Iterable[BaseAction]:
         context.game_state.main_state = state
@@ -195,8 +194,10 @@ class ActionParseGameState(BaseAction):
         self.__find_specs(specs, context)
         if context.image_find_results["battle_result_chest_action_no_key"].found:
             context.game_state.main_state = MainState.BATTLE_RESULT_CHEST_ACTION_NO_KEY
+            context.game_state.main_state_spec = "battle_result_chest_action_no_key"
         elif context.image_find_results["battle_result_chest_action"].found:
             context.game_state.main_state = MainState.BATTLE_RESULT_CHEST_ACTION
+            context.game_state.main_state_spec = "battle_result_chest_action"
         else:
             context.game_state.main_state = MainState.BATTLE_RESULT
 
@@ -209,6 +210,12 @@ class ActionParseGameState(BaseAction):
 
 
 class ActionOpenPvp(BaseAction):
+    # longest waits for the screen to change after a click, and to settle after a skill or move in battle
+    transition_timeout_secs = 3.0
+    battle_timeout_secs = 2.0
+    # how long the screen has to stay the same for the animation of a skill or move to be over
+    battle_quiet_secs = 0.15
+
     def run(self, context: ActionRunningContext) -> Iterable[BaseAction]:
         while True:  # until we have a valid action, to have a meaninful logging on how long an open-pvp run is finished
             has_action = False
@@ -221,26 +228,29 @@ class ActionOpenPvp(BaseAction):
             if has_action:
                 break
 
+            # nothing to do on this screen yet; look again on the next frame, or the same one a tick later
+            yield WaitForNewFrame(0.1)
+
     def __decide(self, context: ActionRunningContext) -> Iterable[BaseAction]:
         if context.game_state.main_state == MainState.CHOOSE_PVP:
             yield from self.__generate_action_to_click_center_target(context, "enter_open_pvp")
-            time.sleep(0.5)  # allow game to switch view
+            yield from self.__wait_for_transition(context)
         
         if context.game_state.main_state == MainState.ENTER_PVP:
             yield from self.__generate_action_to_click_center_target(context, "enter_pvp_battle")
             context.game_state.skill_click_count = 0
-            time.sleep(0.5)  # allow game to switch view
+            yield from self.__wait_for_transition(context)
         if context.game_state.main_state == MainState.ENTER_PVP_WITH_TOKEN:
             yield from self.__generate_action_to_click_center_target(context, "enter_pvp_battle_with_token")
             context.game_state.skill_click_count = 0
-            time.sleep(0.5)  # allow game to switch view
+            yield from self.__wait_for_transition(context)
         
         if context.game_state.main_state == MainState.IN_BATTLE:
             yield from self.__decide_in_battle(context)
 
         if context.game_state.main_state == MainState.BATTLE_RESULT:
             yield ActionClickPosition(2041,1027)
-            time.sleep(0.5)  # allow game to switch view
+            yield from self.__wait_for_transition(context)
 
         if context.game_state.main_state == MainState.BATTLE_RESULT_CHEST_ACTION:
             metadata = images_manager.ImageMetadata()
@@ -250,86 +260,86 @@ class ActionOpenPvp(BaseAction):
             chest_action = strategy.Strategy(context).chest_action
             if chest_action != None:
                 yield ActionClickPosition(*chest_action.value.get_pos())
-                time.sleep(0.5)
+                yield from self.__wait_for_transition(context)
 
         if context.game_state.main_state == MainState.BATTLE_RESULT_CHEST_ACTION_NO_KEY:
             chest_action = strategy.Strategy(context).chest_action_no_key
             if chest_action != None:
                 yield ActionClickPosition(*chest_action.value.get_pos())
-                time.sleep(0.5)
+                yield from self.__wait_for_transition(context)
 
         
         if context.game_state.main_state == MainState.BATTLE_RESULT_CHEST_FULL:
             yield from self.__generate_action_to_click_center_target(context, "battle_result_chest_full")
-            time.sleep(0.5)
+            yield from self.__wait_for_transition(context)
         
         if context.game_state.main_state == MainState.BATTLE_DETAIL_VIEW:
             yield from self.__generate_action_to_click_center_target(context, "retreat_in_battle_detail_view")
-            time.sleep(0.5)  # allow game to switch view
+            yield from self.__wait_for_transition(context)
         
         if context.game_state.main_state == MainState.RETREAT_CONFIRM:
             yield from self.__generate_action_to_click_center_target(context, "retreat_confirm")
-            time.sleep(0.5)  # allow game to switch view
+            yield from self.__wait_for_transition(context)
 
         if context.game_state.main_state == MainState.PVP_FIND_OPPONENT:
             yield from self.__generate_action_to_click_center_target(context, "find_opponent")
-            time.sleep(0.5)  # allow game to switch view
+            yield from self.__wait_for_transition(context)
 
         if context.game_state.main_state == MainState.CHOOSE_ALTAR:
             yield from self.__generate_action_to_click_center_target(context, "choose_altar")
-            time.sleep(0.5)
+            yield from self.__wait_for_transition(context)
 
         if context.game_state.main_state == MainState.REST_AND_RECOVER:
             yield ActionClickPosition(1165, 862)
-            time.sleep(0.5)
+            yield from self.__wait_for_transition(context)
 
         if context.game_state.main_state == MainState.DUNGEON_MARKS_CONFIRM:
             yield from self.__generate_action_to_click_center_target(context, "dungeon_marks_confirm")
-            time.sleep(0.5)
+            yield from self.__wait_for_transition(context)
 
         if context.game_state.main_state == MainState.REVIVE_WINDOW:
             yield ActionClickPosition(1532, 129)
-            time.sleep(0.5)
+            yield from self.__wait_for_transition(context)
 
         if context.game_state.main_state == MainState.QUEST_BEGIN:
             yield ActionClickPosition(1992, 1016)
-            time.sleep(0.5)
+            yield from self.__wait_for_transition(context)
 
         if context.game_state.main_state == MainState.QUEST_BATTLE:
             yield ActionClickPosition(1996, 1016)
-            time.sleep(0.5)
+            yield from self.__wait_for_transition(context)
 
         if context.game_state.main_state == MainState.QUEST_TALK:
             yield ActionClickPosition(1985,1020)
-            time.sleep(0.5)
+            yield from self.__wait_for_transition(context)
 
         if context.game_state.main_state == MainState.QUEST_SKIP:
             yield ActionClickPosition(2062,77)
-            time.sleep(0.5)
+            yield from self.__wait_for_transition(context)
 
         if context.game_state.main_state == MainState.SIDE_QUEST_BATTLE:
             yield ActionClickPosition(1996, 1016)
-            time.sleep(0.5)
+            yield from self.__wait_for_transition(context)
 
         if context.game_state.main_state == MainState.SIDE_QUEST_BEGIN:
             yield ActionClickPosition(1992, 1016)
-            time.sleep(0.5)
+            yield from self.__wait_for_transition(context)
 
         if context.game_state.main_state == MainState.SIDE_QUEST_COLLECT:
             yield ActionClickPosition(1996, 1016)
-            time.sleep(0.5)
+            yield from self.__wait_for_transition(context)
 
         if context.game_state.main_state == MainState.DUNGEON_BATTLE:
             yield ActionClickPosition(1865, 1011)
-            time.sleep(0.5)
+            yield from self.__wait_for_transition(context)
 
         if context.game_state.main_state == MainState.CHALLENGE_START_DUNGEON:
             yield ActionClickPosition(1162,968)
-            time.sleep(0.5)
+            yield from self.__wait_for_transition(context)
 
         if context.game_state.main_state == MainState.CHALLENGE_START_SKIRMISH:
             yield ActionClickPosition(1162,968)
-            time.sleep(0.5)
+            yield from self.__wait_for_transition(context)
 
     def __decide_in_battle(self, context: ActionRunningContext):
         context.game_state.hp = board_image_parser.HpParser().parse(context.device.last_captured_screenshot)
@@ -341,12 +351,32 @@ class ActionOpenPvp(BaseAction):
             yield ActionClickSpells(decision.skill)
             context.game_state.skill_click_count += 1
             context.board_stable_checker.reset()
-            time.sleep(2)
+            yield from self.__wait_for_transition(context, WaitForScreenSettle(
+                self.battle_timeout_secs, quiet_secs=self.battle_quiet_secs))
         elif decision.move_grids is not None:
             yield ActionMoveGrids(decision.move_grids)
             context.game_state.skill_click_count = 0
             context.board_stable_checker.reset()
-            time.sleep(2)
+            checker = context.board_stable_checker
+            yield from self.__wait_for_transition(context, WaitForScreenSettle(
+                self.battle_timeout_secs, rois=[(checker.pos_x1, checker.pos_y1, checker.pos_x2, checker.pos_y2)],
+                quiet_secs=self.battle_quiet_secs))
+
+    def __wait_for_transition(self, context: ActionRunningContext, wait: Wait = None) -> Iterable[Wait]:
+        # until the screen the state was recognized on is gone (its spec disappears), instead of a fixed sleep that
+        # is too long for fast transitions and too short for slow ones
+        if wait is None:
+            spec_name = context.game_state.main_state_spec
+            if spec_name is not None:
+                wait = WaitForSpec(spec_name, False, self.transition_timeout_secs)
+            else:
+                wait = WaitForScreenChange(self.transition_timeout_secs)
+        state = context.game_state.main_state
+        yield wait
+        context.transition_stats.add(state, wait)
+        context.logger.log("transition from {} {} after {:.2f} seconds ({})".format(
+            state.name, "timed out" if wait.timed_out else "done", wait.get_elapsed_secs(),
+            context.transition_stats.get_stats(state)))
 
     def __generate_action_to_click_center_target(self, context: ActionRunningContext, spec_name: str) -> Iterable[BaseAction]:
         find_result = context.image_find_results[spec_name]
@@ -1,17 +1,22 @@
 from board.board import Board
 import copy
+import time
 from typing import Iterable
 
 from PyQt5.QtCore import QObject, pyqtSignal
 from abc import ABC, abstractmethod
 
 from actions.find_images import ImageFindResult
+from actions.game_state_classifier import GameStateClassifier
+from actions.strategy_profile import StrategyProfile
 from flow.game_state import GameState
 from device.device_controller import DeviceController
 from log.logger import Logger
 from dataset.images_manager import ImagesManager
 from board.board_image_parser import BoardImageParser
 from board.ai import BoardAI
+from board.solver_worker import BoardSolverWorker
+from flow.waits import TransitionStats
 
 
 class BoardStableChecker():
@@ -20,11 +25,13 @@ class BoardStableChecker():
     pos_x2 = 1607
     pos_y2 = 837
 
-    stable_total_count = 2
+    # how long the board has to stay the same. Parses follow minicap frames, a few ms apart during animations, so
+    # counting them would call a short pause mid-cascade stable.
+    stable_secs = 0.2
     max_secs = 10
 
     prev_board : Board = None
-    stable_count = 1
+    stable_from_time = 0.0
 
     def __init__(self):
         # don't clear "prev_board" and "stable_from_time" so we can memorize what's the last stable board, and early-exit if nothing happens between
@@ -42,21 +49,23 @@ class BoardStableChecker():
             self.prev_board = None
             return False
 
-        if self.prev_board is not None and self.prev_board == context.game_state.board:
-            self.stable_count += 1
-        else:
-            self.stable_count = 1
+        if self.prev_board is None or self.prev_board != context.game_state.board:
+            self.stable_from_time = time.time()
+            # start solving now, with the deadline the strategy will ask for; by the time the board is stable the
+            # result is usually ready
+            if context.board_solver_worker is not None:
+                context.board_solver_worker.submit(
+                    context.game_state.board, deadline_ms=StrategyProfile.get_active().board_ai_deadline_ms)
 
         self.prev_board = context.game_state.board.copy()
 
-        if self.stable_count >= self.stable_total_count:
+        if time.time() - self.stable_from_time >= self.stable_secs:
             return True
 
         return False
 
     def reset(self):
         self.prev_board = None
-        self.stable_count = 1
 
 
 class ActionRunningContext(QObject):
@@ -66,6 +75,9 @@ class ActionRunningContext(QObject):
     board_stable_checker: BoardStableChecker = None
     images_manager: ImagesManager = None
     board_ai: BoardAI = None
+    game_state_classifier: GameStateClassifier = None
+    board_solver_worker: BoardSolverWorker = None
+    transition_stats: TransitionStats = None
 
     game_state: GameState = GameState()
 
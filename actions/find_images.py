@@ -1,6 +1,8 @@
-from typing import List
+from typing import Dict, List, Tuple
 import cv2
 import configparser
+import os
+import threading
 import time
 import numpy
 import glob
@@ -8,6 +10,12 @@ from dataclasses import dataclass
 
 from log.logger import Logger
 
+actions_folder = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
+config_path = os.path.join(actions_folder, "templates.ini")
+
+# pixels searched around expect_pos, to tolerate small UI shifts
+default_search_margin = 20
+
 
 def cv_size(img):
     return tuple(img.shape[1::-1])
@@ -27,10 +35,10 @@ class ImageFindingSpec:
     record_non_match : bool
     record_all : bool
     match_any_pattern : str
+    search_margin : int
 
     def __init__(self, spec_name: str):
-        config_path = "/Users/petershih/Documents/pq3-helper/actions/{0}/parameters.ini".format(
-            spec_name)
+        config_path = os.path.join(actions_folder, spec_name, "parameters.ini")
         config = configparser.ConfigParser()
         config.read(config_path)
 
@@ -49,9 +57,14 @@ class ImageFindingSpec:
             self.expect_pos_x2 = self.expect_pos_x1
             self.expect_pos_y2 = self.expect_pos_y1
 
+        # record_non_match: write the search window to non_match.png when no target matches it
         self.record_non_match = ImageFindingSpec._try_int(config_spec.get("record_non_match", 0)) == 1
         self.record_all = ImageFindingSpec._try_int(config_spec.get("record_all", 0)) == 1
         self.match_any_pattern = config_spec.get("match_any_pattern", "target.png")
+        self.search_margin = ImageFindingSpec._try_int(config_spec.get("search_margin", default_search_margin))
+
+    def has_expect_pos(self) -> bool:
+        return self.expect_pos_x1 is not None and self.expect_pos_y1 is not None
 
     def _try_float(v) -> float:
         if v is None:
@@ -80,59 +93,198 @@ class ImageFindResult:
     target_w: int = None
     target_h: int = None
 
-def __compare_image(screenshot, target, verbose_log, logger: Logger) -> bool:
-    target_img = cv2.imread(target)
+    score: float = None
+
+class SpecTemplates:
+    # parsed spec and decoded target images of one spec folder, ready to match
+
+    def __init__(self, spec_name: str):
+        self.spec = ImageFindingSpec(spec_name)
+        self.folder_path = os.path.join(actions_folder, spec_name)
+        self.target_paths = sorted(glob.glob(os.path.join(self.folder_path, self.spec.match_any_pattern)))
+        self.target_imgs = [cv2.imread(path) for path in self.target_paths]
+        if not self.target_imgs:
+            raise FileNotFoundError("no target images '{}' in spec folder {}".format(
+                self.spec.match_any_pattern, self.folder_path))
+        for (path, img) in zip(self.target_paths, self.target_imgs):
+            if img is None:
+                raise ValueError("can't read target image {} of spec '{}'".format(path, spec_name))
+        (self.target_w, self.target_h) = cv_size(self.target_imgs[0])
+        self.signature = SpecTemplates.read_signature(spec_name)
+
+    def get_search_window(self, screen_w: int, screen_h: int) -> Tuple[int, int, int, int]:
+        # (x1, y1, x2, y2) of the screenshot region matched against; full screen if spec has no position
+        spec = self.spec
+        if not spec.has_expect_pos():
+            return (0, 0, screen_w, screen_h)
+
+        x1 = max(0, spec.expect_pos_x1 - spec.search_margin)
+        y1 = max(0, spec.expect_pos_y1 - spec.search_margin)
+        x2 = min(screen_w, spec.expect_pos_x2 + self.target_w + spec.search_margin)
+        y2 = min(screen_h, spec.expect_pos_y2 + self.target_h + spec.search_margin)
+        return (x1, y1, x2, y2)
+
+    def get_search_cost(self, screen_w: int, screen_h: int) -> int:
+        # pixel comparisons matchTemplate makes when no target matches (all targets are tried)
+        (x1, y1, x2, y2) = self.get_search_window(screen_w, screen_h)
+        cost = 0
+        for target_img in self.target_imgs:
+            (w, h) = cv_size(target_img)
+            cost += max(0, x2-x1-w+1) * max(0, y2-y1-h+1) * w * h
+        return cost
+
+    def read_signature(spec_name: str) -> Tuple:
+        # mtimes of parameters.ini and target files; changes whenever a target is added, removed or edited
+        folder_path = os.path.join(actions_folder, spec_name)
+        signature = []
+        for entry in sorted(os.scandir(folder_path), key=lambda e: e.name):
+            if entry.name == "parameters.ini" or entry.name.startswith("target"):
+                signature.append((entry.name, entry.stat().st_mtime))
+        return tuple(signature)
+
+
+class TemplateRegistry:
+    # process-wide cache of SpecTemplates, so find_image() doesn't touch the disk once loaded.
+    # With hot_reload, a spec is loaded again when its parameters.ini or target files change, checked at most every
+    # hot_reload_interval secs per spec; set in templates.ini.
+
+    def __init__(self, hot_reload=False, hot_reload_interval=1.0):
+        self.hot_reload = hot_reload
+        self.hot_reload_interval = hot_reload_interval
+        self.__templates: Dict[str, SpecTemplates] = dict()
+        self.__last_checked: Dict[str, float] = dict()
+        self.__lock = threading.Lock()
+
+    def from_config() -> "TemplateRegistry":
+        config = configparser.ConfigParser()
+        config.read(config_path)
+        return TemplateRegistry(hot_reload=config.getboolean("templates", "hot_reload", fallback=False),
+                                hot_reload_interval=config.getfloat("templates", "hot_reload_interval", fallback=1.0))
+
+    def load_all(self, logger: Logger = None):
+        start_time = time.time()
+        for spec_name in sorted(os.listdir(actions_folder)):
+            if os.path.isfile(os.path.join(actions_folder, spec_name, "parameters.ini")):
+                self.get(spec_name)
+        TemplateRegistry.__log(logger, "TemplateRegistry.load_all() loaded {} specs in {:.2f} seconds{}".format(
+            len(self.__templates), time.time()-start_time, ", hot reload on" if self.hot_reload else ""))
+
+    def get(self, spec_name: str, logger: Logger = None) -> SpecTemplates:
+        with self.__lock:
+            templates = self.__templates.get(spec_name)
+            if templates is None:
+                templates = self.__load(spec_name)
+            elif self.hot_reload and self.__should_check(spec_name):
+                if SpecTemplates.read_signature(spec_name) != templates.signature:
+                    TemplateRegistry.__log(logger, "TemplateRegistry: reloading spec '{}'".format(spec_name))
+                    templates = self.__load(spec_name)
+            return templates
+
+    def get_loaded(self) -> List[SpecTemplates]:
+        with self.__lock:
+            return list(self.__templates.values())
+
+    def __load(self, spec_name: str) -> SpecTemplates:
+        templates = SpecTemplates(spec_name)
+        self.__templates[spec_name] = templates
+        self.__last_checked[spec_name] = time.time()
+        return templates
+
+    def __should_check(self, spec_name: str) -> bool:
+        now = time.time()
+        if now - self.__last_checked.get(spec_name, 0) < self.hot_reload_interval:
+            return False
+        self.__last_checked[spec_name] = now
+        return True
+
+    def __log(logger: Logger, s: str):
+        # scripts without a flow have no logger
+        if logger is None:
+            print(s)
+        else:
+            logger.log(s)
+
+
+template_registry = TemplateRegistry.from_config()
+
+
+def __compare_image(screenshot, target_img, target_path, verbose_log, logger: Logger) -> bool:
     res = cv2.matchTemplate(screenshot, target_img, cv2.TM_SQDIFF_NORMED)
 
     min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(res)
 
     if verbose_log:
-        logger.log("Target {}. min_val: {} min_loc: {}".format(target, min_val, min_loc))
+        logger.log("Target {}. min_val: {} min_loc: {}".format(target_path, min_val, min_loc))
     
     return (min_val, min_loc)
 
 def find_image(spec_name: str, screenshot, logger: Logger) -> ImageFindResult:
     result = ImageFindResult()
-    spec = ImageFindingSpec(spec_name)
-
-    targets = glob.glob("/Users/petershih/Documents/pq3-helper/actions/{}/{}".format(spec_name, spec.match_any_pattern))
-    (result.target_w, result.target_h) = cv_size(cv2.imread(targets[0]))
+    templates = template_registry.get(spec_name, logger)
+    spec = templates.spec
 
-    if spec.expect_pos_x1 and spec.expect_pos_y1:
-        screenshot_roi = cv_roi(
-            screenshot, spec.expect_pos_x1, spec.expect_pos_y1,
-            spec.expect_pos_x2+result.target_w,
-            spec.expect_pos_y2+result.target_h)
-    else:
-        screenshot_roi = screenshot
+    (result.target_w, result.target_h) = (templates.target_w, templates.target_h)
 
-    screenshot_roi = screenshot
+    (x1, y1, x2, y2) = templates.get_search_window(*cv_size(screenshot))
+    screenshot_roi = cv_roi(screenshot, x1, y1, x2, y2)
+    (roi_w, roi_h) = cv_size(screenshot_roi)
 
     matched = False
     score = -1.0
     loc = None
-    for target in targets:
-        (score, loc) = __compare_image(screenshot_roi, target, spec.expect_pos_x1 is None, logger)
+    for (target_path, target_img) in zip(templates.target_paths, templates.target_imgs):
+        (target_w, target_h) = cv_size(target_img)
+        if target_w > roi_w or target_h > roi_h:
+            continue
+        (score, loc) = __compare_image(screenshot_roi, target_img, target_path, not spec.has_expect_pos(), logger)
         if score < spec.threshold:
             matched = True
             break
 
-    if spec.expect_pos_x1 and matched:
+    result.score = score
+    if matched and spec.has_expect_pos():
+        # specs without expect_pos are only searched to log where the target is, to calibrate parameters.ini
         result.found = True
-        result.pos_x = spec.expect_pos_x1 + loc[0]
-        result.pos_y = spec.expect_pos_y1 + loc[1]
+        result.pos_x = x1 + loc[0]
+        result.pos_y = y1 + loc[1]
         #logger.log("Found spec '{0}'! val: {1} Writing pos: {2},{3}".format(spec_name, min_val, result.pos_x, result.pos_y))
     else:
         result.found = False
         #logger.log("Did not find spec '{0}'. min_val: {1}".format(spec_name, min_val))
 
 
-    if spec.record_non_match:
-        record_path = "/Users/petershih/Documents/pq3-helper/actions/{}/non_match.png".format(spec_name)
+    if screenshot_roi.size == 0:
+        return result
+
+    if spec.record_non_match and not matched:
+        record_path = os.path.join(templates.folder_path, "non_match.png")
         cv2.imwrite(record_path, screenshot_roi)
 
     if spec.record_all:
-        record_path = "/Users/petershih/Documents/pq3-helper/actions/{}/score_{:.2f}_{}.png".format(spec_name, score, time.time())
+        record_path = os.path.join(templates.folder_path, "score_{:.2f}_{}.png".format(score, time.time()))
         cv2.imwrite(record_path, screenshot_roi)
 
     return result
+
+
+if __name__ == "__main__":
+    # report per-spec search cost of the expect_pos window vs. the full screen
+    screen_w = 2340
+    screen_h = 1080
+
+    template_registry.load_all()
+    total_roi = 0
+    total_full = 0
+    for spec_name in sorted(os.listdir(actions_folder)):
+        if not os.path.isfile(os.path.join(actions_folder, spec_name, "parameters.ini")):
+            continue
+        templates = template_registry.get(spec_name)
+        roi_cost = templates.get_search_cost(screen_w, screen_h)
+        full_cost = sum(
+            (screen_w-w+1) * (screen_h-h+1) * w * h
+            for (w, h) in [cv_size(img) for img in templates.target_imgs])
+        total_roi += roi_cost
+        total_full += full_cost
+        print("{:35s} window={} cost={:.2e} full={:.2e} ({:.0f}x)".format(
+            spec_name, templates.get_search_window(screen_w, screen_h), roi_cost, full_cost, full_cost / max(roi_cost, 1)))
+    print("total cost={:.2e} full={:.2e} ({:.0f}x)".format(total_roi, total_full, total_full / max(total_roi, 1)))
@@ -0,0 +1,135 @@
+from typing import Dict, List, Tuple
+from collections import Counter, deque
+import time
+import cv2
+
+from actions import find_images
+from actions.find_images import ImageFindResult
+from flow.game_state import MainState
+from log.logger import Logger
+
+
+class GameStateClassifier:
+    # Finds which one of the mutually exclusive "oneof" specs is on the screen.
+    #
+    # The spec seen most often recently is tried first and the scan stops at the first confident match, so a steady
+    # screen usually costs a single ROI match. Otherwise the frame is converted once to grayscale at 1 / coarse_scale,
+    # the search window of every other spec is cropped from it, and the specs are tried in the order of how well their
+    # targets match there. The order doesn't change the result unless two specs match confidently.
+    #
+    # A scan stops after latency_budget_secs with the best match so far, so it takes at most the budget plus one ROI
+    # match (over_budget counts those scans).
+
+    # a match is confident when its score is below threshold * confident_ratio
+    confident_ratio = 0.5
+
+    # number of past classifications used to order the specs
+    history_size = 50
+
+    coarse_scale = 4
+    latency_budget_secs = 0.2
+
+    def __init__(self, oneofs: Dict[str, MainState], logger: Logger = None):
+        self.oneofs = oneofs
+        self.logger = logger
+        self.__spec_names = list()
+        for spec_name in oneofs.keys():
+            if find_images.template_registry.get(spec_name).spec.has_expect_pos():
+                self.__spec_names.append(spec_name)
+            else:
+                self.__log("GameStateClassifier: spec '{}' has no expect_pos; ignored".format(spec_name))
+        self.__history = deque(maxlen=self.history_size)
+        self.__latencies = deque(maxlen=self.history_size)
+        self.__coarse_targets = dict()  # spec name: (SpecTemplates, targets converted like the coarse frame)
+        self.over_budget = 0
+
+    def classify(self, screenshot, find_results: Dict[str, ImageFindResult] = None) -> Tuple[MainState, str]:
+        # returns (main state, spec name); (MainState.UNKNOWN, None) if nothing matched
+        start_time = time.time()
+        candidates = []
+        order = self.__get_try_order()
+        if order and not self.__try(order[0], screenshot, find_results, candidates):
+            others = self.__rank_coarse(screenshot, order[1:])
+            for (idx, spec_name) in enumerate(others):
+                if time.time() - start_time > self.latency_budget_secs:
+                    self.over_budget += 1
+                    self.__log("GameStateClassifier: over the latency budget, {} specs not tried".format(
+                        len(others) - idx))
+                    break
+                if self.__try(spec_name, screenshot, find_results, candidates):
+                    break
+
+        if len(candidates) > 1:
+            self.__log("WARNING: cannot determine game state strongly. should be one-of: {}".format(
+                [spec_name for (_, spec_name) in candidates]))
+
+        found_spec = min(candidates)[1] if candidates else None
+        self.__history.append(found_spec)
+        self.__latencies.append(time.time() - start_time)
+
+        if found_spec is None:
+            return (MainState.UNKNOWN, None)
+        return (self.oneofs[found_spec], found_spec)
+
+    def get_latency_stats(self) -> Tuple[float, float, float]:
+        # (last, average, max) classification latency in seconds over the recent history
+        if not self.__latencies:
+            return (0.0, 0.0, 0.0)
+        return (self.__latencies[-1], sum(self.__latencies) / len(self.__latencies), max(self.__latencies))
+
+    def __try(self, spec_name: str, screenshot, find_results: Dict[str, ImageFindResult], candidates: List) -> bool:
+        # matches spec_name, adding (score / threshold, spec name) to candidates if found; whether it's confident
+        result = find_images.find_image(spec_name, screenshot, self.logger)
+        if find_results is not None:
+            find_results[spec_name] = result
+        if not result.found:
+            return False
+        threshold = find_images.template_registry.get(spec_name).spec.threshold
+        candidates.append((result.score / threshold, spec_name))
+        return result.score < threshold * self.confident_ratio
+
+    def __rank_coarse(self, screenshot, spec_names: List[str]) -> List[str]:
+        # spec_names by score / threshold of their best target on the coarse frame, specs it can't rank last
+        scale = self.coarse_scale
+        coarse = cv2.cvtColor(cv2.resize(screenshot, None, fx=1 / scale, fy=1 / scale, interpolation=cv2.INTER_AREA),
+                              cv2.COLOR_BGR2GRAY)
+        crops = dict()  # search window: crop, shared by specs with the same window
+        ranked = []
+        for (idx, spec_name) in enumerate(spec_names):
+            templates = find_images.template_registry.get(spec_name, self.logger)
+            window = templates.get_search_window(*find_images.cv_size(screenshot))
+            crop = crops.get(window)
+            if crop is None:
+                (x1, y1, x2, y2) = window
+                crop = find_images.cv_roi(coarse, x1 // scale, y1 // scale, -(-x2 // scale), -(-y2 // scale))
+                crops[window] = crop
+            (crop_w, crop_h) = find_images.cv_size(crop)
+            best = float("inf")
+            for target in self.__get_coarse_targets(spec_name, templates):
+                (target_w, target_h) = find_images.cv_size(target)
+                if 0 < target_w <= crop_w and 0 < target_h <= crop_h:
+                    best = min(best, cv2.minMaxLoc(cv2.matchTemplate(crop, target, cv2.TM_SQDIFF_NORMED))[0])
+            ranked.append((best / templates.spec.threshold, idx, spec_name))
+        ranked.sort()
+        return [spec_name for (_, _, spec_name) in ranked]
+
+    def __get_coarse_targets(self, spec_name: str, templates: find_images.SpecTemplates) -> List:
+        # converted once per loaded SpecTemplates: a hot reload replaces it
+        (converted_for, targets) = self.__coarse_targets.get(spec_name, (None, None))
+        if converted_for is not templates:
+            scale = self.coarse_scale
+            targets = [cv2.cvtColor(cv2.resize(target, None, fx=1 / scale, fy=1 / scale, interpolation=cv2.INTER_AREA),
+                                    cv2.COLOR_BGR2GRAY) for target in templates.target_imgs]
+            self.__coarse_targets[spec_name] = (templates, targets)
+        return targets
+
+    def __get_try_order(self) -> List[str]:
+        # the most frequently seen specs first
+        counts = Counter(self.__history)
+        return sorted(self.__spec_names, key=lambda spec_name: (-counts[spec_name], self.__spec_names.index(spec_name)))
+
+    def __log(self, s):
+        if self.logger is not None:
+            self.logger.log(s)
+        else:
+            print(s)
@@ -1,5 +1,6 @@
 from flow.game_state import Skill, SkillState, SkillsState
 from actions.base_action import ActionRunningContext
+from actions.strategy_profile import StrategyProfile
 import enum
 from typing import List
 from board import ai
@@ -39,27 +40,19 @@ class ChestActions(enum.Enum):
 
 
 class Strategy:
-    def __init__(self, context : ActionRunningContext) -> None:
+    def __init__(self, context : ActionRunningContext, profile : StrategyProfile = None) -> None:
         self._context = context
         self._board_ai_result = None
-        self._stun_skill = []
         self.chest_action = ChestActions.OPEN_WITH_KEY
         self.chest_action_no_key = ChestActions.SALVAGE
 
-        # Necro
-        #self._non_board_changing_skills = [Skill.SKILL_3]
-        #self._board_changing_skills = [Skill.SKILL_1, Skill.SKILL_2, Skill.SKILL_4]
-
-        # Shaman
-        #self._non_board_changing_skills = [Skill.SKILL_3]
-        #self._board_changing_skills = [Skill.SKILL_1, Skill.SKILL_2]
-        #self._stun_skill = [Skill.SKILL_4]
-
-        # Assassin
-        self._non_board_changing_skills = [Skill.SKILL_2]
-        self._board_changing_skills = [Skill.SKILL_1, Skill.SKILL_3]
-        self._no_damage_skills = [Skill.SKILL_1]
-        self._stun_skill = [Skill.SKILL_4]
+        # skill classes per character class come from strategy_profiles.ini
+        self.profile = profile or StrategyProfile.get_active()
+        self.board_ai_deadline_ms = self.profile.board_ai_deadline_ms
+        self._non_board_changing_skills = self.profile.non_board_changing_skills
+        self._board_changing_skills = self.profile.board_changing_skills
+        self._no_damage_skills = self.profile.no_damage_skills
+        self._stun_skill = self.profile.stun_skills
 
     def _get_active_stun_skill(self) -> Skill:
         for skill in self._stun_skill:
@@ -100,10 +93,12 @@ class Strategy:
         return Decision.move_grids(self._get_board_ai_result())
 
     def make_decision(self) -> Decision:
-        #return self._make_decision_pvp()
-        #return self._make_decision_shaman()
-        return self._make_decision_assassin()
-        #return Decision.no_action()
+        decisions = {
+            "pvp": self._make_decision_pvp,
+            "shaman": self._make_decision_shaman,
+            "assassin": self._make_decision_assassin,
+        }
+        return decisions[self.profile.decision]()
 
     def _make_decision_pvp(self) -> Decision:
         for skill in [Skill.SKILL_1, Skill.SKILL_2, Skill.SKILL_3, Skill.SKILL_4]:
@@ -195,7 +190,12 @@ class Strategy:
         if self._board_ai_result is not None:
             return self._board_ai_result
 
-        self._board_ai_result = self._context.board_ai.decide_best_result(self._context.game_state.board)
+        if self._context.board_solver_worker is not None:
+            self._board_ai_result = self._context.board_solver_worker.get_result(
+                self._context.game_state.board, deadline_ms=self.board_ai_deadline_ms)
+        else:
+            self._board_ai_result = self._context.board_ai.decide_best_result(
+                self._context.game_state.board, deadline_ms=self.board_ai_deadline_ms)
         return self._board_ai_result
 
     def _move_grids(self) -> Decision:
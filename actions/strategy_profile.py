@@ -0,0 +1,67 @@
+import configparser
+import os
+from typing import List
+from flow.game_state import Skill
+from board.scoring import BoardScoring
+
+profiles_path = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__), "strategy_profiles.ini"))
+
+
+class StrategyProfile:
+    # per-class skills and board scoring, from strategy_profiles.ini
+    __active: "StrategyProfile" = None
+
+    # decision routines of Strategy (_make_decision_*)
+    decisions = ["pvp", "shaman", "assassin"]
+
+    def __init__(self, name: str, config_section):
+        self.name = name
+        self.decision: str = config_section.get("decision", "assassin")
+        if self.decision not in StrategyProfile.decisions:
+            raise ValueError("unknown decision '{}' in strategy profile '{}'; expected one of {}".format(
+                self.decision, name, ", ".join(StrategyProfile.decisions)))
+        self.non_board_changing_skills = StrategyProfile.__parse_skills(config_section.get("non_board_changing_skills"))
+        self.board_changing_skills = StrategyProfile.__parse_skills(config_section.get("board_changing_skills"))
+        self.no_damage_skills = StrategyProfile.__parse_skills(config_section.get("no_damage_skills"))
+        self.stun_skills = StrategyProfile.__parse_skills(config_section.get("stun_skills"))
+        # latency budget of the board solver per turn; None to search until done
+        self.board_ai_deadline_ms: float = config_section.getfloat("board_ai_deadline_ms", None)
+        # see BoardAI; 0 rollouts to rank by the scoring alone
+        self.refill_rollouts: int = config_section.getint("refill_rollouts", 0)
+        self.refill_weight: float = config_section.getfloat("refill_weight", 0.5)
+
+        default_scoring = BoardScoring.default()
+        self.scoring = BoardScoring(
+            StrategyProfile.__parse_grid_weights(config_section.get("grid_weights")),
+            stun_weight=config_section.getfloat("stun_weight", default_scoring.stun_weight),
+            total_lock_weight=config_section.getfloat("total_lock_weight", default_scoring.total_lock_weight),
+            step_weight=config_section.getfloat("step_weight", default_scoring.step_weight),
+            stop_on_stun=config_section.getboolean("stop_on_stun", default_scoring.stop_on_stun))
+
+    def load(name: str = None, path: str = None) -> "StrategyProfile":
+        # name: section of the profile; None for the one selected in [general]
+        config = configparser.ConfigParser()
+        config.read(path or profiles_path)
+        if name is None:
+            name = config["general"]["profile"]
+        return StrategyProfile(name, config[name])
+
+    def get_active() -> "StrategyProfile":
+        # loaded once
+        if StrategyProfile.__active is None:
+            StrategyProfile.__active = StrategyProfile.load()
+            print("strategy profile: {}".format(StrategyProfile.__active.name))
+        return StrategyProfile.__active
+
+    def __parse_skills(s: str) -> List[Skill]:
+        skills = [Skill.SKILL_1, Skill.SKILL_2, Skill.SKILL_3, Skill.SKILL_4]
+        return [skills[int(item) - 1] for item in (s or "").split(",") if item.strip() != ""]
+
+    def __parse_grid_weights(s: str):
+        ret = dict()
+        for item in (s or "").split(","):
+            if item.strip() == "":
+                continue
+            (grid_str, weight) = item.split(":")
+            ret[grid_str.strip()] = float(weight)
+        return ret
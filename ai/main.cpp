@@ -1,4 +1,5 @@
 #include <iostream>
+#include <algorithm>
 #include <array>
 #include <map>
 #include <string>
@@ -0,0 +1,202 @@
+import copy
+import os
+import random
+import tempfile
+import time
+from board.board import Board
+from board.grid_types import GridTypes
+from board.ai import BoardAI
+from board.bitboard import cell_index
+from board.refill import RefillEvaluator
+from board.scoring import BoardScoring
+from board.solver_worker import BoardSolverWorker
+
+# compares the in-process solver with the ai/ai subprocess and the transposition table solver on random boards
+
+board_count = 30
+seed = 1
+deadline_ms_list = [10, 30, 100, 300]
+worker_counts = [1, 2, 4, 8]
+cache_lookups = 200
+cache_size = 16
+stable_delay_secs = 0.3  # from the first parse of a board until BoardStableChecker calls it stable
+deep_board_count = 8
+refill_check_rollouts = 20000  # to compare the choices with and without refill rollouts
+
+
+def make_random_boards(grid_types: GridTypes, count: int):
+    rand = random.Random(seed)
+    values = [grid_type.value for grid_type in grid_types.grid_types]
+
+    boards = []
+    with open(os.path.join(os.path.dirname(os.path.realpath(__file__)), "ai", "in")) as f:
+        boards.append(parse_board(grid_types, f.read().strip()))
+    while len(boards) < count:
+        grids = [[rand.choice(values) for y in range(5)] for x in range(7)]
+        board = Board.from_grids(grids, grid_types)
+        board.update_locks()
+        boards.append(board)
+    return boards
+
+
+def parse_board(grid_types: GridTypes, s: str) -> Board:
+    grids = [[0] * 5 for x in range(7)]
+    for y in range(5):
+        for x in range(7):
+            for grid_type in grid_types.grid_types:
+                if grid_type.short_str == s[y*7+x]:
+                    grids[x][y] = grid_type.value
+    board = Board.from_grids(grids, grid_types)
+    board.update_locks()
+    return board
+
+
+def run(name: str, ai: BoardAI, boards, deadline_ms: float = None):
+    results = []
+    solvers = []
+    elapsed = []
+    for board in boards:
+        ai.result_cache.clear()
+        start_time = time.time()
+        results.append(ai.decide_best_result(board, deadline_ms=deadline_ms))
+        elapsed.append(time.time() - start_time)
+        solvers.append(copy.copy(ai.last_solver))  # the parallel solver is reused between boards
+    elapsed.sort()
+    print("{}: mean {:.1f} ms, median {:.1f} ms, max {:.1f} ms per board".format(
+        name, sum(elapsed) / len(elapsed) * 1000, elapsed[len(elapsed) // 2] * 1000, elapsed[-1] * 1000))
+    return (results, solvers)
+
+
+def outcome(result, preferred_grid_value):
+    # comparable with ">", like ResultComparator: any stun, then preferred locks, total locks, fewer steps
+    if result.final_board_has_stun:
+        return (True, 0, 0, 0)
+    return (result.final_board_has_stun, result.final_board_lock_count_per_grid_type.get(preferred_grid_value, 0),
+            result.final_board_total_locks, -len(result.steps))
+
+
+def report_transposition_table(solvers):
+    nodes = sum(solver.nodes for solver in solvers)
+    secs = sum(solver.elapsed_secs for solver in solvers)
+    lookups = sum(solver.table_lookups for solver in solvers)
+    hits = sum(solver.table_hits for solver in solvers)
+    exhaustive = sum(1 for solver in solvers if solver.exhaustive)
+    print("  {} nodes, {:.0f} nodes/s, table hit rate {:.3f}, exhaustive on {}/{} boards".format(
+        nodes, nodes / max(secs, 1e-9), hits / max(lookups, 1), exhaustive, len(solvers)))
+
+
+if __name__ == "__main__":
+    grid_types = GridTypes()
+    boards = make_random_boards(grid_types, board_count)
+
+    preferred_grid_value = None
+    for grid_type in grid_types.grid_types:
+        if grid_type.short_str == BoardAI.preferred_grid_str:
+            preferred_grid_value = int(grid_type.value)
+
+    (in_process_results, _) = run("in-process solver", BoardAI(), boards)
+
+    if os.path.exists(BoardAI.ai_binary_path):
+        (subprocess_results, _) = run("subprocess ai/ai", BoardAI(use_subprocess=True), boards)
+        same = sum(1 for (lhs, rhs) in zip(in_process_results, subprocess_results) if list(lhs.steps) == list(rhs.steps))
+        print("same steps on {}/{} boards".format(same, len(boards)))
+    else:
+        print("{} not found; build it with ai/Makefile to compare".format(BoardAI.ai_binary_path))
+
+    (tt_results, tt_solvers) = run("transposition table solver", BoardAI(use_transposition_table=True), boards)
+    report_transposition_table(tt_solvers)
+    better = sum(1 for (tt, dfs) in zip(tt_results, in_process_results)
+                 if outcome(tt, preferred_grid_value) > outcome(dfs, preferred_grid_value))
+    worse = sum(1 for (tt, dfs) in zip(tt_results, in_process_results)
+                if outcome(tt, preferred_grid_value) < outcome(dfs, preferred_grid_value))
+    print("  better outcome than the in-process solver on {} boards, worse on {}".format(better, worse))
+
+    # the flow's BoardAI: the walker, ranking by the scoring instead of ResultComparator
+    (scored_results, _) = run("in-process solver ranked by scoring", BoardAI(rank_walker_by_scoring=True), boards)
+    scoring = BoardScoring.default().compile(grid_types)
+    score = lambda result: scoring.score_steps(result.final_board.bitboard, result.steps)
+    higher = sum(1 for (lhs, rhs) in zip(scored_results, in_process_results) if score(lhs) > score(rhs))
+    lower = sum(1 for (lhs, rhs) in zip(scored_results, in_process_results) if score(lhs) < score(rhs))
+    optimal = sum(1 for (result, tt) in zip(scored_results, tt_results) if abs(score(result) - score(tt)) < 1e-9)
+    print("  higher score than with ResultComparator on {} boards, lower on {} (stuns: every stun counts the same); "
+          "optimal score on {}/{} boards".format(higher, lower, optimal, len(boards)))
+
+    for deadline_ms in deadline_ms_list:
+        (results, solvers) = run("anytime solver, deadline {} ms".format(deadline_ms), BoardAI(), boards, deadline_ms)
+        report_transposition_table(solvers)
+        optimal = sum(1 for (result, tt) in zip(results, tt_results)
+                      if outcome(result, preferred_grid_value) == outcome(tt, preferred_grid_value))
+        print("  optimal outcome on {}/{} boards".format(optimal, len(boards)))
+
+    # parallel root split on the boards the single-process search takes longest on
+    order = sorted(range(len(boards)), key=lambda idx: -tt_solvers[idx].elapsed_secs)
+    deep_boards = [boards[idx] for idx in order[:deep_board_count]]
+    deep_steps = [tt_results[idx].steps for idx in order[:deep_board_count]]
+    print("parallel root split on the {} deepest boards, {} CPU cores:".format(len(deep_boards), os.cpu_count()))
+    base_secs = None
+    base_nodes = None
+    for workers in worker_counts:
+        ai = BoardAI(use_transposition_table=True, workers=workers)
+        ai.decide_best_result(deep_boards[-1])  # start the worker processes
+        start_time = time.time()
+        (results, solvers) = run("  {} workers".format(workers), ai, deep_boards)
+        secs = time.time() - start_time
+        ai.close()
+        nodes = sum(solver.nodes for solver in solvers)
+        if base_secs is None:
+            base_secs = secs
+            base_nodes = nodes
+        same = sum(1 for (result, steps) in zip(results, deep_steps) if list(result.steps) == list(steps))
+        # workers get each other's complete table entries between tasks; subtrees searched at the same time still
+        # repeat positions
+        print("    speedup {:.2f}x, {:.2f}x the nodes of one process, same steps on {}/{} boards".format(
+            base_secs / secs, nodes / base_nodes, same, len(deep_boards)))
+
+    # result cache on a stream of boards where recent boards come back, like after a skill fires
+    rand = random.Random(seed)
+    stream = [rand.choice(boards[:rand.randint(1, len(boards))]) for _ in range(cache_lookups)]
+    with tempfile.TemporaryDirectory() as folder:
+        db_path = os.path.join(folder, "results.sqlite")
+        for (name, ai) in [("no cache", BoardAI(cache_size=0)),
+                           ("LRU cache of {}".format(cache_size), BoardAI(cache_size=cache_size)),
+                           ("LRU cache of {} + SQLite, cold".format(cache_size), BoardAI(cache_size=cache_size, cache_db_path=db_path)),
+                           ("LRU cache of {} + SQLite, after restart".format(cache_size), BoardAI(cache_size=cache_size, cache_db_path=db_path))]:
+            start_time = time.time()
+            for board in stream:
+                ai.decide_best_result(board)
+            print("{}: {:.1f} ms per lookup; {}".format(
+                name, (time.time() - start_time) / len(stream) * 1000, ai.result_cache.get_stats()))
+            ai.close()
+
+    # speculative solving: the worker starts on the first parse, the strategy asks once the board is stable
+    worker = BoardSolverWorker(BoardAI(cache_size=0))
+    blocked = []
+    for board in boards:
+        worker.submit(board)
+        time.sleep(stable_delay_secs)
+        start_time = time.time()
+        worker.get_result(board)
+        blocked.append(time.time() - start_time)
+    print("speculative worker, {:.0f} ms until stable: strategy blocked {:.1f} ms mean, {:.1f} ms max; {}".format(
+        stable_delay_secs * 1000, sum(blocked) / len(blocked) * 1000, max(blocked) * 1000, worker.get_stats()))
+
+    # refill rollouts: expected score of the steps chosen with and without them, re-estimated with more rollouts
+    plain_ai = BoardAI(use_transposition_table=True, cache_size=0)
+    refill_ai = BoardAI(use_transposition_table=True, cache_size=0, refill_rollouts=2000)
+    (refill_results, _) = run("refill rollouts", refill_ai, boards)
+    check = RefillEvaluator(refill_ai.scoring, refill_ai.refill_evaluator.model, refill_check_rollouts, seed=seed)
+    changed = 0
+    gain = 0.0
+    for (board, refill_result) in zip(boards, refill_results):
+        plain_result = plain_ai.decide_best_result(board)
+        if list(plain_result.steps) == list(refill_result.steps):
+            continue
+        changed += 1
+        for (sign, steps) in [(1, refill_result.steps), (-1, plain_result.steps)]:
+            final_board = board.bitboard.update_locks()
+            for (x1, y1, x2, y2) in steps:
+                final_board = final_board.swap(cell_index(x1, y1), cell_index(x2, y2))
+            expected = refill_ai.scoring.score_steps(final_board, steps) + refill_ai.refill_weight * check.expected_score(final_board)
+            gain += sign * expected
+    print("  other steps on {}/{} boards, expected score +{:.2f} per changed board; {}".format(
+        changed, len(boards), gain / max(changed, 1), refill_ai.refill_evaluator.model.get_stats()))
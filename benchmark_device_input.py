@@ -0,0 +1,158 @@
+import socket
+import threading
+import time
+import xmlrpc.client
+from xmlrpc.server import SimpleXMLRPCRequestHandler, SimpleXMLRPCServer
+from device.monkey_runner_adaptor import MonkeyRunnerAdaptor
+
+# Input latency of a battle turn through MonkeyRunnerAdaptor, against a local stand-in for monkey_runner_target.py
+# that counts connections, calls and health checks instead of touching a device.
+# Compares the previous adaptor (a new ServerProxy per gesture, HTTP/1.0 target closing the connection after every
+# call and checking the device after it, one drag call per swap) with the keep-alive connection and run_gestures()
+# on a target that only checks the device on heartbeats.
+# Then counts the heartbeats while the input is busy and while it's idle, restarts the target under the adaptor, and
+# prints its metrics.
+
+port = 13729  # not the target's, MonkeyRunnerTargetRunner kills whatever listens there
+turns = 50
+swaps_per_turn = 5
+health_check_secs = 0.02  # time of device.getProperty("clock.realtime")
+heartbeat_interval_secs = 0.2
+
+
+class FakeTarget:
+    def __init__(self, check_every_call: bool):
+        # check_every_call: as perform_until_healthy() did
+        self.check_every_call = check_every_call
+        self.connections = 0
+        self.calls = 0
+        self.health_checks = 0
+
+    def is_healthy(self):
+        self.health_checks += 1
+        time.sleep(health_check_secs)
+        return True
+
+    def drag(self, x1, y1, x2, y2):
+        self.calls += 1
+        if self.check_every_call:
+            self.is_healthy()
+
+    def run_gestures(self, gestures):
+        self.calls += 1
+        for gesture in gestures:
+            time.sleep(gesture[-1])
+        return True
+
+    def heartbeat(self):
+        return (self.is_healthy(), 0)
+
+
+def start_server(target: FakeTarget, protocol_version: str) -> SimpleXMLRPCServer:
+    class RequestHandler(SimpleXMLRPCRequestHandler):
+        rpc_paths = ('/RPC2',)
+
+        def setup(self):
+            super().setup()
+            target.connections += 1
+            server.open_connections.append(self.connection)
+
+        def log_message(self, format, *args):
+            pass
+    RequestHandler.protocol_version = protocol_version
+
+    server = SimpleXMLRPCServer(("localhost", port), requestHandler=RequestHandler, allow_none=True, logRequests=False)
+    server.open_connections = []
+    server.handle_error = lambda request, client_address: None  # dropped connections in stop_server()
+    server.register_function(target.drag, "drag")
+    server.register_function(target.run_gestures, "run_gestures")
+    server.register_function(target.heartbeat, "heartbeat")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def stop_server(server: SimpleXMLRPCServer):
+    # as if the target died: drops the keep-alive connection it's serving
+    for connection in server.open_connections:
+        try:
+            connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    server.shutdown()
+    server.server_close()
+
+
+def get_drags():
+    return [(800 + 100 * idx, 300, 900 + 100 * idx, 300) for idx in range(swaps_per_turn)]
+
+
+def run_legacy(url: str):
+    for _ in range(turns):
+        for drag in get_drags():
+            xmlrpc.client.ServerProxy(url).drag(*drag)
+
+
+def run_persistent(adaptor: MonkeyRunnerAdaptor):
+    run_persistent_turns(adaptor, turns)
+    adaptor.close()  # stops its heartbeats
+
+
+def run_batched(adaptor: MonkeyRunnerAdaptor):
+    for _ in range(turns):
+        adaptor.run_gestures([("drag", *drag, 0.0) for drag in get_drags()])
+    adaptor.close()
+
+
+def measure(name: str, protocol_version: str, run):
+    target = FakeTarget(protocol_version == "HTTP/1.0")
+    server = start_server(target, protocol_version)
+    start_time = time.time()
+    run("http://localhost:{}".format(port))
+    elapsed = time.time() - start_time
+    stop_server(server)
+    print("{:24s} {:.2f} ms per turn; {:.1f} calls and {:.1f} health checks per turn, {} connections".format(
+        name, elapsed / turns * 1000, target.calls / turns, target.health_checks / turns, target.connections))
+
+
+def measure_heartbeats():
+    MonkeyRunnerAdaptor.heartbeat_interval_secs = heartbeat_interval_secs
+    target = FakeTarget(False)
+    server = start_server(target, "HTTP/1.1")
+    adaptor = MonkeyRunnerAdaptor("http://localhost:{}".format(port), start_target=False)
+    start_time = time.time()
+    while time.time() - start_time < heartbeat_interval_secs * 5.5:
+        run_persistent_turns(adaptor, 1)
+    print("busy {:.1f} secs: {} heartbeats".format(heartbeat_interval_secs * 5.5, target.health_checks))
+    health_checks = target.health_checks
+    time.sleep(heartbeat_interval_secs * 5.5)
+    print("idle {:.1f} secs: {} heartbeats".format(heartbeat_interval_secs * 5.5, target.health_checks - health_checks))
+
+    # the target goes away for a second; the next drag waits with backoff instead of spinning
+    stop_server(server)
+    threading.Timer(1.0, lambda: start_server(target, "HTTP/1.1")).start()
+    start_time = time.time()
+    adaptor.drag(800, 300, 900, 300)
+    print("drag during a 1 sec restart took {:.2f} secs".format(time.time() - start_time))
+    print("metrics: {}".format(adaptor.get_stats()))
+    adaptor.close()
+
+
+def run_persistent_turns(adaptor: MonkeyRunnerAdaptor, count: int):
+    for _ in range(count):
+        for drag in get_drags():
+            adaptor.drag(*drag)
+
+
+def main():
+    print("{} turns of {} swaps, health check {:.0f} ms, no pacing".format(
+        turns, swaps_per_turn, health_check_secs * 1000))
+    measure("previous adaptor", "HTTP/1.0", run_legacy)
+    measure("keep-alive, drag()", "HTTP/1.1",
+            lambda url: run_persistent(MonkeyRunnerAdaptor(url, start_target=False)))
+    measure("keep-alive, run_gestures", "HTTP/1.1",
+            lambda url: run_batched(MonkeyRunnerAdaptor(url, start_target=False)))
+    measure_heartbeats()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,14 @@
+import os
 import subprocess
+import threading
+import time
 from typing import Dict, List
+from board.bitboard import cell_index
 from board.board import Board
+from board.refill import RefillEvaluator, RefillModel
+from board.result_cache import ResultCache
+from board.scoring import BoardScoring
+from board.solver import BoardSolver, TranspositionSolver, ParallelSolver
 
 
 class Result:
@@ -11,54 +19,231 @@ class Result:
         self.final_board_lock_count_per_grid_type : Dict[int, int] = dict()
         self.final_board_total_locks : int = 0
 
+        # search metadata
+        self.exhaustive : bool = None  # None if unknown (subprocess)
+        self.search_depth : int = None  # depth limit of an anytime search; None if unlimited
+        self.elapsed_ms : float = 0.0
+        self.from_cache = False
+        self.cancelled = False  # search stopped by a CancelToken; steps may be far from the best
+        self.expected_refill_score : float = None  # of the board after the refill, if ranked with refill rollouts
+
     def calculate_final_board_stats(self):
         self.final_board_total_locks = self.final_board.total_locks()
         self.final_board_has_stun = self.has_stun(self.final_board)
 
-        for x in range(7):
-            for y in range(5):
-                if self.final_board.is_locked_nocheck(x, y):
-                    grid_type = int(self.final_board.grids[x,y])
-                    self.final_board_lock_count_per_grid_type[grid_type] = self.final_board_lock_count_per_grid_type.get(grid_type, 0) + 1
+        bitboard = self.final_board.bitboard
+        for grid_type in range(len(bitboard.masks)):
+            lock_count = bitboard.count_locks(grid_type)
+            if lock_count > 0:
+                self.final_board_lock_count_per_grid_type[grid_type] = lock_count
 
     def has_stun(self, board: Board):
-        for y in range(5):
-            all_same = True
-            grid_type = self.final_board.grids[0,y]
-            for x in range(7):
-                if self.final_board.grids[x,y] != grid_type:
-                    all_same = False
-                    break
-            if all_same:
-                return True
-        return False
+        return board.bitboard.has_stun()
+
+
+class CancelToken:
+    # Cancels one decide_best_result() call from another thread, through the solver of that call. A cancel that
+    # comes before the solver is created is applied when it's attached; the subprocess can't be cancelled.
+    def __init__(self):
+        self.cancelled = False
+        self.__solver = None
+        self.__lock = threading.Lock()
+
+    def cancel(self):
+        with self.__lock:
+            self.cancelled = True
+            if self.__solver is not None:
+                self.__solver.cancel()
+
+    def attach(self, solver):
+        with self.__lock:
+            self.__solver = solver
+            if self.cancelled:
+                solver.cancel()
 
     def __str__(self):
-        return "{} steps; {} locks; stun={}".format(len(self.steps), self.final_board.total_locks(), self.final_board_has_stun)
+        return "{} steps; {} locks; stun={}; exhaustive={}; {:.0f} ms".format(
+            len(self.steps), self.final_board.total_locks(), self.final_board_has_stun, self.exhaustive, self.elapsed_ms)
 
 class BoardAI:
-    ai_binary_path = "/Users/petershih/Documents/pq3-helper/ai/ai"
+    ai_binary_path = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__), "..", "ai", "ai"))
+    default_cache_db_path = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__), "..", "ai", "results.sqlite"))
 
-    def __init__(self):
-        self.last_board : Board = None
-        self.last_board_result : Result = None
+    # grid type preferred by the walker after stun (purple), same as ResultComparator in ai/main.cpp
+    preferred_grid_str = "P"
 
-    def decide_best_result(self, board: Board) -> Result:
-        if self.last_board is not None and self.last_board == board:
+    # refill rollouts: best steps per first swap to rank, and time to rank them (within the deadline, if any)
+    refill_candidates = 8
+    refill_time_budget_secs = 0.05
+
+    def __init__(self, use_subprocess=False, use_transposition_table=False, workers=1, cache_size=256, cache_db_path=None,
+                 scoring: BoardScoring = None, rank_walker_by_scoring=False, refill_rollouts=0, refill_weight=0.5):
+        # use_subprocess: run the ai/ai binary (build with ai/Makefile) instead of the in-process solver
+        # use_transposition_table: search every reachable position with TranspositionSolver instead of
+        #   the first 1000 results of the C++ walker
+        # workers: > 1 to split the transposition table search (and the anytime search) across processes
+        # cache_size, cache_db_path: see ResultCache
+        # scoring: ranks results of the transposition table and anytime searches; the walker and the subprocess
+        #   keep the ResultComparator ordering
+        # rank_walker_by_scoring: rank the walker's results by scoring too (see BoardSolver). The subprocess can't.
+        # refill_rollouts: > 0 to rank the best steps of the single-process transposition table and anytime searches
+        #   by their score plus refill_weight times the expected score after the refill (see RefillEvaluator),
+        #   sampled with this many rollouts per candidate from the grid frequencies of the boards solved so far
+        self.use_subprocess = use_subprocess
+        self.use_transposition_table = use_transposition_table
+        self.rank_walker_by_scoring = rank_walker_by_scoring
+        self.workers = workers
+        self.parallel_solver : ParallelSolver = None
+        self.last_solver = None
+        self.scoring = scoring or BoardScoring.default()
+        self.__compiled_scoring_for = None
+        self.refill_rollouts = refill_rollouts
+        self.refill_weight = refill_weight
+        self.refill_evaluator : RefillEvaluator = None
+
+        # results of the walker and of the scored searches differ, so they are cached apart
+        if use_transposition_table:
+            namespace = "scoring:{}".format(self.scoring.get_key())
+            if refill_rollouts > 0:
+                namespace += ":refill:{}".format(refill_weight)
+        elif rank_walker_by_scoring and not use_subprocess:
+            namespace = "walker:scoring:{}".format(self.scoring.get_key())
+        else:
+            namespace = "walker"
+        self.result_cache = ResultCache(cache_size, cache_db_path, namespace)
+
+    def decide_best_result(self, board: Board, deadline_ms: float = None, cancel_token: CancelToken = None) -> Result:
+        # deadline_ms: return the best result found within this time, using the anytime TranspositionSolver
+        # cancel_token: to make this call return early from another thread
+        start_time = time.time()
+        result = Result()
+
+        solution = self.result_cache.get(board.bitboard.grids)
+        if solution is not None and self._is_cacheable(solution[1], None):
             print("ai cache hit")
-            return self.last_board_result
+            (result.steps, result.exhaustive, result.search_depth) = solution
+            result.from_cache = True
+            result.elapsed_ms = (time.time() - start_time) * 1000
+            self._fill_detail_result(board, result)
+            return result
+
+        if self.refill_rollouts > 0:
+            self._get_refill_evaluator(board).model.observe(board.bitboard)
+
+        if deadline_ms is not None:
+            result.steps = self._solve_anytime(board, deadline_ms, cancel_token)
+            result.search_depth = self.last_solver.depth
+            result.exhaustive = self.last_solver.exhaustive
+        elif self.use_subprocess:
+            self.last_solver = None
+            result.steps = self._solve_with_subprocess(board)
+        else:
+            result.steps = self._solve_in_process(board, cancel_token)
+            result.exhaustive = self.last_solver.exhaustive
+        if self.refill_rollouts > 0 and isinstance(self.last_solver, TranspositionSolver) and not self.last_solver.cancelled:
+            time_budget_secs = self.refill_time_budget_secs
+            if deadline_ms is not None:
+                time_budget_secs = min(time_budget_secs, start_time + deadline_ms / 1000 - time.time())
+            (result.steps, result.expected_refill_score) = self._rank_with_refills(board, result.steps, time_budget_secs)
+        result.elapsed_ms = (time.time() - start_time) * 1000
+
+        self._fill_detail_result(board, result)
+        if self.last_solver is not None and self.last_solver.cancelled:
+            result.cancelled = True
+        elif self._is_cacheable(result.exhaustive, deadline_ms):
+            self.result_cache.put(board.bitboard.grids, (result.steps, result.exhaustive, result.search_depth))
 
+        return result
+
+    def _is_cacheable(self, exhaustive: bool, deadline_ms: float) -> bool:
+        # The scored searches stop at a deadline or at their node and time budget, so a non-exhaustive result depends
+        # on the load of the machine; only keep the exhaustive ones (older cache files may hold the others).
+        # The walker and the subprocess are deterministic, but a deadline search of a walker BoardAI ranks by scoring;
+        # don't mix it into the walker's namespace.
+        if self.use_transposition_table:
+            return exhaustive is True
+        return deadline_ms is None
+
+    def _solve_in_process(self, board: Board, cancel_token: CancelToken = None) -> List:
+        if self.use_transposition_table:
+            self.last_solver = self._get_transposition_solver(board)
+        elif self.rank_walker_by_scoring:
+            self.last_solver = BoardSolver(self._get_preferred_grid_value(board), self._get_scoring(board))
+        else:
+            self.last_solver = BoardSolver(self._get_preferred_grid_value(board))
+        if cancel_token is not None:
+            cancel_token.attach(self.last_solver)
+        return self.last_solver.solve(board)
+
+    def _solve_anytime(self, board: Board, deadline_ms: float, cancel_token: CancelToken = None) -> List:
+        self.last_solver = self._get_transposition_solver(board)
+        if cancel_token is not None:
+            cancel_token.attach(self.last_solver)
+        return self.last_solver.solve(board, deadline_secs=deadline_ms / 1000)
+
+    def _get_scoring(self, board: Board) -> BoardScoring:
+        if self.__compiled_scoring_for is not board.grid_types:
+            self.scoring.compile(board.grid_types)
+            self.__compiled_scoring_for = board.grid_types
+        return self.scoring
+
+    def _get_transposition_solver(self, board: Board):
+        self._get_scoring(board)
+        if self.workers <= 1:
+            return TranspositionSolver(self.scoring)
+
+        # keep the worker pool between boards; clear the cancel of the previous board before a CancelToken attaches
+        if self.parallel_solver is None:
+            self.parallel_solver = ParallelSolver(self.scoring, self.workers)
+        self.parallel_solver.cancelled = False
+        return self.parallel_solver
+
+    def _get_refill_evaluator(self, board: Board) -> RefillEvaluator:
+        if self.refill_evaluator is None:
+            model = RefillModel([int(grid_type.value) for grid_type in board.grid_types.grid_types])
+            self.refill_evaluator = RefillEvaluator(self.scoring, model, self.refill_rollouts)
+        return self.refill_evaluator
+
+    def _rank_with_refills(self, board: Board, steps: List, time_budget_secs: float):
+        # the stun ends the turn with the enemy stunned; keep it whatever the refill
+        if not steps or self.last_solver.stun_found:
+            return (steps, None)
+        candidates = []
+        for (score, candidate_steps) in self.last_solver.get_candidates(board, self.refill_candidates):
+            final_board = board.bitboard.update_locks()
+            for (x1, y1, x2, y2) in candidate_steps:
+                final_board = final_board.swap(cell_index(x1, y1), cell_index(x2, y2))
+            candidates.append((score, candidate_steps, final_board))
+        if not candidates:
+            return (steps, None)
+        ranked = self._get_refill_evaluator(board).rank(candidates, self.refill_weight, time_budget_secs)
+        (_, expected, best_steps) = ranked[0]
+        return (best_steps, expected)
+
+    def close(self):
+        if self.parallel_solver is not None:
+            self.parallel_solver.close()
+            self.parallel_solver = None
+        self.result_cache.close()
+
+    def _get_preferred_grid_value(self, board: Board) -> int:
+        for grid_type in board.grid_types.grid_types:
+            if grid_type.short_str == self.preferred_grid_str:
+                return int(grid_type.value)
+        return None
+
+    def _solve_with_subprocess(self, board: Board) -> List:
         proc = subprocess.Popen(self.ai_binary_path, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
 
         s = ""
         for y in range(5):
             for x in range(7):
-                s = s + board.grid_types.get_str(board.grids[x][y])
+                s = s + board.grid_types.get_str(board.get_grid(x, y))
 
         result_bytes = proc.communicate(bytearray(s.encode()))[0]
         result_str = result_bytes.decode("utf-8")
 
-        result = Result()
+        steps = []
         for step_str in result_str.split("\n"):
             step_list = step_str.split(" ")
             if len(step_list)<4:
@@ -67,16 +252,8 @@ class BoardAI:
             y1 = int(step_list[1])
             x2 = int(step_list[2])
             y2 = int(step_list[3])
-            result.steps.append((x1,y1,x2,y2))
-
-        self._fill_detail_result(board, result)
-        self._cache_result(board, result)
-
-        return result
-
-    def _cache_result(self, board: Board, result: Result) :
-        self.last_board = board
-        self.last_board_result = result
+            steps.append((x1,y1,x2,y2))
+        return steps
 
     def _fill_detail_result(self, board: Board, result: Result):
         result.final_board = board
@@ -18,23 +18,14 @@ class Result:
         self.final_board_total_locks = self.final_board.total_locks()
         self.final_board_has_stun = self.has_stun(self.final_board)
 
-        for x in range(7):
-            for y in range(5):
-                if self.final_board.is_locked_nocheck(x, y):
-                    grid_type = int(self.final_board.grids[x,y])
-                    self.final_board_lock_count_per_grid_type[grid_type] = self.final_board_lock_count_per_grid_type.get(grid_type, 0) + 1
+        bitboard = self.final_board.bitboard
+        for grid_type in range(len(bitboard.masks)):
+            lock_count = bitboard.count_locks(grid_type)
+            if lock_count > 0:
+                self.final_board_lock_count_per_grid_type[grid_type] = lock_count
 
     def has_stun(self, board: Board):
-        for y in range(5):
-            all_same = True
-            grid_type = self.final_board.grids[0,y]
-            for x in range(7):
-                if self.final_board.grids[x,y] != grid_type:
-                    all_same = False
-                    break
-            if all_same:
-                return True
-        return False
+        return board.bitboard.has_stun()
 
     def __str__(self):
         return "{} steps; {} locks; stun={}".format(len(self.steps), self.final_board.total_locks(), self.final_board_has_stun)
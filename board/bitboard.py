@@ -0,0 +1,169 @@
+from typing import Sequence, Tuple
+
+# Compact immutable board: one 35-bit mask per grid value plus a lock mask.
+#
+# Cell (x, y) is bit x*5+y, so a column is 5 consecutive bits and moving along a row is a shift by 5.
+# A run of 3 is found with shift-and-AND of a grid value's mask, masked to the cells a run can start at.
+
+x_grids = 7
+y_grids = 5
+cell_count = x_grids * y_grids
+all_cells = (1 << cell_count) - 1
+
+
+def cell_index(x: int, y: int) -> int:
+    return x * y_grids + y
+
+
+def __cells_mask(predicate) -> int:
+    mask = 0
+    for x in range(x_grids):
+        for y in range(y_grids):
+            if predicate(x, y):
+                mask |= 1 << cell_index(x, y)
+    return mask
+
+
+# cells a vertical (along y) / horizontal (along x) run of 3 can start at
+vertical_run_starts = __cells_mask(lambda x, y: y <= y_grids - 3)
+horizontal_run_starts = __cells_mask(lambda x, y: x <= x_grids - 3)
+
+# cells in the middle / at the end of a vertical or horizontal run of 3
+vertical_run_mids = __cells_mask(lambda x, y: 1 <= y <= y_grids - 2)
+vertical_run_ends = __cells_mask(lambda x, y: y >= 2)
+horizontal_run_mids = __cells_mask(lambda x, y: 1 <= x <= x_grids - 2)
+horizontal_run_ends = __cells_mask(lambda x, y: x >= 2)
+
+row_masks = [__cells_mask(lambda x, y, row=row: y == row) for row in range(y_grids)]
+
+
+def __build_cell_triples():
+    # masks of every 3 consecutive cells of a column or row, per cell they contain
+    triples = []
+    for start in range(cell_count):
+        if (vertical_run_starts >> start) & 1:
+            triples.append(0b111 << start)
+        if (horizontal_run_starts >> start) & 1:
+            triples.append((1 | (1 << y_grids) | (1 << (2 * y_grids))) << start)
+    return [tuple(triple for triple in triples if (triple >> i) & 1) for i in range(cell_count)]
+
+
+cell_triples = __build_cell_triples()
+
+
+def run_locks(mask: int) -> int:
+    # cells of mask in a vertical or horizontal run of 3 or more
+    v = mask & (mask >> 1) & (mask >> 2) & vertical_run_starts
+    h = mask & (mask >> y_grids) & (mask >> (2 * y_grids)) & horizontal_run_starts
+    return v | (v << 1) | (v << 2) | h | (h << y_grids) | (h << (2 * y_grids))
+
+
+def run_completions(mask: int) -> int:
+    # cells that would be in a run of 3 with two cells of mask, if they had the same value
+    v = (((mask >> 1) & (mask >> 2) & vertical_run_starts)
+         | ((mask << 1) & (mask >> 1) & vertical_run_mids)
+         | ((mask << 1) & (mask << 2) & vertical_run_ends))
+    h = (((mask >> y_grids) & (mask >> (2 * y_grids)) & horizontal_run_starts)
+         | ((mask << y_grids) & (mask >> y_grids) & horizontal_run_mids)
+         | ((mask << y_grids) & (mask << (2 * y_grids)) & horizontal_run_ends))
+    return v | h
+
+
+def swap_locks(mask_a: int, mask_b: int, i: int, j: int) -> int:
+    # cells locked by the runs through i (value b) and j (value a) after swapping them
+    locks = 0
+    for triple in cell_triples[i]:
+        if mask_b & triple == triple:
+            locks |= triple
+    for triple in cell_triples[j]:
+        if mask_a & triple == triple:
+            locks |= triple
+    return locks
+
+
+def popcount(mask: int) -> int:
+    return bin(mask).count("1")
+
+
+class BitBoard:
+    # grids: grid value per cell (index x*5+y), kept next to the masks for O(1) lookups.
+    # Equality and hashing only consider grids, like Board.__eq__ and the visited set of the C++ solver.
+    __slots__ = ("grids", "masks", "locks")
+
+    def __init__(self, grids: Tuple[int, ...], masks: Tuple[int, ...], locks: int):
+        self.grids = grids
+        self.masks = masks
+        self.locks = locks
+
+    def from_grids(grids: Sequence[int], lock_runs=True) -> "BitBoard":
+        # lock_runs: lock every run already on the board
+        grids = tuple(grids)
+        masks = [0] * (max(grids) + 1)
+        for (i, value) in enumerate(grids):
+            masks[value] |= 1 << i
+
+        locks = 0
+        if lock_runs:
+            for mask in masks:
+                locks |= run_locks(mask)
+        return BitBoard(grids, tuple(masks), locks)
+
+    def __hash__(self):
+        return hash(self.grids)
+
+    def __eq__(self, other):
+        return isinstance(other, BitBoard) and self.grids == other.grids
+
+    def with_locks(self, locks: int) -> "BitBoard":
+        return BitBoard(self.grids, self.masks, self.locks | locks)
+
+    def update_locks(self) -> "BitBoard":
+        locks = 0
+        for mask in self.masks:
+            locks |= run_locks(mask)
+        return self.with_locks(locks)
+
+    def is_locked(self, i: int) -> bool:
+        return (self.locks >> i) & 1 == 1
+
+    def swap(self, i: int, j: int) -> "BitBoard":
+        # None if either cell is locked or the swap doesn't lock either of them
+        pair_mask = (1 << i) | (1 << j)
+        if self.locks & pair_mask:
+            return None
+
+        a = self.grids[i]
+        b = self.grids[j]
+        if a == b:
+            return None
+
+        # a new run has to go through one of the swapped cells: b moved to i, a moved to j
+        mask_a = self.masks[a] ^ pair_mask
+        mask_b = self.masks[b] ^ pair_mask
+        new_locks = swap_locks(mask_a, mask_b, i, j)
+        if not new_locks:
+            return None
+
+        grids = list(self.grids)
+        grids[i] = b
+        grids[j] = a
+        masks = list(self.masks)
+        masks[a] = mask_a
+        masks[b] = mask_b
+        return BitBoard(tuple(grids), tuple(masks), self.locks | new_locks)
+
+    def total_locks(self) -> int:
+        return popcount(self.locks)
+
+    def count_locks(self, value: int) -> int:
+        if value >= len(self.masks):
+            return 0
+        return popcount(self.masks[value] & self.locks)
+
+    def has_stun(self) -> bool:
+        # a whole row of the same grid value
+        for row_mask in row_masks:
+            for mask in self.masks:
+                if mask & row_mask == row_mask:
+                    return True
+        return False
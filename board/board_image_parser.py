@@ -1,10 +1,11 @@
-from typing import Tuple
+from typing import List, Tuple
 import cv2
 import math
 import os
 import time
 import numpy
 from board.grid_types import GridTypes, GridType
+from board.grid_feature_classifier import GridFeatureClassifier
 from board.board import Board
 
 x_grids = 7
@@ -64,6 +65,78 @@ def compare_grid_image(img, grid_types: GridTypes) -> Tuple[GridType, float]:
     
     return (min_grid_type, min_score)
 
+class BatchGridClassifier:
+    # Scores all cells against all grid type images in one pass; same result as compare_grid_image().
+    #
+    # TM_SQDIFF_NORMED is (sum(I^2) - 2*sum(I*T) + sum(T^2)) / sqrt(sum(I^2)*sum(T^2)). The cross term of
+    # every cell/seed/offset is a product of FFT spectrums, transformed back only at the valid offsets;
+    # sum(I^2) of every window comes from an integral image.
+    seed_size = 80
+    img_size = 90
+
+    # cells scored per batch; bounds the (freq y, freq x, cell, seed) spectrum product to ~30MB
+    cells_per_batch = 7
+
+    def __init__(self, grid_types: GridTypes):
+        self.seed_grid_types: List[GridType] = list()
+        seeds = []
+        for grid_type in grid_types.grid_types:
+            for grid_img in grid_type.images:
+                seeds.append(cv_roi_center(grid_img, self.seed_size, self.seed_size))
+                self.seed_grid_types.append(grid_type)
+
+        n = self.img_size
+        seeds = numpy.stack(seeds).astype(numpy.float64)
+        self.seed_sq_sums = numpy.sum(seeds ** 2, axis=(1, 2, 3))
+        seed_spectrums = numpy.conj(numpy.fft.rfft2(seeds, s=(n, n), axes=(1, 2)))
+        self.seed_spectrums = seed_spectrums.transpose(1, 2, 3, 0).copy()  # (freq y, freq x, channel, seed)
+
+        # inverse real DFT evaluated only at the valid offsets, one matrix per axis
+        offsets = numpy.arange(n - self.seed_size + 1)
+        freqs_y = numpy.arange(n)
+        freqs_x = numpy.arange(n // 2 + 1)
+        weights_x = numpy.full(len(freqs_x), 2.0)
+        weights_x[0] = 1.0
+        if n % 2 == 0:
+            weights_x[-1] = 1.0
+        self.inverse_y = numpy.exp(2j * numpy.pi * numpy.outer(offsets, freqs_y) / n) / n
+        self.inverse_x = numpy.exp(2j * numpy.pi * numpy.outer(freqs_x, offsets) / n) * weights_x[:, None] / n
+
+    def classify(self, img_grids) -> List[Tuple[GridType, float]]:
+        imgs = numpy.stack([cv_roi_center(img, self.img_size, self.img_size) for img in img_grids]).astype(numpy.float64)
+        scores = numpy.concatenate([
+            self.__score(imgs[i:i+self.cells_per_batch])
+            for i in range(0, len(imgs), self.cells_per_batch)])
+
+        ret = []
+        for cell_scores in scores:
+            seed_idx = int(numpy.argmin(cell_scores))
+            ret.append((self.seed_grid_types[seed_idx], float(cell_scores[seed_idx])))
+        return ret
+
+    def __score(self, imgs):
+        # (cells, seeds) min TM_SQDIFF_NORMED over all offsets
+        spectrums = numpy.fft.rfft2(imgs, axes=(1, 2)).transpose(1, 2, 0, 3)  # (freq y, freq x, cell, channel)
+        cross = numpy.matmul(spectrums, self.seed_spectrums)  # (freq y, freq x, cell, seed)
+        corr = numpy.tensordot(self.inverse_y, cross, axes=(1, 0))
+        corr = numpy.real(numpy.tensordot(corr, self.inverse_x, axes=(1, 0)))
+        corr = corr.transpose(1, 2, 0, 3)  # (cell, seed, offset y, offset x)
+
+        k = self.seed_size
+        integral = numpy.cumsum(numpy.cumsum(numpy.sum(imgs ** 2, axis=3), axis=1), axis=2)
+        integral = numpy.pad(integral, ((0, 0), (1, 0), (1, 0)))
+        img_sq_sums = integral[:, k:, k:] - integral[:, :-k, k:] - integral[:, k:, :-k] + integral[:, :-k, :-k]
+
+        img_sq_sums = img_sq_sums[:, None, :, :]
+        seed_sq_sums = self.seed_sq_sums[None, :, None, None]
+        sq_diff = img_sq_sums - 2 * corr + seed_sq_sums
+        norm = numpy.sqrt(img_sq_sums * seed_sq_sums)
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            # like OpenCV, scores are capped at 1 (also when the window or seed is all black)
+            scores = numpy.where(sq_diff < norm, sq_diff / norm, 1.0)
+        return numpy.min(numpy.maximum(scores, 0.0), axis=(2, 3))
+
+
 class HpParser:
     x1 = 1752
     y1 = 976
@@ -98,34 +171,110 @@ class HpParser:
 
 class BoardImageParser:
     grid_types = GridTypes()
+    grid_classifier = BatchGridClassifier(grid_types)
+
+    # cells the feature classifier is less confident about, or that are far from every known grid, are template
+    # matched instead. On the sample screenshots 0.75 keeps 97% of the cells of recognizable boards, and no
+    # misclassified one.
+    feature_min_confidence = 0.3
+    feature_max_distance = 0.75
+
+    # incremental mode: cells whose center differs less than this (mean abs pixel diff) from the
+    # image they were last classified on keep their cached grid type and score
+    cell_change_threshold = 8.0
+    cell_change_size = 90
+
+    def __init__(self, use_feature_classifier=False, incremental=False):
+        self.feature_classifier: GridFeatureClassifier = None
+        if use_feature_classifier:
+            self.feature_classifier = GridFeatureClassifier.load()
+
+        self.incremental = incremental
+        self.__cached_cell_imgs = None
+        self.__cached_classified = None
 
     def parse(self, board_img, report=True) -> Board:
         start_time = time.time()
 
-        ret = Board()
-        ret.grid_types = self.grid_types
+        parse_score = None
+        grids = numpy.zeros((7, 5))
 
-        for x_idx in range(7):
-            for y_idx in range(5):
-                (x, y, w, h) = get_grid_rect(x_idx, y_idx)
-                img_grid = cv_roi(board_img, x, y, w, h)
+        cells = [(x_idx, y_idx) for x_idx in range(7) for y_idx in range(5)]
+        img_grids = [cv_roi(board_img, *get_grid_rect(x_idx, y_idx)) for (x_idx, y_idx) in cells]
 
-                (grid_type, score) = compare_grid_image(img_grid, self.grid_types)
+        changed = self.__get_changed_cells(img_grids)
+        classified = self.__update_cache(img_grids, changed)
 
-                if ret.parse_score is None:
-                    ret.parse_score = score
-                else:
-                    ret.parse_score = max(ret.parse_score, score)
+        for (idx, ((x_idx, y_idx), img_grid, (grid_type, score))) in enumerate(zip(cells, img_grids, classified)):
+            if parse_score is None:
+                parse_score = score
+            else:
+                parse_score = max(parse_score, score)
 
-                ret.grids[x_idx, y_idx] = grid_type.value
-                if report:
-                    self.__report_grid_parse_result(img_grid, grid_type, score)
+            grids[x_idx, y_idx] = grid_type.value
+            if report and idx in changed:
+                self.__report_grid_parse_result(img_grid, grid_type, score)
 
-        print("BoardImageParser.parse() took {:.2f} seconds".format(time.time()-start_time))
+        print("BoardImageParser.parse() took {:.3f} seconds; {} cells classified".format(
+            time.time()-start_time, len(changed)))
 
+        ret = Board.from_grids(grids, self.grid_types)
+        ret.parse_score = parse_score
         ret.update_locks()
         return ret
 
+    def reset(self):
+        self.__cached_cell_imgs = None
+        self.__cached_classified = None
+
+    def __get_changed_cells(self, img_grids) -> List[int]:
+        if not self.incremental or self.__cached_cell_imgs is None:
+            return list(range(len(img_grids)))
+
+        changed = []
+        for (idx, img_grid) in enumerate(img_grids):
+            img = cv_roi_center(img_grid, self.cell_change_size, self.cell_change_size)
+            diff = cv2.mean(cv2.absdiff(img, self.__cached_cell_imgs[idx]))
+            if max(diff[:3]) > self.cell_change_threshold:
+                changed.append(idx)
+        return changed
+
+    def __update_cache(self, img_grids, changed: List[int]) -> List[Tuple[GridType, float]]:
+        if len(changed) == len(img_grids):
+            classified = self.__classify(img_grids)
+        else:
+            classified = list(self.__cached_classified)
+            if changed:
+                for (idx, result) in zip(changed, self.__classify([img_grids[idx] for idx in changed])):
+                    classified[idx] = result
+
+        if self.incremental:
+            if self.__cached_cell_imgs is None:
+                self.__cached_cell_imgs = [None] * len(img_grids)
+            for idx in changed:
+                self.__cached_cell_imgs[idx] = numpy.copy(
+                    cv_roi_center(img_grids[idx], self.cell_change_size, self.cell_change_size))
+            self.__cached_classified = classified
+        return classified
+
+    def __classify(self, img_grids) -> List[Tuple[GridType, float]]:
+        if self.feature_classifier is None:
+            return self.grid_classifier.classify(img_grids)
+
+        # classified cells are scored by their distance, estimated as a template matching score
+        ret = [None] * len(img_grids)
+        fallback = []
+        for (idx, (grid_value, confidence, distance)) in enumerate(self.feature_classifier.classify(img_grids)):
+            if confidence >= self.feature_min_confidence and distance <= self.feature_max_distance:
+                ret[idx] = (self.grid_types.get_grid_type(grid_value), self.feature_classifier.get_score(distance))
+            else:
+                fallback.append(idx)
+
+        if fallback:
+            for (idx, result) in zip(fallback, self.grid_classifier.classify([img_grids[idx] for idx in fallback])):
+                ret[idx] = result
+        return ret
+
     def __report_grid_parse_result(self, img_grid, grid_type: GridType, score):
         if score > 0.05:
             grid_type.record_image(img_grid, score)
\ No newline at end of file
@@ -0,0 +1,106 @@
+import os
+from typing import Dict, List, Tuple
+import cv2
+import numpy
+from board.grid_types import GridTypes, GridType
+
+
+def cv_roi_center(img, w, h):
+    (img_h, img_w) = img.shape[:2]
+    x = int((img_w-w)/2)
+    y = int((img_h-h)/2)
+    return img[y:y+h, x:x+w]
+
+
+class GridFeatureClassifier:
+    # k-NN on HSV histograms of the grid center, trained offline from the grid type folders.
+    #
+    # confidence compares the distance to the best class with the distance to the runner-up class:
+    # 1 - d_best / d_second, so 0 means "as close to another gem type" and 1 means an exact match.
+    # The distance itself tells how far the image is from every known grid; score_per_distance maps it to an
+    # estimated TM_SQDIFF_NORMED score, calibrated against template matching by train_grid_classifier.py.
+
+    model_path = os.path.realpath(os.path.join(
+        os.getcwd(), os.path.dirname(__file__), "grid_types", "classifier.npz"))
+
+    img_size = 80
+    hist_bins = [12, 4, 4]
+    k = 3
+
+    default_score_per_distance = 0.047
+
+    def __init__(self, features=None, labels=None, score_per_distance=None):
+        self.features = features
+        self.labels = labels
+        self.score_per_distance = score_per_distance or self.default_score_per_distance
+
+    def extract_features(img):
+        img = cv_roi_center(img, GridFeatureClassifier.img_size, GridFeatureClassifier.img_size)
+        hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+        hist = cv2.calcHist([hsv], [0, 1, 2], None, GridFeatureClassifier.hist_bins, [0, 180, 0, 256, 0, 256])
+        hist = hist.flatten()
+        # Hellinger distance becomes euclidean on square roots of the normalized histogram
+        return numpy.sqrt(hist / max(hist.sum(), 1)).astype(numpy.float32)
+
+    def train(grid_types: GridTypes, include_recorded=True) -> "GridFeatureClassifier":
+        features = []
+        labels = []
+        for grid_type in grid_types.grid_types:
+            imgs = list(grid_type.images)
+            if include_recorded:
+                imgs += GridFeatureClassifier.__load_recorded_images(grid_type)
+            for img in imgs:
+                features.append(GridFeatureClassifier.extract_features(img))
+                labels.append(grid_type.value)
+        return GridFeatureClassifier(numpy.stack(features), numpy.array(labels, dtype=numpy.float32))
+
+    def __load_recorded_images(grid_type: GridType) -> List:
+        # crops dumped by GridType.record_image(), labeled by the type they were recorded under
+        folder = os.path.realpath(os.path.join(grid_type.folder_path, "../dataset", grid_type.name))
+        if not os.path.isdir(folder):
+            return []
+        return [cv2.imread(os.path.join(folder, filename)) for filename in sorted(os.listdir(folder))
+                if filename[-4:] == ".bmp"]
+
+    def save(self, path=None):
+        numpy.savez_compressed(path or self.model_path, features=self.features, labels=self.labels,
+                               score_per_distance=self.score_per_distance)
+
+    def load(path=None) -> "GridFeatureClassifier":
+        data = numpy.load(path or GridFeatureClassifier.model_path)
+        score_per_distance = float(data["score_per_distance"]) if "score_per_distance" in data else None
+        return GridFeatureClassifier(data["features"], data["labels"], score_per_distance)
+
+    def get_score(self, distance: float) -> float:
+        # estimated template matching score of an image at this distance
+        return distance * self.score_per_distance
+
+    def classify(self, img_grids) -> List[Tuple[float, float, float]]:
+        # (grid value, confidence, distance) per image
+        features = numpy.stack([GridFeatureClassifier.extract_features(img) for img in img_grids])
+        return self.classify_features(features)
+
+    def classify_features(self, features, exclude=None) -> List[Tuple[float, float, float]]:
+        # exclude: optional training sample index per query, skipped (for leave-one-out evaluation)
+        distances = numpy.sqrt(numpy.maximum(
+            numpy.sum(features ** 2, axis=1)[:, None]
+            - 2 * features @ self.features.T
+            + numpy.sum(self.features ** 2, axis=1)[None, :], 0))
+        if exclude is not None:
+            distances[numpy.arange(len(features)), exclude] = numpy.inf
+
+        values = numpy.unique(self.labels)
+        ret = []
+        for row in distances:
+            # mean distance of the k nearest samples per class
+            class_distances = []
+            for value in values:
+                nearest = numpy.sort(row[self.labels == value])[:self.k]
+                nearest = nearest[numpy.isfinite(nearest)]
+                class_distances.append(numpy.mean(nearest) if len(nearest) > 0 else numpy.inf)
+            order = numpy.argsort(class_distances)
+            best = class_distances[order[0]]
+            second = class_distances[order[1]] if len(order) > 1 else numpy.inf
+            confidence = 1.0 - best / second if second > 0 else 0.0
+            ret.append((float(values[order[0]]), float(confidence), float(best)))
+        return ret
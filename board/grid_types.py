@@ -57,6 +57,12 @@ class GridTypes:
         print(len(ret.images))
         return ret
 
+    def get_grid_type(self, grid_value: float) -> GridType:
+        for grid_type in self.grid_types:
+            if grid_type.value == grid_value:
+                return grid_type
+        return None
+
     def get_str(self, grid_value: float):
         for grid_type in self.grid_types:
             if grid_type.value == grid_value:
@@ -0,0 +1,113 @@
+import time
+from typing import List, Sequence, Tuple
+import numpy
+from board.bitboard import BitBoard, popcount, x_grids, y_grids
+from board.scoring import BoardScoring
+
+
+class RefillModel:
+    # Grid value frequencies of the boards seen so far, the distribution new grids are sampled from.
+    # Starts uniform: every grid value counts once.
+
+    def __init__(self, values: Sequence[int]):
+        self.values = numpy.array(values, dtype=numpy.int8)
+        self.counts = numpy.ones(len(values), dtype=numpy.int64)
+        self.boards_observed = 0
+
+    def observe(self, board: BitBoard):
+        for (idx, value) in enumerate(self.values):
+            if value < len(board.masks):
+                self.counts[idx] += popcount(board.masks[value])
+        self.boards_observed += 1
+
+    def get_probabilities(self) -> numpy.ndarray:
+        return self.counts / self.counts.sum()
+
+    def get_stats(self) -> str:
+        return "{} boards observed, frequencies {}".format(self.boards_observed, " ".join(
+            "{}:{:.3f}".format(value, p) for (value, p) in zip(self.values, self.get_probabilities())))
+
+
+class RefillEvaluator:
+    # Expected score of the board the next turn starts with, by sampling refills of the locked grids.
+    #
+    # Assumes locked grids clear at the end of the turn, the grids above fall down (y grows downward) and new grids
+    # drop in at the top, drawn from RefillModel. Runs formed by the refill lock right away and count with scoring,
+    # like the locks of the turn itself. Rollouts of one board run as a batch of numpy arrays.
+
+    batch_size = 256
+
+    def __init__(self, scoring: BoardScoring, model: RefillModel, rollouts=2000, seed=None):
+        # scoring: compiled, see BoardScoring.compile()
+        # rollouts: per candidate
+        self.scoring = scoring
+        self.model = model
+        self.rollouts = rollouts
+        self.random = numpy.random.default_rng(seed)
+
+        # stats of the last rank()
+        self.rollouts_done = 0
+        self.elapsed_secs = 0.0
+
+    def rank(self, candidates: Sequence[Tuple[float, List, BitBoard]], refill_weight: float, time_budget_secs: float) \
+            -> List[Tuple[float, float, List]]:
+        # candidates: (score, steps, final board); returns (score + refill_weight * expected refill score,
+        # expected refill score, steps), best first. Rollouts go round-robin over the candidates, a batch at a time,
+        # until each got self.rollouts or time_budget_secs runs out.
+        start_time = time.time()
+        sums = [0.0] * len(candidates)
+        counts = [0] * len(candidates)
+        layouts = [self.__get_layout(board) for (_, _, board) in candidates]
+        while True:
+            for (idx, layout) in enumerate(layouts):
+                batch = min(self.batch_size, self.rollouts - counts[idx])
+                if batch > 0:
+                    sums[idx] += self.__rollout(layout, batch).sum()
+                    counts[idx] += batch
+            if min(counts, default=self.rollouts) >= self.rollouts or time.time() - start_time > time_budget_secs:
+                break
+
+        ranked = []
+        for ((score, steps, _), total, count) in zip(candidates, sums, counts):
+            expected = total / max(count, 1)
+            ranked.append((score + refill_weight * expected, expected, steps))
+        ranked.sort(key=lambda candidate: -candidate[0])  # stable: equal values keep the order of candidates
+        self.rollouts_done = sum(counts)
+        self.elapsed_secs = time.time() - start_time
+        return ranked
+
+    def expected_score(self, board: BitBoard) -> float:
+        return float(self.__rollout(self.__get_layout(board), self.rollouts).mean())
+
+    def __get_layout(self, board: BitBoard):
+        # (grids after the fall with -1 for new grids, mask of the new grids), as (x, y) arrays
+        grids = numpy.full((x_grids, y_grids), -1, dtype=numpy.int8)
+        for x in range(x_grids):
+            kept = [board.grids[x * y_grids + y] for y in range(y_grids) if not (board.locks >> (x * y_grids + y)) & 1]
+            grids[x, y_grids - len(kept):] = kept
+        return (grids, grids < 0)
+
+    def __rollout(self, layout, count: int) -> numpy.ndarray:
+        (grids, refilled) = layout
+        boards = numpy.broadcast_to(grids, (count, x_grids, y_grids)).copy()
+        boards[:, refilled] = self.random.choice(
+            self.model.values, size=(count, int(refilled.sum())), p=self.model.get_probabilities())
+
+        # runs of 3 along y, then along x
+        locked = numpy.zeros(boards.shape, dtype=bool)
+        run = (boards[:, :, :-2] == boards[:, :, 1:-1]) & (boards[:, :, 1:-1] == boards[:, :, 2:])
+        locked[:, :, :-2] |= run
+        locked[:, :, 1:-1] |= run
+        locked[:, :, 2:] |= run
+        run = (boards[:, :-2, :] == boards[:, 1:-1, :]) & (boards[:, 1:-1, :] == boards[:, 2:, :])
+        locked[:, :-2, :] |= run
+        locked[:, 1:-1, :] |= run
+        locked[:, 2:, :] |= run
+
+        scoring = self.scoring
+        scores = scoring.total_lock_weight * locked.sum(axis=(1, 2), dtype=numpy.float64)
+        for (value, weight) in scoring.value_weights:
+            scores += weight * (locked & (boards == value)).sum(axis=(1, 2))
+        stun = (boards[:, 1:, :] == boards[:, :-1, :]).all(axis=1).any(axis=1)
+        scores += scoring.stun_weight * stun
+        return scores
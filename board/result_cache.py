@@ -0,0 +1,107 @@
+import collections
+import json
+import os
+import sqlite3
+from typing import List, Optional, Tuple
+
+# (steps, exhaustive, search_depth) of a solved board; BoardAI rebuilds the Result by replaying the steps
+Solution = Tuple[List[Tuple[int, int, int, int]], Optional[bool], Optional[int]]
+
+
+class ResultCache:
+    # LRU of solved boards keyed by their grids, optionally backed by a SQLite file that survives restarts.
+    # Memory misses fall through to the file; every put() is written through to it.
+
+    def __init__(self, capacity=256, db_path=None, namespace=""):
+        # capacity: boards kept in memory; 0 disables caching
+        # db_path: SQLite file; None to keep the cache in memory only
+        # namespace: keeps apart the results of solvers ranking boards differently in the same file
+        self.capacity = capacity
+        self.db_path = db_path
+        self.namespace = namespace
+        self.__entries = collections.OrderedDict()
+        self.__db: sqlite3.Connection = None
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, grids: Tuple[int, ...]) -> Optional[Solution]:
+        if self.capacity <= 0:
+            return None
+
+        solution = self.__entries.get(grids)
+        if solution is not None:
+            self.__entries.move_to_end(grids)
+            self.hits += 1
+            return solution
+
+        solution = self.__load(grids)
+        if solution is not None:
+            self.disk_hits += 1
+            self.__insert(grids, solution)
+            return solution
+
+        self.misses += 1
+        return None
+
+    def put(self, grids: Tuple[int, ...], solution: Solution):
+        if self.capacity <= 0:
+            return
+        self.__insert(grids, solution)
+        self.__store(grids, solution)
+
+    def clear(self):
+        # memory only; the file keeps its entries
+        self.__entries.clear()
+
+    def get_stats(self) -> str:
+        lookups = self.hits + self.disk_hits + self.misses
+        return "{} hits, {} disk hits, {} misses, {} evictions, hit rate {:.3f}, {} boards in memory".format(
+            self.hits, self.disk_hits, self.misses, self.evictions,
+            (self.hits + self.disk_hits) / max(lookups, 1), len(self.__entries))
+
+    def close(self):
+        if self.__db is not None:
+            self.__db.close()
+            self.__db = None
+
+    def __insert(self, grids, solution: Solution):
+        self.__entries[grids] = solution
+        self.__entries.move_to_end(grids)
+        while len(self.__entries) > self.capacity:
+            self.__entries.popitem(last=False)
+            self.evictions += 1
+
+    def __get_db(self) -> sqlite3.Connection:
+        # opened on first use, from the thread calling get() and put() (BoardSolverWorker's); sqlite3 connections
+        # can't be shared between threads
+        if self.__db is None and self.db_path is not None:
+            os.makedirs(os.path.dirname(os.path.realpath(self.db_path)), exist_ok=True)
+            self.__db = sqlite3.connect(self.db_path)
+            self.__db.execute("CREATE TABLE IF NOT EXISTS solutions "
+                              "(namespace TEXT, grids TEXT, solution TEXT, PRIMARY KEY (namespace, grids))")
+        return self.__db
+
+    def __load(self, grids) -> Optional[Solution]:
+        db = self.__get_db()
+        if db is None:
+            return None
+        row = db.execute("SELECT solution FROM solutions WHERE namespace = ? AND grids = ?",
+                         (self.namespace, self.__db_key(grids))).fetchone()
+        if row is None:
+            return None
+        (steps, exhaustive, search_depth) = json.loads(row[0])
+        return ([tuple(step) for step in steps], exhaustive, search_depth)
+
+    def __store(self, grids, solution: Solution):
+        db = self.__get_db()
+        if db is None:
+            return
+        db.execute("INSERT OR REPLACE INTO solutions VALUES (?, ?, ?)",
+                   (self.namespace, self.__db_key(grids), json.dumps(solution)))
+        db.commit()
+
+    def __db_key(self, grids) -> str:
+        return ",".join(str(value) for value in grids)
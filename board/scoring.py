@@ -0,0 +1,57 @@
+from typing import Dict, List, Tuple
+from board.bitboard import BitBoard, popcount
+from board.grid_types import GridTypes
+
+
+class BoardScoring:
+    # Scores the board a search ends on, higher is better:
+    #   stun_weight if a row is all the same grid type
+    #   + per locked cell: total_lock_weight + grid_weights[its grid type]
+    #   + step_weight per step
+    #
+    # default() ranks like ResultComparator in ai/main.cpp: stun, then purple locks, then total locks, then fewer
+    # steps (35 cells, so 36 purple-weight units beat any total, and 35 steps cost less than one lock).
+
+    def __init__(self, grid_weights: Dict[str, float], stun_weight=10000.0, total_lock_weight=1.0,
+                 step_weight=-1.0 / 36, stop_on_stun=True):
+        # grid_weights: by grid type short string, e.g. {"P": 36}
+        # stop_on_stun: end the search at the first stun found, like ResultComparator treating all stuns as equal
+        self.grid_weights = grid_weights
+        self.stun_weight = stun_weight
+        self.total_lock_weight = total_lock_weight
+        self.step_weight = step_weight
+        self.stop_on_stun = stop_on_stun
+
+        # compile(): (grid value, weight) of grid types with an extra weight
+        self.value_weights: Tuple[Tuple[int, float], ...] = None
+
+    def default() -> "BoardScoring":
+        return BoardScoring({"P": 36.0})
+
+    def get_key(self) -> Tuple:
+        return (tuple(sorted(self.grid_weights.items())), self.stun_weight, self.total_lock_weight, self.step_weight,
+                self.stop_on_stun)
+
+    def compile(self, grid_types: GridTypes) -> "BoardScoring":
+        value_weights = []
+        for grid_type in grid_types.grid_types:
+            weight = self.grid_weights.get(grid_type.short_str, 0.0)
+            if weight != 0.0:
+                value_weights.append((int(grid_type.value), weight))
+        self.value_weights = tuple(value_weights)
+        return self
+
+    def score(self, board: BitBoard) -> float:
+        # without steps; the search adds step_weight per step
+        locks = board.locks
+        score = self.total_lock_weight * popcount(locks)
+        masks = board.masks
+        for (value, weight) in self.value_weights:
+            if value < len(masks):
+                score += weight * popcount(masks[value] & locks)
+        if board.has_stun():
+            score += self.stun_weight
+        return score
+
+    def score_steps(self, board: BitBoard, steps: List) -> float:
+        return self.score(board) + self.step_weight * len(steps)
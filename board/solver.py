@@ -0,0 +1,664 @@
+import itertools
+import multiprocessing
+import multiprocessing.connection
+import random
+import time
+from collections import deque
+from typing import List, Tuple
+from board.board import Board
+from board.scoring import BoardScoring
+from board.bitboard import BitBoard, x_grids, y_grids, cell_count, cell_index, cell_triples, run_completions
+
+# In-process port of the DFS in ai/main.cpp (BoardDfsWalker + ResultComparator).
+#
+# Walks BitBoards, trying the swaps in the same order as the C++ walker, so both return the same steps.
+
+# same order as BoardDfsWalker::swappable_directions_
+swap_directions = [(0, 1), (1, -1), (1, 0), (1, 1)]
+
+
+def __build_swaps():
+    # (x1, y1, x2, y2, cell 1, cell 2, mask of both cells) of every swap the walker tries, in order
+    ret = []
+    for x in range(x_grids):
+        for y in range(y_grids):
+            for (dx, dy) in swap_directions:
+                if not (0 <= x+dx < x_grids and 0 <= y+dy < y_grids):
+                    continue
+                i = cell_index(x, y)
+                j = cell_index(x+dx, y+dy)
+                ret.append((x, y, x+dx, y+dy, i, j, (1 << i) | (1 << j)))
+    return ret
+
+
+swaps = __build_swaps()
+
+
+class SolverResult:
+    def __init__(self, board: BitBoard, steps: List, preferred_grid_value: int):
+        self.steps = steps
+        self.has_stun = board.has_stun()
+        self.preferred_locks = board.count_locks(preferred_grid_value) if preferred_grid_value is not None else 0
+        self.total_locks = board.total_locks()
+
+    def is_better_than(self, other: "SolverResult") -> bool:
+        # ResultComparator: stun, then locks of the preferred grid type, then total locks, then fewer steps
+        if self.has_stun:
+            return True
+        if other.has_stun:
+            return False
+        if self.preferred_locks != other.preferred_locks:
+            return self.preferred_locks > other.preferred_locks
+        if self.total_locks != other.total_locks:
+            return self.total_locks > other.total_locks
+        return len(self.steps) < len(other.steps)
+
+
+class BoardSolver:
+    # same early-exit as the C++ walker
+    max_results = 1000
+
+    def __init__(self, preferred_grid_value: int, scoring: BoardScoring = None):
+        # scoring: compiled; ranks the results by score instead of ResultComparator, a later result replacing the best
+        #   one only if it scores higher. With stop_on_stun the walk ends at the first stun, like TranspositionSolver.
+        self.preferred_grid_value = preferred_grid_value
+        self.scoring = scoring
+        self.__visited = set()
+        self.__steps = []
+        self.__results = 0
+        self.__best: SolverResult = None
+        self.__best_score = None  # with scoring
+        self.exhaustive = True
+        self.stun_found = False
+        self.cancelled = False
+
+    def solve(self, board: Board) -> List[Tuple[int, int, int, int]]:
+        self.__visited = set()
+        self.__steps = []
+        self.__results = 0
+        self.__best = None
+        self.__best_score = None
+        self.stun_found = False
+
+        root = board.bitboard.update_locks()
+        root_hash = zobrist_grids_hash(root.grids)
+        self.__visited.add(root_hash)
+        self.__dfs(root.grids, root.masks, root.locks, root_hash, [swap_candidates(mask) for mask in root.masks])
+        self.exhaustive = self.__results <= self.max_results and not self.cancelled
+        return self.__best.steps if self.__best is not None else []
+
+    def cancel(self):
+        # from another thread: stop the running solve() soon; it returns the best steps so far
+        self.cancelled = True
+
+    def __dfs(self, grids: Tuple[int, ...], masks: Tuple[int, ...], locks: int, h: int, value_candidates: List):
+        # h: Zobrist hash of grids, the key of the visited set. The position is already in it: children are checked
+        # before they are built, since most of them were reached before through other swap orders.
+        # value_candidates: swap_candidates() of each mask; a swap only changes two of them
+        if self.__results > self.max_results or self.cancelled or self.stun_found:
+            return
+
+        down = up_right = right = down_right = 0
+        for candidates in value_candidates:
+            down |= candidates[0]
+            up_right |= candidates[1]
+            right |= candidates[2]
+            down_right |= candidates[3]
+        candidates = (down & ~(locks | (locks >> 1)) & walker_swap_starts[0],
+                      up_right & ~(locks | (locks >> 4)) & walker_swap_starts[1],
+                      right & ~(locks | (locks >> 5)) & walker_swap_starts[2],
+                      down_right & ~(locks | (locks >> 6)) & walker_swap_starts[3])
+        # swap indexes of walker_swaps_at sort like the walker's swap order
+        swap_indexes = []
+        for (direction, candidate) in enumerate(candidates):
+            while candidate:
+                low = candidate & -candidate
+                candidate ^= low
+                swap_indexes.append(((low.bit_length() - 1) << 2) | direction)
+        swap_indexes.sort()
+
+        any_swappable = False
+        visited = self.__visited
+        steps = self.__steps
+        for swap_index in swap_indexes:
+            (step, i, j, pair_mask, triples_i, triples_j) = walker_swaps_at[swap_index]
+            a = grids[i]
+            b = grids[j]
+            if a == b:
+                continue
+
+            mask_b = masks[b] ^ pair_mask
+            new_locks = 0
+            for triple in triples_i:
+                if mask_b & triple == triple:
+                    new_locks |= triple
+            mask_a = masks[a] ^ pair_mask
+            for triple in triples_j:
+                if mask_a & triple == triple:
+                    new_locks |= triple
+            if not new_locks:
+                continue
+
+            any_swappable = True
+            keys_i = zobrist_grid_keys[i]
+            keys_j = zobrist_grid_keys[j]
+            child_hash = h ^ keys_i[a] ^ keys_i[b] ^ keys_j[b] ^ keys_j[a]
+            if child_hash in visited:
+                continue
+            visited.add(child_hash)
+
+            swapped_grids = list(grids)
+            swapped_grids[i] = b
+            swapped_grids[j] = a
+            swapped_masks = list(masks)
+            swapped_masks[a] = mask_a
+            swapped_masks[b] = mask_b
+            child_candidates = list(value_candidates)
+            child_candidates[a] = swap_candidates(mask_a)
+            child_candidates[b] = swap_candidates(mask_b)
+            steps.append(step)
+            self.__dfs(tuple(swapped_grids), tuple(swapped_masks), locks | new_locks, child_hash, child_candidates)
+            steps.pop()
+
+        if not any_swappable:
+            self.__results += 1
+            board = BitBoard(grids, masks, locks)
+            if self.scoring is not None:
+                score = self.scoring.score_steps(board, steps)
+                if self.__best_score is None or score > self.__best_score:
+                    self.__best_score = score
+                    self.__best = SolverResult(board, list(steps), self.preferred_grid_value)
+                if self.scoring.stop_on_stun and board.has_stun():
+                    self.stun_found = True
+                return
+            # like std::min_element, a later result replaces the best one only if it compares smaller
+            result = SolverResult(board, list(steps), self.preferred_grid_value)
+            if self.__best is None or result.is_better_than(self.__best):
+                self.__best = result
+
+
+def swap_candidates(mask: int) -> Tuple[int, int, int, int]:
+    # Per swap direction of swap_directions (cell offsets 1, 4, 5, 6 = dx * y_grids + dy): the cells a swap starting
+    # there may make a run of mask's value with, moving the value next to two cells of it. Only these swaps can lock
+    # anything; BoardSolver checks them exactly.
+    # fewer than 3 cells of a value can't make a run
+    two_off = mask & (mask - 1)
+    if not two_off & (two_off - 1):
+        return no_swap_candidates
+    completion = run_completions(mask) & ~mask
+    return ((completion & (mask >> 1)) | (mask & (completion >> 1)),
+            (completion & (mask >> 4)) | (mask & (completion >> 4)),
+            (completion & (mask >> 5)) | (mask & (completion >> 5)),
+            (completion & (mask >> 6)) | (mask & (completion >> 6)))
+
+
+no_swap_candidates = (0, 0, 0, 0)
+
+
+def __build_walker_swaps():
+    # at cell * 4 + swap direction: (step, cell 1, cell 2, mask of both cells, triples through cell 1, triples through
+    # cell 2), or None off the board; per direction: cells a swap can start at
+    swaps_at = [None] * (cell_count * len(swap_directions))
+    starts = [0] * len(swap_directions)
+    for (x1, y1, x2, y2, i, j, pair_mask) in swaps:
+        direction = swap_directions.index((x2 - x1, y2 - y1))
+        swaps_at[(i << 2) | direction] = ((x1, y1, x2, y2), i, j, pair_mask, cell_triples[i], cell_triples[j])
+        starts[direction] |= 1 << i
+    return (swaps_at, starts)
+
+
+(walker_swaps_at, walker_swap_starts) = __build_walker_swaps()
+
+
+# Zobrist keys: one per (cell, grid value) and one per locked cell. Fixed seed so hashes are reproducible.
+max_grid_value = 15
+
+
+def __build_zobrist_keys():
+    rand = random.Random(3)
+    grid_keys = [[rand.getrandbits(64) for value in range(max_grid_value + 1)] for i in range(x_grids * y_grids)]
+    lock_keys = [rand.getrandbits(64) for i in range(x_grids * y_grids)]
+    return (grid_keys, lock_keys)
+
+
+(zobrist_grid_keys, zobrist_lock_keys) = __build_zobrist_keys()
+
+
+def zobrist_grids_hash(grids: Tuple[int, ...]) -> int:
+    h = 0
+    for (i, value) in enumerate(grids):
+        h ^= zobrist_grid_keys[i][value]
+    return h
+
+
+def zobrist_hash(board: BitBoard) -> int:
+    h = 0
+    for (i, value) in enumerate(board.grids):
+        h ^= zobrist_grid_keys[i][value]
+        if (board.locks >> i) & 1:
+            h ^= zobrist_lock_keys[i]
+    return h
+
+
+def zobrist_locks(locks: int) -> int:
+    h = 0
+    while locks:
+        bit = locks & -locks
+        h ^= zobrist_lock_keys[bit.bit_length() - 1]
+        locks ^= bit
+    return h
+
+
+class TranspositionSolver:
+    # Searches the positions reachable by swaps, memoizing per position (grids + locks, keyed by Zobrist hash) the best
+    # outcome reachable from it and the swap leading there. Steps are rebuilt by walking the table from the root.
+    # Outcomes are BoardScoring scores; with stop_on_stun the search ends at the first stun it finds.
+    #
+    # Without a deadline it searches every position in one pass. With a deadline it is an anytime search: iterative
+    # deepening, where positions at the depth limit are scored as if the search stopped there, keeping the steps of the
+    # deepest finished iteration. exhaustive tells whether every reachable position was searched, or the search ended at
+    # a stun without running out of budget. Only entries of fully searched positions are complete.
+    #
+    # Table entries: (outcome, swap index or None, searched depth or None if unlimited, complete).
+    #
+    # There's no branch-and-bound: no cheap upper bound on the outcome cuts here. A free cell only moves as the partner
+    # of a swap locking some other run, so bounds counting the free cells of each grid type that could still complete
+    # a run, or a stun row, stay 1 to 4 purple locks above the exact outcome on most positions.
+
+    max_nodes = 2000000
+    time_budget_secs = 5.0
+
+    def __init__(self, scoring: BoardScoring, max_nodes: int = None, time_budget_secs: float = None):
+        # scoring: compiled for the grid types of the boards to solve
+        self.scoring = scoring
+        self.__step_weight = scoring.step_weight
+        if max_nodes is not None:
+            self.max_nodes = max_nodes
+        if time_budget_secs is not None:
+            self.time_budget_secs = time_budget_secs
+
+        self.__table = dict()
+        self.__deadline = 0.0
+        self.__out_of_budget = False
+
+        # stats of the last solve()
+        self.stun_found = False
+        self.nodes = 0
+        self.table_lookups = 0
+        self.table_hits = 0
+        self.exhaustive = True
+        self.depth = None  # depth limit of the returned steps; None if unlimited
+        self.value = None  # outcome of the returned steps
+        self.elapsed_secs = 0.0
+        self.cancelled = False
+
+    def cancel(self):
+        # from another thread: stop the running solve() soon, like running out of time
+        self.cancelled = True
+
+    def solve(self, board: Board, deadline_secs: float = None) -> List[Tuple[int, int, int, int]]:
+        # deadline_secs: seconds from now to return the best steps found so far
+        return self.solve_bitboard(board.bitboard.update_locks(), deadline_secs)
+
+    def solve_bitboard(self, root: BitBoard, deadline_secs: float = None,
+                       keep_table=False) -> List[Tuple[int, int, int, int]]:
+        # keep_table: reuse the positions searched by the previous call, e.g. for sibling subtrees of the same board.
+        #   Only valid with the same scoring and no deadline in either call.
+        start_time = time.time()
+        if not keep_table:
+            self.__table = dict()
+        self.__deadline = start_time + (self.time_budget_secs if deadline_secs is None else deadline_secs)
+        self.__out_of_budget = False
+        self.stun_found = False
+        self.nodes = 0
+        self.table_lookups = 0
+        self.table_hits = 0
+
+        root_hash = zobrist_hash(root)
+
+        if deadline_secs is None:
+            depth_limits = [None]
+        else:
+            depth_limits = range(1, x_grids * y_grids + 1)
+
+        steps = None
+        best = None
+        self.depth = 0
+        for depth_limit in depth_limits:
+            (value, complete) = self.__search(root, root_hash, depth_limit)
+            # an interrupted iteration still found real steps; keep them only if they are better
+            if best is None or value > best:
+                best = value
+                steps = self.__best_steps(root, root_hash)
+                self.depth = depth_limit
+            if complete or self.__out_of_budget or self.stun_found:
+                break
+
+        self.value = best
+        # a search that ended at a stun within its budget returns what it always will, like an exhaustive one
+        self.exhaustive = self.__table[root_hash][3] or (self.stun_found and not self.__out_of_budget)
+        self.elapsed_secs = time.time() - start_time
+        return steps
+
+    def get_candidates(self, board: Board, count: int) -> List[Tuple[float, List[Tuple[int, int, int, int]]]]:
+        # (outcome, steps) of the best steps starting with each swap the last solve() of board searched, best first
+        root = board.bitboard.update_locks()
+        candidates = []
+        for (x1, y1, x2, y2, i, j, pair_mask) in swaps:
+            child = root.swap(i, j)
+            if child is None:
+                continue
+            child_hash = zobrist_hash(child)
+            entry = self.__table.get(child_hash)
+            if entry is None:
+                continue
+            steps = [(x1, y1, x2, y2)] + self.__best_steps(child, child_hash)
+            candidates.append((entry[0] + self.__step_weight, steps))
+        candidates.sort(key=lambda candidate: -candidate[0])  # stable: equal outcomes keep the swap order
+        return candidates[:count]
+
+    def get_table_size(self) -> int:
+        return len(self.__table)
+
+    def get_complete_entries(self, start: int = 0) -> List[Tuple[int, Tuple]]:
+        # (hash, entry) of the complete entries added after the first start ones, e.g. to share with other searches of
+        # the same board
+        return [(h, entry) for (h, entry) in itertools.islice(self.__table.items(), start, None) if entry[3]]
+
+    def add_entries(self, entries: List[Tuple[int, Tuple]]):
+        # complete entries of another search of the same board and scoring; entries already here are kept
+        table = self.__table
+        for (h, entry) in entries:
+            if h not in table:
+                table[h] = entry
+
+    def get_report(self) -> str:
+        return "{} nodes in {:.3f} s ({:.0f} nodes/s), table size {}, table hit rate {:.3f}, depth {}, exhaustive={}".format(
+            self.nodes, self.elapsed_secs, self.nodes / max(self.elapsed_secs, 1e-9), len(self.__table),
+            self.table_hits / max(self.table_lookups, 1), self.depth, self.exhaustive)
+
+    def evaluate(self, board: BitBoard) -> float:
+        # outcome of stopping at this board
+        return self.scoring.score(board)
+
+    def __search(self, board: BitBoard, h: int, depth: int):
+        # depth: swaps left to search from here; None if unlimited. Returns (outcome, complete).
+        self.nodes += 1
+        if self.nodes > self.max_nodes or self.cancelled or (self.nodes & 63 == 0 and time.time() > self.__deadline):
+            self.__out_of_budget = True
+
+        if self.scoring.stop_on_stun and board.has_stun():
+            # a stun row is locked, so it stays; every stun counts the same, the first one ends the search
+            self.stun_found = True
+            best = self.evaluate(board)
+            self.__table[h] = (best, None, depth, True)
+            return (best, True)
+
+        if depth == 0 or self.__out_of_budget:
+            best = self.evaluate(board)
+            self.__table[h] = (best, None, 0, False)
+            return (best, False)
+
+        child_depth = None if depth is None else depth - 1
+        best = None
+        best_swap = None
+        complete = True
+        table = self.__table
+        locks = board.locks
+        grids = board.grids
+        masks = board.masks
+        for (swap_idx, (x1, y1, x2, y2, i, j, pair_mask)) in enumerate(swaps):
+            # same as BitBoard.swap(), inlined
+            if locks & pair_mask:
+                continue
+            a = grids[i]
+            b = grids[j]
+            if a == b:
+                continue
+
+            mask_a = masks[a] ^ pair_mask
+            mask_b = masks[b] ^ pair_mask
+            new_locks = 0
+            for triple in cell_triples[i]:
+                if mask_b & triple == triple:
+                    new_locks |= triple
+            for triple in cell_triples[j]:
+                if mask_a & triple == triple:
+                    new_locks |= triple
+            if not new_locks:
+                continue
+
+            child_hash = (h ^ zobrist_grid_keys[i][a] ^ zobrist_grid_keys[i][b]
+                          ^ zobrist_grid_keys[j][b] ^ zobrist_grid_keys[j][a] ^ zobrist_locks(new_locks & ~locks))
+            self.table_lookups += 1
+            entry = table.get(child_hash)
+            if entry is not None and (entry[3] or (child_depth is not None and entry[2] is not None and entry[2] >= child_depth)):
+                self.table_hits += 1
+                (child_value, child_complete) = (entry[0], entry[3])
+            else:
+                swapped_grids = list(grids)
+                swapped_grids[i] = b
+                swapped_grids[j] = a
+                swapped_masks = list(masks)
+                swapped_masks[a] = mask_a
+                swapped_masks[b] = mask_b
+                (child_value, child_complete) = self.__search(
+                    BitBoard(tuple(swapped_grids), tuple(swapped_masks), locks | new_locks), child_hash, child_depth)
+
+            complete = complete and child_complete
+            value = child_value + self.__step_weight
+            if best is None or value > best:
+                best = value
+                best_swap = swap_idx
+
+            if self.__out_of_budget:
+                complete = False
+                break
+            if self.stun_found:
+                # the swaps after this one weren't searched; one of them may reach a stun in fewer steps
+                if swap_idx < len(swaps) - 1:
+                    complete = False
+                break
+
+        if best is None:
+            best = self.evaluate(board)
+        table[h] = (best, best_swap, depth, complete)
+        return (best, complete)
+
+    def __best_steps(self, board: BitBoard, h: int) -> List[Tuple[int, int, int, int]]:
+        steps = []
+        while True:
+            entry = self.__table.get(h)
+            if entry is None or entry[1] is None:
+                return steps
+            (x1, y1, x2, y2, i, j, pair_mask) = swaps[entry[1]]
+            steps.append((x1, y1, x2, y2))
+            board = board.swap(i, j)
+            h = zobrist_hash(board)
+
+
+def run_parallel_worker(conn):
+    # main of a ParallelSolver worker process: solves the root swaps the parent sends until it sends None.
+    # Subtrees of the same board reuse the table, and with it the complete entries other workers found.
+    key = None
+    solver: TranspositionSolver = None
+    while True:
+        task = conn.recv()
+        if task is None:
+            return
+        (scoring, grids, locks, swap_idx, deadline_at, entries) = task
+
+        # a deadline search keeps depth limited entries, so it starts from an empty table
+        task_key = (scoring.get_key(), grids, locks) if deadline_at is None else None
+        if task_key is None or task_key != key:
+            solver = TranspositionSolver(scoring)
+        key = task_key
+        solver.add_entries(entries)
+        conn.send(solve_root_swap(solver, grids, locks, swap_idx, deadline_at))
+
+
+def solve_root_swap(solver: TranspositionSolver, grids: Tuple[int, ...], locks: int, swap_idx: int,
+                    deadline_at: float = None):
+    # best outcome and steps after the root swap, or None if it can't be swapped; with the complete table entries
+    # the search added, to share with the other workers
+    masks = [0] * (max(grids) + 1)
+    for (i, value) in enumerate(grids):
+        masks[value] |= 1 << i
+    root = BitBoard(grids, tuple(masks), locks)
+
+    (x1, y1, x2, y2, i, j, pair_mask) = swaps[swap_idx]
+    child = root.swap(i, j)
+    if child is None:
+        return None
+
+    table_size = solver.get_table_size()
+    deadline_secs = None if deadline_at is None else max(deadline_at - time.time(), 0.001)
+    steps = solver.solve_bitboard(child, deadline_secs, keep_table=True)
+    value = solver.value + solver.scoring.step_weight
+    stats = (solver.nodes, solver.table_lookups, solver.table_hits, solver.exhaustive, solver.stun_found)
+    entries = solver.get_complete_entries(table_size) if deadline_at is None else []
+    return (value, [(x1, y1, x2, y2)] + steps, stats, entries)
+
+
+class ParallelSolver:
+    # TranspositionSolver with the root swaps split across worker processes (threads would share the GIL).
+    # Root swaps go out in order, one to each idle worker. The complete table entries a subtree search adds are
+    # merged here and sent along with the next task of every other worker, so sibling subtrees don't search the
+    # positions another worker already finished. Results reduce with the same ordering as TranspositionSolver, ties
+    # going to the earlier root swap, and the first subtree with a stun wins with stop_on_stun, so both return the
+    # same steps when the search is exhaustive. With stop_on_stun, which stun a subtree finds first also depends on
+    # what its table already holds, so equally scored stuns may come back with other steps.
+    #
+    # The workers are started on first use and kept; call close() to stop them.
+
+    # how often a waiting solve() checks for cancel()
+    cancel_poll_secs = 0.01
+
+    def __init__(self, scoring: BoardScoring, workers: int):
+        self.scoring = scoring
+        self.workers = workers
+        self.__conns = []
+        self.__processes = []
+        self.__in_flight = dict()  # connection -> root swap index, of tasks sent and not received yet
+
+        # stats of the last solve()
+        self.nodes = 0
+        self.table_lookups = 0
+        self.table_hits = 0
+        self.shared_entries = 0
+        self.exhaustive = True
+        self.depth = None
+        self.value = None
+        self.stun_found = False
+        self.elapsed_secs = 0.0
+        self.cancelled = False
+
+    def cancel(self):
+        # from another thread: make solve() return the best steps of the finished root swaps; running ones finish in
+        # the background
+        self.cancelled = True
+
+    def solve(self, board: Board, deadline_secs: float = None) -> List[Tuple[int, int, int, int]]:
+        # cancelled is not cleared here, so a cancel() right before solve() isn't lost; reset it between boards
+        start_time = time.time()
+        self.__start_workers()
+        self.__drain()
+
+        root = board.bitboard.update_locks()
+        self.value = self.scoring.score(root)
+        if self.scoring.stop_on_stun and root.has_stun():
+            self.elapsed_secs = time.time() - start_time
+            return []
+
+        deadline_at = None if deadline_secs is None else start_time + deadline_secs
+        pending = deque(swap_idx for (swap_idx, swap) in enumerate(swaps) if not root.locks & swap[6])
+        results = dict()
+        entries = []  # complete table entries of this board, in the order they were merged
+        known = set()
+        # per worker: how many of entries it has, and the ones of other workers merged before its own
+        seen = dict((conn, 0) for conn in self.__conns)
+        unseen = dict((conn, []) for conn in self.__conns)
+
+        def send(conn):
+            if self.cancelled or not pending:
+                return
+            swap_idx = pending.popleft()
+            conn.send((self.scoring, root.grids, root.locks, swap_idx, deadline_at,
+                       unseen[conn] + entries[seen[conn]:]))
+            unseen[conn] = []
+            seen[conn] = len(entries)
+            self.__in_flight[conn] = swap_idx
+
+        for conn in self.__conns:
+            send(conn)
+        while self.__in_flight and not self.cancelled:
+            for conn in multiprocessing.connection.wait(list(self.__in_flight), self.cancel_poll_secs):
+                ret = conn.recv()
+                results[self.__in_flight.pop(conn)] = ret
+                if ret is not None:
+                    # the worker has its own entries; the other workers get them with their next task
+                    unseen[conn] += entries[seen[conn]:]
+                    for (h, entry) in ret[3]:
+                        if h not in known:
+                            known.add(h)
+                            entries.append((h, entry))
+                    seen[conn] = len(entries)
+                    if ret[2][4]:
+                        pending.clear()  # later subtrees lose to this stun
+                send(conn)
+
+        self.nodes = 1
+        self.table_lookups = 0
+        self.table_hits = 0
+        self.shared_entries = len(entries)
+        self.exhaustive = not pending and not self.__in_flight
+        self.stun_found = False
+        best = None
+        steps = []
+        for swap_idx in sorted(results):
+            ret = results[swap_idx]
+            if ret is None:
+                continue
+            (value, child_steps, (nodes, table_lookups, table_hits, exhaustive, stun_found), _) = ret
+            self.nodes += nodes
+            self.table_lookups += table_lookups + 1
+            self.table_hits += table_hits
+            self.exhaustive = self.exhaustive and exhaustive
+            if best is None or value > best:
+                best = value
+                steps = child_steps
+            if stun_found:
+                # the single-process search would have stopped in this subtree
+                self.stun_found = True
+                break
+
+        if best is None:
+            best = self.scoring.score(root)
+        self.value = best
+        self.elapsed_secs = time.time() - start_time
+        return steps
+
+    def close(self):
+        self.__drain()
+        for conn in self.__conns:
+            conn.send(None)
+        for process in self.__processes:
+            process.join()
+        self.__conns = []
+        self.__processes = []
+
+    def __start_workers(self):
+        if self.__processes:
+            return
+        for _ in range(self.workers):
+            (parent_conn, child_conn) = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=run_parallel_worker, args=(child_conn,), daemon=True)
+            process.start()
+            self.__conns.append(parent_conn)
+            self.__processes.append(process)
+
+    def __drain(self):
+        # results of tasks still running when a cancelled solve() returned
+        for conn in list(self.__in_flight):
+            conn.recv()
+        self.__in_flight.clear()
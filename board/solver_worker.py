@@ -0,0 +1,107 @@
+import threading
+import time
+from typing import Optional
+from board.ai import BoardAI, CancelToken, Result
+from board.board import Board
+
+
+class SolverJob:
+    def __init__(self, board: Board, deadline_ms: float = None):
+        self.board = board
+        self.deadline_ms = deadline_ms
+        self.result: Result = None
+        self.error: Exception = None
+        self.cancel_token = CancelToken()
+        self.done = threading.Event()
+
+    def is_for(self, board: Board, deadline_ms: float) -> bool:
+        # a finished search without a deadline is at least as good as one with any deadline
+        if self.board != board:
+            return False
+        return self.deadline_ms == deadline_ms or (self.deadline_ms is None and self.done.is_set())
+
+
+class BoardSolverWorker:
+    # Solves boards on a background thread so a result is usually ready by the time the strategy asks for it.
+    #
+    # submit() as soon as a board is parsed; a new board, or another deadline, cancels the job of the previous one.
+    # get_result() returns the finished result, or waits for it. All BoardAI calls happen on the worker thread, so
+    # its result cache (and its SQLite connection) stay on one thread.
+
+    def __init__(self, board_ai: BoardAI):
+        self.board_ai = board_ai
+        self.__condition = threading.Condition()
+        self.__job: SolverJob = None
+        self.__pending: SolverJob = None
+        self.__thread: threading.Thread = None
+
+        self.submitted = 0
+        self.cancelled = 0
+        self.ready_hits = 0  # get_result() found the result already computed
+        self.waits = 0
+        self.wait_secs = 0.0
+
+    def submit(self, board: Board, deadline_ms: float = None) -> SolverJob:
+        with self.__condition:
+            job = self.__pending or self.__job
+            usable = job is not None and not job.cancel_token.cancelled and (
+                not job.done.is_set() or job.result is not None)
+            if usable and job.is_for(board, deadline_ms):
+                return job
+
+            for stale_job in [self.__pending, self.__job]:
+                if stale_job is not None and not stale_job.done.is_set() and not stale_job.cancel_token.cancelled:
+                    stale_job.cancel_token.cancel()
+                    self.cancelled += 1
+
+            self.__pending = SolverJob(board, deadline_ms)
+            self.submitted += 1
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__run, name="BoardSolverWorker", daemon=True)
+                self.__thread.start()
+            self.__condition.notify()
+            return self.__pending
+
+    def get_result(self, board: Board, deadline_ms: float = None) -> Result:
+        # a job submitted with another deadline is solved again with this one
+        while True:
+            job = self.submit(board, deadline_ms)
+            if job.done.is_set() and job.result is not None:
+                self.ready_hits += 1
+                return job.result
+
+            start_time = time.time()
+            job.done.wait()
+            self.waits += 1
+            self.wait_secs += time.time() - start_time
+            if job.error is not None:
+                raise job.error
+            if job.result is not None:
+                return job.result
+
+    def get_stats(self) -> str:
+        return "{} submitted, {} cancelled, {} ready, {} waited ({:.1f} ms on average)".format(
+            self.submitted, self.cancelled, self.ready_hits, self.waits, self.wait_secs / max(self.waits, 1) * 1000)
+
+    def __run(self):
+        while True:
+            with self.__condition:
+                while self.__pending is None:
+                    self.__condition.wait()
+                job = self.__pending
+                self.__pending = None
+                self.__job = job
+
+            result: Optional[Result] = None
+            try:
+                if not job.cancel_token.cancelled:
+                    result = self.board_ai.decide_best_result(
+                        job.board, deadline_ms=job.deadline_ms, cancel_token=job.cancel_token)
+            except Exception as e:
+                print("BoardSolverWorker: solving failed: {}".format(e))
+                job.error = e
+
+            with self.__condition:
+                if result is not None and not job.cancel_token.cancelled and not result.cancelled:
+                    job.result = result
+                job.done.set()
@@ -0,0 +1,201 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+import cv2
+from actions.base_action import BaseAction
+from device.minicap_client import FrameRing
+from flow.flow_controller import ActionEntry, FlowController
+from flow.waits import TransitionStats, Wait, WaitForNewFrame, WaitForScreenChange, WaitForScreenSettle, WaitForSpec, WaitSecs
+
+# Runs actions yielding waits through ActionEntry, the way FlowRunner does (step, then block until the front entry
+# can make progress), against a FrameRing fed with screenshots at random times instead of a device.
+# Measures how long after a frame arrives the action is resumed, vs. the previous 100 ms polling tick, and checks
+# that WaitForScreenChange ignores frames of the same screen and reports timeouts, that WaitForScreenSettle waits for
+# the changes to stop, and that WaitForSpec only matches frames changed in the spec's search window since the captured
+# screenshot.
+# Importing flow.flow_controller starts the device clients; they fail harmlessly without adb.
+
+screenshot_path = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__), "_temp_last_screenshot.png"))
+rounds = 20
+poll_interval_secs = 0.1  # the previous FlowRunner tick
+spec_name = "battle_waiting_action"  # found in the screenshot
+
+
+class FakeDevice:
+    screen_size = (2340, 1080)
+
+    def __init__(self):
+        self.frames = FrameRing()
+        self.last_captured_frame_seq = 0
+        self.last_captured_frame = None
+
+    def publish(self, jpeg: bytes):
+        self.frames.get_write_buffer(len(jpeg))[:] = jpeg
+        self.frames.publish()
+
+    def get_latest_frame(self):
+        return self.frames.latest()
+
+    def wait_for_frame_after(self, seq: int, timeout_secs: float):
+        return self.frames.wait_newer_than(seq, timeout_secs)
+
+    def capture(self):
+        frame = self.frames.latest()
+        if frame is not None:
+            self.last_captured_frame_seq = frame.seq
+            self.last_captured_frame = frame
+
+    def get_captured_reduced(self):
+        return None if self.last_captured_frame is None else self.last_captured_frame.decode_reduced()
+
+
+class FakeContext:
+    def __init__(self, device: FakeDevice):
+        self.device = device
+        self.logger = None
+
+
+class ActionWaiting(BaseAction):
+    log_elapsed_time = False
+
+    def __init__(self, wait: Wait, after_capture=None):
+        self.wait = wait
+        self.after_capture = after_capture  # e.g. the click, changing the screen before the wait starts
+        self.resume_time = None
+
+    def run(self, context):
+        context.device.capture()
+        if self.after_capture is not None:
+            self.after_capture()
+        yield self.wait
+        self.resume_time = time.time()
+
+
+def run_event_driven(action: BaseAction, context: FakeContext):
+    # FlowRunner.run() with FlowController.wait_for_next_tick()
+    actions = deque([ActionEntry(action)])
+    while actions:
+        actions.popleft().step(actions, context)
+        if actions:
+            actions[0].block(context, FlowController.max_block_secs)
+
+
+def run_polling(action: BaseAction, context: FakeContext):
+    actions = deque([ActionEntry(action)])
+    while actions:
+        actions.popleft().step(actions, context)
+        time.sleep(poll_interval_secs)
+
+
+def measure_wake_latency(name: str, run, jpeg: bytes):
+    latencies = []
+    for _ in range(rounds):
+        device = FakeDevice()
+        device.publish(jpeg)
+        action = ActionWaiting(WaitForNewFrame(2.0))
+        publish_times = []
+        delay = random.uniform(0.05, 0.4)
+        threading.Timer(delay, lambda: (publish_times.append(time.time()), device.publish(jpeg))).start()
+        run(action, FakeContext(device))
+        latencies.append(action.resume_time - publish_times[0])
+    print("{:14s} resumed {:.1f} ms after the frame on average, {:.1f} ms at worst".format(
+        name, sum(latencies) / len(latencies) * 1000, max(latencies) * 1000))
+
+
+def expect(failures, name: str, ok: bool, detail: str):
+    print("{} {} {}".format("ok  " if ok else "FAIL", name, detail))
+    if not ok:
+        failures.append(name)
+
+
+def main():
+    image = cv2.imread(screenshot_path)
+    jpeg = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 80])[1].tobytes()
+    changed = image.copy()
+    changed[100:300, 100:300] = 255 - changed[100:300, 100:300]
+    changed_jpeg = cv2.imencode(".jpg", changed, [cv2.IMWRITE_JPEG_QUALITY, 80])[1].tobytes()
+
+    random.seed(1)
+    measure_wake_latency("100 ms polling", run_polling, jpeg)
+    measure_wake_latency("event-driven", run_event_driven, jpeg)
+
+    failures = []
+    device = FakeDevice()
+    device.publish(jpeg)
+    wait = WaitForScreenChange(2.0)
+    action = ActionWaiting(wait)
+    for (delay, data) in [(0.1, jpeg), (0.2, jpeg), (0.3, changed_jpeg)]:
+        threading.Timer(delay, lambda data=data: device.publish(data)).start()
+    start_time = time.time()
+    run_event_driven(action, FakeContext(device))
+    elapsed = action.resume_time - start_time
+    expect(failures, "screen change", not wait.timed_out and 0.3 <= elapsed < 0.4,
+           "resumed after {:.3f} secs, the change was at 0.3".format(elapsed))
+
+    wait = WaitForScreenChange(0.5, rois=[(1000, 800, 1100, 900)])
+    action = ActionWaiting(wait)
+    threading.Timer(0.1, lambda: device.publish(jpeg)).start()
+    threading.Timer(0.2, lambda: device.publish(changed_jpeg)).start()  # outside the ROI
+    run_event_driven(action, FakeContext(device))
+    expect(failures, "change outside the ROI", wait.timed_out, "timed out after {:.3f} secs".format(
+        wait.get_elapsed_secs()))
+
+    # an animation: a change every 50 ms until 0.3
+    wait = WaitForScreenSettle(2.0, quiet_secs=0.15)
+    action = ActionWaiting(wait)
+    for idx in range(6):
+        threading.Timer(0.05 * (idx + 1), lambda data=[changed_jpeg, jpeg][idx % 2]: device.publish(data)).start()
+    run_event_driven(action, FakeContext(device))
+    expect(failures, "screen settles", not wait.timed_out and 0.45 <= wait.get_elapsed_secs() < 0.5,
+           "after {:.3f} secs, the last change was at 0.3".format(wait.get_elapsed_secs()))
+
+    wait = WaitSecs(0.3)
+    run_event_driven(ActionWaiting(wait), FakeContext(device))
+    expect(failures, "fixed wait", abs(wait.get_elapsed_secs() - 0.3) < 0.02, "{:.3f} secs".format(
+        wait.get_elapsed_secs()))
+
+    # the spec disappears at 0.3; the frames before change the screen elsewhere and aren't matched
+    gone = image.copy()
+    gone[117:186, 764:1577] = 0
+    gone_jpeg = cv2.imencode(".jpg", gone, [cv2.IMWRITE_JPEG_QUALITY, 80])[1].tobytes()
+    device = FakeDevice()
+    device.publish(jpeg)
+    stats = TransitionStats()
+    for timeout_secs in [2.0, 0.5]:
+        wait = WaitForSpec(spec_name, False, timeout_secs)
+        action = ActionWaiting(wait)
+        device.publish(jpeg)
+        device.frames.decodes = 0
+        changes = [(0.1, changed_jpeg), (0.2, jpeg)] + ([(0.3, gone_jpeg), (0.4, jpeg)] if timeout_secs > 1 else [])
+        for (delay, data) in changes:
+            threading.Timer(delay, lambda data=data: device.publish(data)).start()
+        run_event_driven(action, FakeContext(device))
+        stats.add("state", wait)
+        if timeout_secs > 1:
+            expect(failures, "spec disappears", not wait.timed_out and 0.3 <= wait.get_elapsed_secs() < 0.4
+                   and device.frames.decodes == 1, "after {:.3f} secs, {} frames matched".format(
+                       wait.get_elapsed_secs(), device.frames.decodes))
+        else:
+            expect(failures, "spec stays", wait.timed_out and device.frames.decodes == 0,
+                   "timed out after {:.3f} secs, {} frames matched".format(wait.get_elapsed_secs(), device.frames.decodes))
+        time.sleep(0.5)
+
+    # the spec is gone by the time the wait starts, no frame changes it again
+    wait = WaitForSpec(spec_name, False, 2.0)
+    device.publish(jpeg)
+    device.frames.decodes = 0
+    run_event_driven(ActionWaiting(wait, lambda: device.publish(gone_jpeg)), FakeContext(device))
+    stats.add("state", wait)
+    expect(failures, "spec gone before the wait", not wait.timed_out and wait.get_elapsed_secs() < 0.1,
+           "after {:.3f} secs, {} frames matched".format(wait.get_elapsed_secs(), device.frames.decodes))
+    print("transitions: " + stats.get_stats("state"))
+
+    print("OK" if len(failures) == 0 else "FAILED: {}".format(", ".join(failures)))
+    return len(failures)
+
+
+if __name__ == "__main__":
+    # the device clients never stop, skip waiting for them
+    os._exit(1 if main() else 0)
@@ -0,0 +1,238 @@
+import os
+import socket
+import threading
+import time
+import tracemalloc
+import cv2
+import numpy as np
+from actions import find_images
+from board.board_image_parser import HpParser
+from device.minicap_client import FrameRing, RoiDecoder, read_frames
+
+# Streams a screenshot as minicap frames over a local socket pair and compares the frame path of MinicapClient with
+# the previous one (recv + bytes concatenation, copied into the last frame, copied again by get_last_frame(), copied
+# by np.array()): time and memory allocated per frame, and the copy / allocation counters of FrameRing.
+# Then measures how long a capture takes when it waits for the next frame, like get_last_frame() did, or takes the
+# latest one.
+# Last, the decode CPU per new frame with the ROIs FlowController declares: full decode of every frame vs.
+# DeviceController's RoiDecoder, on frames at 30 fps changing outside / inside the ROIs, and in bursts of both.
+
+screenshot_path = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__), "_temp_last_screenshot.png"))
+frame_count = 200
+capture_count = 30
+frame_interval_secs = 0.1  # minicap only sends a frame when the screen changes
+capture_interval_secs = 0.03
+decode_count = 60
+decode_interval_secs = 0.033  # an animation at 30 fps
+
+
+def make_stream(jpeg: bytes, count: int) -> bytes:
+    banner = bytearray(24)
+    banner[0] = 1
+    banner[1] = len(banner)
+    frame = len(jpeg).to_bytes(4, "little") + jpeg
+    return bytes(banner) + frame * count
+
+
+def send(sock: socket.socket, stream: bytes):
+    sock.sendall(stream)
+    sock.shutdown(socket.SHUT_WR)
+
+
+def send_slowly(sock: socket.socket, jpeg: bytes, stop: threading.Event):
+    frame = len(jpeg).to_bytes(4, "little") + jpeg
+    sock.sendall(make_stream(b"", 0))
+    while not stop.is_set():
+        sock.sendall(frame)
+        time.sleep(frame_interval_secs)
+    sock.shutdown(socket.SHUT_WR)
+
+
+def read_frames_until_closed(sock, frames: FrameRing):
+    try:
+        read_frames(sock, frames)
+    except ConnectionAbortedError:
+        pass
+
+
+def legacy_read_bytes(sock, length):
+    out = sock.recv(length)
+    length -= len(out)
+    while length > 0:
+        more = sock.recv(length)
+        if len(more) == 0:
+            raise ConnectionAbortedError()
+        out += more
+        length -= len(more)
+    return bytearray(out)
+
+
+def run_legacy(sock) -> np.ndarray:
+    # MinicapClient before FrameRing, with the consumer taking every frame
+    last_frame = bytearray()
+    buffer = None
+    legacy_read_bytes(sock, 2)
+    legacy_read_bytes(sock, 22)
+    try:
+        while True:
+            length = int.from_bytes(legacy_read_bytes(sock, 4), "little")
+            last_frame[:] = legacy_read_bytes(sock, length)
+            frame = bytearray()
+            frame[:] = last_frame
+            buffer = np.array(frame)
+    except ConnectionAbortedError:
+        return buffer
+
+
+class ConsumingFrameRing(FrameRing):
+    # takes every frame as soon as it's published, like DeviceController.capture_screenshot() does with the last one
+    def __init__(self):
+        super().__init__()
+        self.buffer = None
+
+    def publish(self):
+        super().publish()
+        self.buffer = np.frombuffer(self.get_data(self.latest()), dtype=np.uint8)
+
+
+def run_ring(sock, frames: ConsumingFrameRing) -> np.ndarray:
+    try:
+        read_frames(sock, frames)
+    except ConnectionAbortedError:
+        return frames.buffer
+
+
+def measure(name: str, run, stream: bytes):
+    (receiver, sender) = socket.socketpair()
+    sender_thread = threading.Thread(target=send, args=(sender, stream), daemon=True)
+    sender_thread.start()
+
+    tracemalloc.start()
+    start_time = time.time()
+    buffer = run(receiver)
+    elapsed = time.time() - start_time
+    (_, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    sender_thread.join()
+    receiver.close()
+    sender.close()
+    decoded = cv2.imdecode(buffer, cv2.IMREAD_UNCHANGED)
+    print("{}: {:.3f} ms per frame, peak {:.0f} KB traced, last frame decodes to {}".format(
+        name, elapsed / frame_count * 1000, peak / 1024, decoded.shape))
+
+
+def main():
+    jpeg = cv2.imencode(".jpg", cv2.imread(screenshot_path))[1].tobytes()
+    stream = make_stream(jpeg, frame_count)
+    print("{} frames of {:.0f} KB".format(frame_count, len(jpeg) / 1024))
+
+    measure("previous frame path", run_legacy, stream)
+
+    frames = ConsumingFrameRing()
+    initial_allocations = frames.allocations
+    measure("FrameRing", lambda sock: run_ring(sock, frames), stream)
+    print("  {}; {:.3f} allocations and {:.3f} copies per frame after the initial buffers".format(
+        frames.get_stats(), (frames.allocations - initial_allocations) / max(frames.frames, 1),
+        frames.copies / max(frames.frames, 1)))
+
+    (receiver, sender) = socket.socketpair()
+    stop = threading.Event()
+    sender_thread = threading.Thread(target=send_slowly, args=(sender, jpeg, stop), daemon=True)
+    sender_thread.start()
+    frames = FrameRing()
+    threading.Thread(target=read_frames_until_closed, args=(receiver, frames), daemon=True).start()
+    frames.wait_newer_than(0)
+    for (name, capture) in [("wait for the next frame", lambda seq: frames.wait_newer_than(seq)),
+                            ("latest frame", lambda seq: frames.latest())]:
+        latencies = []
+        seq = 0
+        for _ in range(capture_count):
+            start_time = time.time()
+            frame = capture(seq)
+            frame.decode()
+            latencies.append(time.time() - start_time)
+            seq = frame.seq
+            time.sleep(capture_interval_secs)
+        print("capture, {}: {:.1f} ms mean, {:.1f} ms max".format(
+            name, sum(latencies) / len(latencies) * 1000, max(latencies) * 1000))
+    print("  {}".format(frames.get_stats()))
+    stop.set()
+    sender_thread.join()
+    receiver.close()
+    sender.close()
+
+    measure_roi_decodes(cv2.imread(screenshot_path))
+
+
+def get_rois():
+    # as FlowController.__declare_rois(); BoardStableChecker's rect is copied, importing actions.base_action starts
+    # the minicap client
+    rois = [(730, 207, 1607, 837), (HpParser.x1, HpParser.y1, HpParser.x2, HpParser.y2)]
+    find_images.template_registry.load_all()
+    for templates in find_images.template_registry.get_loaded():
+        if templates.spec.has_expect_pos():
+            rois.append(templates.get_search_window(2340, 1080))
+    return rois
+
+
+def make_frames(image, rois, inside: bool):
+    # JPEGs of image with a blinking 40x40 square, in one of the ROIs or where no ROI reaches
+    covered = np.zeros(image.shape[:2], dtype=bool)
+    for (x1, y1, x2, y2) in rois:
+        covered[max(y1 - 8, 0):y2 + 8, max(x1 - 8, 0):x2 + 8] = True
+    if inside:
+        (x, y) = (rois[0][0] + 100, rois[0][1] + 100)
+    else:
+        (y, x) = next((y, x) for y in range(0, image.shape[0] - 40, 8) for x in range(0, image.shape[1] - 40, 8)
+                      if not covered[y:y + 40, x:x + 40].any())
+    jpegs = []
+    for idx in range(decode_count):
+        frame = image.copy()
+        if idx % 2 == 1:
+            frame[y:y + 40, x:x + 40] = 255 - frame[y:y + 40, x:x + 40]
+        jpegs.append(cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, 80])[1].tobytes())
+    return jpegs
+
+
+def decode_all(jpegs, rois, gated: bool):
+    # CPU ms per frame, full decodes, full decodes without a reduced one
+    frames = FrameRing()
+    decoder = RoiDecoder()
+    decoder.rois = {str(idx): roi for (idx, roi) in enumerate(rois)}
+    cpu_secs = 0.0
+    for jpeg in jpegs:
+        frames.get_write_buffer(len(jpeg))[:] = jpeg
+        frames.publish()
+        frame = frames.latest()
+        start_time = time.process_time()
+        if gated:
+            decoder.decode(frame)
+        else:
+            frame.decode()
+        cpu_secs += time.process_time() - start_time
+        time.sleep(decode_interval_secs)
+    if not gated:
+        return (cpu_secs / len(jpegs) * 1000, len(jpegs), len(jpegs))
+    return (cpu_secs / len(jpegs) * 1000, decoder.full_decodes, decoder.direct_decodes)
+
+
+def measure_roi_decodes(image):
+    rois = get_rois()
+    roi_area = sum((x2 - x1) * (y2 - y1) for (x1, y1, x2, y2) in rois)
+    print("{} ROIs, {:.0f}% of the screen (overlaps counted twice)".format(
+        len(rois), roi_area * 100 / (image.shape[0] * image.shape[1])))
+    outside_jpegs = make_frames(image, rois, False)
+    inside_jpegs = make_frames(image, rois, True)
+    burst = decode_count // 4
+    mixed_jpegs = [(inside_jpegs if idx // burst % 2 == 0 else outside_jpegs)[idx] for idx in range(decode_count)]
+    for (name, jpegs) in [("outside", outside_jpegs), ("inside", inside_jpegs),
+                          ("in bursts of {} frames inside / outside".format(burst), mixed_jpegs)]:
+        (full_ms, _, _) = decode_all(jpegs, rois, False)
+        (gated_ms, full_decodes, direct_decodes) = decode_all(jpegs, rois, True)
+        print("changes {} the ROIs: full decodes {:.1f} ms per frame, gated {:.1f} ms per frame ({} of {} decoded in "
+              "full, {} without a reduced decode)".format(name, full_ms, gated_ms, full_decodes, len(jpegs), direct_decodes))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import time
+from device.fake_minitouch_server import FakeMinitouchServer
+from device.minitouch_client import MinitouchClient, MinitouchCommands
+
+# Checks MinitouchClient against FakeMinitouchServer: coordinates, gesture shapes, multi-point swipes, pipelined
+# batches and reconnecting. Then how long a turn of swaps takes to send and to play.
+
+swaps_per_turn = 5
+swap_interval_secs = 0.3  # ActionMoveGrids
+
+
+def expect(failures, name: str, ok: bool, detail=""):
+    print("{} {} {}".format("ok  " if ok else "FAIL", name, detail))
+    if not ok:
+        failures.append(name)
+
+
+def wait_for_commits(server: FakeMinitouchServer, commits: int):
+    deadline = time.time() + 5
+    while server.commits < commits and time.time() < deadline:
+        time.sleep(0.01)
+
+
+def main():
+    failures = []
+    # a portrait touch panel under the landscape screen, as on most phones
+    server = FakeMinitouchServer(port=0, max_x=1079, max_y=2339)
+    client = MinitouchClient(port=server.port, forward=False, rotation=90)
+
+    client.touch(2340, 0)
+    wait_for_commits(server, 2)
+    events = [event[1:] for event in server.get_events()]
+    expect(failures, "tap", events == [("d", 0, 1079, 2339), ("u", 0, -1, -1)], str(events))
+
+    server.clear()
+    start_time = time.time()
+    client.drag(100, 500, 300, 500)
+    elapsed = time.time() - start_time
+    wait_for_commits(server, client.drag_steps + 2)
+    events = server.get_events()
+    kinds = "".join(event[1] for event in events)
+    expect(failures, "drag", kinds == "d" + "m" * client.drag_steps + "u"
+           and events[0][3:] == (579, 100) and events[-2][3:] == (579, 300), "{} from {} to {}".format(
+               kinds, events[0][3:], events[-2][3:]))
+    expect(failures, "drag returns once played", elapsed >= client.drag_secs * 0.9, "{:.3f} secs".format(elapsed))
+    expect(failures, "drag duration on device", events[-1][0] - events[0][0] >= client.drag_secs * 0.9,
+           "{:.3f} secs".format(events[-1][0] - events[0][0]))
+
+    server.clear()
+    client.send(MinitouchCommands().swipe([(1000, 500, 800, 500), (1200, 500, 1400, 500)], 0.05, 5))
+    wait_for_commits(server, 7)
+    events = server.get_events()
+    contacts = sorted(set(event[2] for event in events))
+    simultaneous = all(a[0] == b[0] for (a, b) in zip(events[0::2], events[1::2]))
+    expect(failures, "two-finger swipe", contacts == [0, 1] and simultaneous and len(events) == 14, str(contacts))
+
+    server.clear()
+    client.run_gestures([("drag", 800, 300, 900, 300, 0.0), ("touch", 200, 54, 0.0)])
+    wait_for_commits(server, client.drag_steps + 4)
+    kinds = "".join(event[1] for event in server.get_events())
+    expect(failures, "run_gestures", kinds == "d" + "m" * client.drag_steps + "u" + "du", kinds)
+
+    server.drop_connection()
+    time.sleep(0.1)
+    server.clear()
+    client.touch(10, 10)
+    wait_for_commits(server, 2)
+    expect(failures, "reconnect", len(server.get_events()) == 2 and server.connections == 2,
+           "{} connections".format(server.connections))
+    expect(failures, "no protocol errors", len(server.errors) == 0, str(server.errors))
+
+    # pipelined: sending a turn doesn't wait for the device, only the waits in it take time
+    drags = [(800 + 100 * idx, 300, 900 + 100 * idx, 300) for idx in range(swaps_per_turn)]
+    batch = MinitouchCommands()
+    for drag in drags:
+        batch.swipe([drag], client.drag_secs, client.drag_steps).wait(swap_interval_secs)
+    commits = server.commits
+    start_time = time.time()
+    client.send(batch, wait=False)
+    sent = time.time() - start_time
+    wait_for_commits(server, commits + swaps_per_turn * (client.drag_steps + 2))
+    played = time.time() - start_time
+    print("turn of {} swaps: {} commands sent in {:.2f} ms, last one committed after {:.3f} secs ({:.3f} secs of waits in the batch)".format(
+        swaps_per_turn, len(batch.commands), sent * 1000, played, batch.duration_secs))
+
+    server.close()
+    print("OK" if len(failures) == 0 else "FAILED: {}".format(", ".join(failures)))
+    return len(failures)
+
+
+if __name__ == "__main__":
+    exit(1 if main() else 0)
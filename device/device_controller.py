@@ -1,52 +1,145 @@
+import configparser
+import os
 import subprocess
 import socket
+import time
+from typing import Optional
 import numpy as np
 import cv2
 
-from device.minicap_client import MinicapClient
+from device.minicap_client import Frame, MinicapClient, RoiDecoder
+from device.minitouch_client import MinitouchClient
 from device.monkey_runner_adaptor import MonkeyRunnerAdaptor
 from PyQt5.QtCore import QByteArray, QObject
-from PyQt5.QtGui import QPixmap
+from PyQt5.QtGui import QImage, QPixmap
 from PyQt5 import QtCore
 
 
+config_path = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__), "device.ini"))
+
+
+def create_input_backend():
+    # MonkeyRunnerAdaptor or MinitouchClient, as selected in device.ini
+    config = configparser.ConfigParser()
+    config.read(config_path)
+    backend = config.get("input", "backend", fallback="monkeyrunner")
+    print("input backend: {}".format(backend))
+    if backend == "minitouch":
+        return MinitouchClient(port=config.getint("minitouch", "port", fallback=1111),
+                               rotation=config.getint("minitouch", "rotation", fallback=0))
+    if backend != "monkeyrunner":
+        raise ValueError("unknown input backend '{}' in {}".format(backend, config_path))
+    return MonkeyRunnerAdaptor()
+
+
 class DeviceController(QObject):
   # not thread-safe
 
-    # Signal to update UI
-    update_screenshot = QtCore.pyqtSignal()
+    # Signal to update UI, with a thumbnail of the screenshot
+    update_screenshot = QtCore.pyqtSignal(QImage)
+
+    screen_size = (2340, 1080)  # minicap -P 2340x1080@2340x1080/0
 
     last_captured_screenshot = None
+    last_captured_frame_seq = 0
+    last_captured_frame: Frame = None
+    last_thumbnail: QImage = None
+    first_frame_timeout_secs = 10.0
+    thumbnail_height = 250
     last_captured_screenshot_path: str = "/Users/petershih/Documents/pq3-helper/_temp_last_screenshot.png"
 
+    # for debugging: also write the screenshot to last_captured_screenshot_path, at most this often; None to never
+    snapshot_interval_secs: float = None
+    last_snapshot_time = 0.0
+
     minicap_client: MinicapClient = MinicapClient()
-    monkey_runner: MonkeyRunnerAdaptor = MonkeyRunnerAdaptor()
+    # touch(), drag() and run_gestures() of MonkeyRunnerAdaptor or MinitouchClient
+    input_backend = create_input_backend()
+
+    def __init__(self):
+        super().__init__()
+        # with ROIs declared, frames that change none of them aren't decoded in full
+        self.roi_decoder = RoiDecoder()
+
+    def declare_roi(self, name: str, x1: int, y1: int, x2: int, y2: int):
+        # screenshot region (x2, y2 exclusive) a consumer reads from last_captured_screenshot
+        self.roi_decoder.rois[name] = (x1, y1, x2, y2)
+
+    def get_latest_frame(self) -> Optional[Frame]:
+        return self.minicap_client.latest()
+
+    def wait_for_frame_after(self, seq: int, timeout_secs: float) -> Optional[Frame]:
+        # None on timeout
+        return self.minicap_client.wait_newer_than(seq, timeout_secs)
+
+    def get_captured_reduced(self):
+        # the reduced image of the frame last captured, for comparing frames with it; None if minicap replaced it
+        frame = self.last_captured_frame
+        return None if frame is None else frame.decode_reduced()
+
+    def get_decode_stats(self) -> str:
+        return "{}; {}".format(self.roi_decoder.get_stats(), self.minicap_client.frames.get_stats())
+
+    def get_input_stats(self) -> str:
+        # gesture latency percentiles, reconnects, ...
+        return self.input_backend.get_stats()
 
     def capture_screenshot2(self):
-        self.monkey_runner.take_snapshot(self.last_captured_screenshot_path, "png")
+        # monkeyrunner backend only
+        self.input_backend.take_snapshot(self.last_captured_screenshot_path, "png")
         try:
             self.last_captured_screenshot = cv2.imread(self.last_captured_screenshot_path)
         except:
             self.last_captured_screenshot = None
             return
-        self.update_screenshot.emit()
+        self.__emit_thumbnail(self.last_captured_screenshot)
 
     def capture_screenshot(self):
+        # the latest frame, without waiting for the next one: minicap only sends frames when the screen changes
         try:
-            self.last_captured_screenshot = cv2.imdecode(
-                np.array(self.minicap_client.get_last_frame()), cv2.IMREAD_UNCHANGED)
+            (image, preview) = (None, None)
+            for _ in range(2):  # a newer frame may replace the one being decoded
+                frame = self.minicap_client.latest() or self.minicap_client.wait_newer_than(0, self.first_frame_timeout_secs)
+                if frame is None:
+                    break
+                if frame.seq == self.last_captured_frame_seq and self.last_captured_screenshot is not None:
+                    return
+                (image, preview) = self.roi_decoder.decode(frame)
+                if image is not None:
+                    break
+            self.last_captured_screenshot = image
         except:
             self.last_captured_screenshot = None
             return
-            
-        cv2.imwrite(self.last_captured_screenshot_path,
-                    self.last_captured_screenshot)
-        self.update_screenshot.emit()
-        
+        if image is None:
+            return
+        self.last_captured_frame_seq = frame.seq
+        self.last_captured_frame = frame
+
+        if self.snapshot_interval_secs is not None and time.time() - self.last_snapshot_time >= self.snapshot_interval_secs:
+            cv2.imwrite(self.last_captured_screenshot_path, self.last_captured_screenshot)
+            self.last_snapshot_time = time.time()
+        self.__emit_thumbnail(preview)
+
+    def __emit_thumbnail(self, image):
+        if image is None:
+            return
+        (height, width) = image.shape[:2]
+        thumbnail = cv2.resize(image, (width * self.thumbnail_height // height, self.thumbnail_height),
+                               interpolation=cv2.INTER_LINEAR)  # INTER_AREA takes ~20x longer on a full frame
+        thumbnail = cv2.cvtColor(thumbnail, cv2.COLOR_BGRA2RGB if thumbnail.shape[2] == 4 else cv2.COLOR_BGR2RGB)
+        # the signal may be delivered on the UI thread after the numpy buffer is gone, so the QImage owns a copy
+        self.last_thumbnail = QImage(thumbnail.data, thumbnail.shape[1], thumbnail.shape[0], thumbnail.strides[0],
+                                     QImage.Format_RGB888).copy()
+        self.update_screenshot.emit(self.last_thumbnail)
 
     def tap(self, x, y):
         #subprocess.call("adb -s 0B111JEC213922 shell input tap {} {}".format(str(x), str(y)), shell=True)
-        self.monkey_runner.touch(x, y)
+        self.input_backend.touch(x, y)
 
     def drag(self, x1, y1, x2, y2):
-        self.monkey_runner.drag(x1,y1,x2,y2)
+        self.input_backend.drag(x1,y1,x2,y2)
+
+    def drag_all(self, drags, interval_secs):
+        # drags: (x1, y1, x2, y2), each followed by interval_secs, in one round trip
+        self.input_backend.run_gestures([("drag", *drag, interval_secs) for drag in drags])
@@ -0,0 +1,120 @@
+import socket
+import threading
+import time
+from typing import List, Tuple
+
+
+class FakeMinitouchServer:
+    # thread-safe
+    #
+    # Local stand-in for minitouch on the device, to run MinitouchClient without hardware: sends the banner, plays
+    # the commands of a connection in order (sleeping on "w") and records the touches every "c" commits.
+    # One connection at a time, like minitouch.
+
+    def __init__(self, port=1111, max_contacts=10, max_x=2339, max_y=1079, max_pressure=255):
+        self.max_contacts = max_contacts
+        self.max_x = max_x
+        self.max_y = max_y
+        self.max_pressure = max_pressure
+
+        self.__lock = threading.Lock()
+        self.events: List[Tuple[float, str, int, int, int]] = []  # (time committed, "d" / "m" / "u", contact, x, y)
+        self.commits = 0
+        self.connections = 0
+        self.errors: List[str] = []
+
+        self.__server = socket.create_server(("127.0.0.1", port))
+        self.port = self.__server.getsockname()[1]
+        self.__connection = None
+        threading.Thread(target=self.__serve, daemon=True).start()
+
+    def get_events(self) -> List[Tuple[float, str, int, int, int]]:
+        with self.__lock:
+            return list(self.events)
+
+    def clear(self):
+        with self.__lock:
+            self.events.clear()
+            self.commits = 0
+            self.errors.clear()
+
+    def drop_connection(self):
+        # as if minitouch died; the client has to reconnect
+        with self.__lock:
+            connection = self.__connection
+        if connection is not None:
+            connection.shutdown(socket.SHUT_RDWR)
+
+    def close(self):
+        self.__server.close()
+
+    def __serve(self):
+        while True:
+            try:
+                (connection, _) = self.__server.accept()
+            except OSError:
+                return
+            with self.__lock:
+                self.__connection = connection
+                self.connections += 1
+            try:
+                self.__handle(connection)
+            except OSError:
+                pass
+            connection.close()
+
+    def __handle(self, connection: socket.socket):
+        connection.sendall("v 1\n^ {} {} {} {}\n$ 12345\n".format(
+            self.max_contacts, self.max_x, self.max_y, self.max_pressure).encode("ascii"))
+        pending = []
+        down = set()
+        f = connection.makefile("r", encoding="ascii")
+        for line in f:
+            fields = line.split()
+            if len(fields) == 0:
+                continue
+            command = fields[0]
+            if command in ("d", "m"):
+                (contact, x, y, pressure) = [int(v) for v in fields[1:5]]
+                if not (0 <= contact < self.max_contacts and 0 <= x <= self.max_x and 0 <= y <= self.max_y
+                        and 0 <= pressure <= self.max_pressure):
+                    self.__error("out of range: " + line.strip())
+                if (command == "d") == (contact in down):
+                    self.__error("contact {} is {}: {}".format(contact, "down" if contact in down else "up", line.strip()))
+                down.add(contact)
+                pending.append((command, contact, x, y))
+            elif command == "u":
+                contact = int(fields[1])
+                if contact not in down:
+                    self.__error("contact {} is up: {}".format(contact, line.strip()))
+                down.discard(contact)
+                pending.append((command, contact, -1, -1))
+            elif command == "c":
+                with self.__lock:
+                    now = time.time()
+                    self.events.extend((now, *event) for event in pending)
+                    self.commits += 1
+                pending = []
+            elif command == "w":
+                time.sleep(int(fields[1]) / 1000)
+            elif command == "r":
+                pending = []
+                down.clear()
+            else:
+                self.__error("unknown command: " + line.strip())
+
+    def __error(self, message: str):
+        print("FakeMinitouchServer: " + message)
+        with self.__lock:
+            self.errors.append(message)
+
+
+if __name__ == "__main__":
+    # for running the app without a device: select the minitouch backend in device.ini
+    server = FakeMinitouchServer()
+    print("fake minitouch listening on port {}".format(server.port))
+    while True:
+        time.sleep(1)
+        for event in server.get_events():
+            print(event)
+        server.clear()
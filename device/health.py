@@ -0,0 +1,99 @@
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Callable, Dict
+
+
+class Backoff:
+    # delays between retries: initial_secs, doubling up to max_secs until reset()
+
+    def __init__(self, initial_secs=0.1, max_secs=5.0, factor=2.0):
+        self.initial_secs = initial_secs
+        self.max_secs = max_secs
+        self.factor = factor
+        self.__next_secs = initial_secs
+
+    def next_delay(self) -> float:
+        delay = self.__next_secs
+        self.__next_secs = min(self.__next_secs * self.factor, self.max_secs)
+        return delay
+
+    def sleep(self):
+        time.sleep(self.next_delay())
+
+    def reset(self):
+        self.__next_secs = self.initial_secs
+
+
+class InputMetrics:
+    # thread-safe
+    #
+    # Latency of the recent calls per name (touch, drag, heartbeat, ...) and event counters (reconnects, failures).
+
+    def __init__(self, history=200):
+        self.__lock = threading.Lock()
+        self.__latencies: Dict[str, deque] = defaultdict(lambda: deque(maxlen=history))
+        self.__counters: Dict[str, int] = defaultdict(int)
+
+    def record(self, name: str, secs: float):
+        with self.__lock:
+            self.__latencies[name].append(secs)
+
+    def count(self, name: str, n=1):
+        with self.__lock:
+            self.__counters[name] += n
+
+    def get_counter(self, name: str) -> int:
+        with self.__lock:
+            return self.__counters[name]
+
+    def get_percentile(self, name: str, p: float) -> float:
+        # nearest rank; 0 before the first call
+        with self.__lock:
+            latencies = sorted(self.__latencies[name])
+        if not latencies:
+            return 0.0
+        return latencies[min(int(p / 100 * len(latencies)), len(latencies) - 1)]
+
+    def get_stats(self) -> str:
+        with self.__lock:
+            names = sorted(name for (name, latencies) in self.__latencies.items() if latencies)
+            counters = sorted(self.__counters.items())
+        latencies = ["{} p50 {:.0f} / p90 {:.0f} / p99 {:.0f} ms".format(
+            name, self.get_percentile(name, 50) * 1000, self.get_percentile(name, 90) * 1000,
+            self.get_percentile(name, 99) * 1000) for name in names]
+        return ", ".join(latencies + ["{} {}".format(name, n) for (name, n) in counters])
+
+
+class Heartbeat:
+    # Calls check() on a daemon thread every interval_secs, busy or idle: a broken connection may drop gestures
+    # without failing them, so it has to be found while the input is in use too. check() raises or returns False on
+    # failure; the next checks back off then.
+
+    def __init__(self, check: Callable[[], bool], interval_secs: float, metrics: InputMetrics):
+        self.check = check
+        self.interval_secs = interval_secs
+        self.metrics = metrics
+        self.__stopped = threading.Event()
+        threading.Thread(target=self.__run, daemon=True).start()
+
+    def stop(self):
+        self.__stopped.set()
+
+    def __run(self):
+        backoff = Backoff(self.interval_secs, self.interval_secs * 8)
+        delay = self.interval_secs
+        while not self.__stopped.wait(delay):
+            try:
+                healthy = self.check()
+            except Exception as e:
+                print("heartbeat failed: " + str(e))
+                healthy = False
+            self.metrics.count("heartbeats")
+            if healthy:
+                backoff.reset()
+                delay = self.interval_secs
+            else:
+                # the target may be restarting; don't hammer it
+                self.metrics.count("heartbeat failures")
+                delay = backoff.next_delay()
@@ -3,21 +3,278 @@ import threading
 import cv2
 import subprocess
 import time
+from typing import Dict, Iterable, Optional, Tuple
+import numpy as np
 
 from PyQt5.QtCore import QRunnable, QThreadPool
 
 
-def read_bytes(socket, length):
-    out = socket.recv(length)
-    length -= len(out)
-    while length > 0:
-        more = socket.recv(length)
-        if len(more) == 0:
+def read_into(socket, view: memoryview):
+    # fills view from the socket
+    while len(view) > 0:
+        received = socket.recv_into(view)
+        if received == 0:
             raise ConnectionAbortedError()
+        view = view[received:]
 
-        out += more
-        length -= len(more)
-    return bytearray(out)
+
+class Frame:
+    # a published frame of FrameRing
+    def __init__(self, frames: "FrameRing", seq: int, timestamp: float, slot: int, length: int):
+        self.seq = seq  # increases by one per frame received
+        self.timestamp = timestamp  # time.time() when received
+        self.slot = slot
+        self.length = length
+        self.__frames = frames
+
+    def decode(self):
+        # the image, decoded once per frame; None if it couldn't be decoded or a newer frame replaced it
+        return self.__frames.decode(self)
+
+    def decode_reduced(self):
+        # the image at 1 / FrameRing.reduced_scale of the resolution, about half the CPU of decode()
+        return self.__frames.decode(self, FrameRing.reduced_flags)
+
+
+class FrameRing:
+    # thread-safe
+    #
+    # Latest frame of the minicap stream, in reusable JPEG buffers. Each frame is received straight into a slot that
+    # is neither the latest frame, the one last handed to a consumer, nor one being decoded, and consumers read it in
+    # place, so a frame is never copied. A slot is only reallocated when a frame doesn't fit, and one is only added
+    # when every slot is in use.
+    #
+    # Frames are only decoded when a consumer asks, once per frame and resolution: the last decoded image is kept.
+
+    # libjpeg scales down while decoding, skipping most of the IDCT and color conversion
+    reduced_scale = 8
+    reduced_flags = cv2.IMREAD_REDUCED_COLOR_8
+
+    def __init__(self, slot_count=4, slot_size=1024 * 1024):
+        self.__slots = [bytearray(slot_size) for _ in range(slot_count)]
+        self.__lengths = [0] * slot_count
+        self.__slot_seqs = [0] * slot_count
+        self.__decoding = [0] * slot_count
+        self.__writing = None
+        self.__latest = None
+        self.__leased = None
+        self.__seq = 0
+        self.__timestamp = 0.0
+        self.__cond = threading.Condition()
+
+        self.__decode_lock = threading.Lock()
+        self.__decoded = dict()  # flags: (seq, image)
+
+        self.frames = 0
+        self.frame_bytes = 0
+        self.allocations = slot_count
+        self.copies = 0
+        self.decodes = 0
+        self.reduced_decodes = 0
+        self.decode_hits = 0
+
+    def get_write_buffer(self, length: int) -> memoryview:
+        # from the reader thread: where to receive the next frame, published by publish()
+        with self.__cond:
+            idx = next((idx for idx in range(len(self.__slots))
+                        if idx != self.__latest and idx != self.__leased and self.__decoding[idx] == 0), None)
+            if idx is None:
+                # every slot is the latest frame, leased or being decoded (fewer than 3 slots): add one
+                idx = len(self.__slots)
+                self.__slots.append(bytearray(length))
+                self.__lengths.append(0)
+                self.__slot_seqs.append(0)
+                self.__decoding.append(0)
+                self.allocations += 1
+            self.__slot_seqs[idx] = 0
+        if len(self.__slots[idx]) < length:
+            self.__slots[idx] = bytearray(max(length, len(self.__slots[idx]) * 2))
+            self.allocations += 1
+        self.__writing = idx
+        self.__lengths[idx] = length
+        return memoryview(self.__slots[idx])[:length]
+
+    def publish(self):
+        with self.__cond:
+            self.__latest = self.__writing
+            self.__seq += 1
+            self.__timestamp = time.time()
+            self.__slot_seqs[self.__latest] = self.__seq
+            self.frames += 1
+            self.frame_bytes += self.__lengths[self.__latest]
+            self.__cond.notify_all()
+
+    def latest(self) -> Optional[Frame]:
+        # the latest frame without waiting; None before the first one
+        with self.__cond:
+            return self.__lease_latest()
+
+    def wait_newer_than(self, seq: int, timeout: float = None) -> Optional[Frame]:
+        # the latest frame once it's newer than seq (0 for any); None on timeout
+        with self.__cond:
+            if not self.__cond.wait_for(lambda: self.__seq > seq, timeout):
+                return None
+            return self.__lease_latest()
+
+    def get_data(self, frame: Frame) -> Optional[memoryview]:
+        # the JPEG of frame, read in place; valid until a newer frame is handed to a consumer
+        with self.__cond:
+            if self.__slot_seqs[frame.slot] != frame.seq:
+                return None
+            return memoryview(self.__slots[frame.slot])[:frame.length]
+
+    def copy_data(self, frame: Frame) -> Optional[bytearray]:
+        # for consumers keeping the JPEG longer
+        data = self.get_data(frame)
+        if data is None:
+            return None
+        self.copies += 1
+        self.allocations += 1
+        return bytearray(data)
+
+    def decode(self, frame: Frame, flags=cv2.IMREAD_UNCHANGED):
+        with self.__decode_lock:
+            (decoded_seq, decoded) = self.__decoded.get(flags, (0, None))
+            if decoded_seq == frame.seq:
+                self.decode_hits += 1
+                return decoded
+
+            with self.__cond:
+                if self.__slot_seqs[frame.slot] != frame.seq:
+                    return None
+                self.__decoding[frame.slot] += 1
+            try:
+                image = cv2.imdecode(np.frombuffer(memoryview(self.__slots[frame.slot])[:frame.length], dtype=np.uint8),
+                                     flags)
+            finally:
+                with self.__cond:
+                    self.__decoding[frame.slot] -= 1
+
+            if flags == self.reduced_flags:
+                self.reduced_decodes += 1
+            else:
+                self.decodes += 1
+            self.__decoded[flags] = (frame.seq, image)
+            return image
+
+    def get_stats(self) -> str:
+        return "{} frames ({:.0f} KB on average), {} decoded, {} decoded reduced, {} decode cache hits, " \
+               "{} buffer allocations, {} copies".format(
+                   self.frames, self.frame_bytes / max(self.frames, 1) / 1024, self.decodes, self.reduced_decodes,
+                   self.decode_hits, self.allocations, self.copies)
+
+    def __lease_latest(self) -> Optional[Frame]:
+        if self.__latest is None:
+            return None
+        self.__leased = self.__latest
+        return Frame(self, self.__seq, self.__timestamp, self.__latest, self.__lengths[self.__latest])
+
+
+def rois_changed(last, reduced, rois: Iterable[Tuple[int, int, int, int]], threshold: int) -> bool:
+    # whether any full resolution ROI (x1, y1, x2, y2) differs between two reduced images of FrameRing by more
+    # than threshold in some channel of a reduced pixel it overlaps
+    if last is None or last.shape != reduced.shape:
+        return True
+    scale = FrameRing.reduced_scale
+    for (x1, y1, x2, y2) in rois:
+        (rx1, ry1, rx2, ry2) = (x1 // scale, y1 // scale, -(-x2 // scale), -(-y2 // scale))
+        diff = cv2.absdiff(reduced[ry1:ry2, rx1:rx2], last[ry1:ry2, rx1:rx2])
+        if diff.size > 0 and diff.max() > threshold:
+            return True
+    return False
+
+
+class RoiDecoder:
+    # not thread-safe
+    #
+    # Decodes frames for a consumer reading only some regions (ROIs) of them. A frame is first decoded at reduced
+    # scale, and only decoded in full when some ROI differs from the last full decode by more than threshold (max
+    # per-channel difference of a reduced pixel); otherwise the last full image is kept, at most max_skip_secs.
+    #
+    # After a frame changed an ROI the next ones usually do too (animations), and there the reduced decode only adds
+    # to the full one. So they are decoded in full directly, except for a probe every probe_interval_secs decoded both
+    # ways. Once the ROIs are the same as at the previous probe, frames are gated again. The interval doubles, up to
+    # max_probe_interval_secs, until a frame is skipped: blinking ROIs may match at a probe and change right after.
+
+    def __init__(self, threshold=8, max_skip_secs=1.0, probe_interval_secs=0.25, max_probe_interval_secs=1.0):
+        self.rois: Dict[str, Tuple[int, int, int, int]] = dict()
+        self.threshold = threshold
+        self.max_skip_secs = max_skip_secs
+        self.probe_interval_secs = probe_interval_secs
+        self.max_probe_interval_secs = max_probe_interval_secs
+
+        self.__image = None  # last full decode
+        self.__reduced = None  # reduced decode of the last frame decoded both ways, __image's frame unless changing
+        self.__full_decode_time = 0.0
+        self.__last_probe_time = None  # while decoding in full directly
+        self.__probe_interval_secs = probe_interval_secs
+
+        self.full_decodes = 0
+        self.direct_decodes = 0  # full decodes without a reduced one
+        self.skipped_decodes = 0
+
+    def decode(self, frame: Frame):
+        # (image, preview): the full image of frame, or of an earlier frame with the same ROIs; the preview is the
+        # reduced image when the full decode was skipped. (None, None) if frame was replaced while decoding.
+        if not self.rois:
+            image = frame.decode()
+            return (image, image)
+
+        now = time.time()
+        changing = self.__last_probe_time is not None
+        if changing and now - self.__last_probe_time < self.__probe_interval_secs:
+            image = frame.decode()
+            if image is not None:
+                self.__set_image(image, now)
+                self.direct_decodes += 1
+            return (image, image)
+
+        reduced = frame.decode_reduced()
+        if reduced is None:
+            return (None, None)
+        changed = rois_changed(self.__reduced, reduced, self.rois.values(), self.threshold)
+        if changing:
+            # probe: the image is decoded anyway, the frames in between may differ from both probes
+            self.__last_probe_time = now if changed else None
+            self.__probe_interval_secs = min(self.__probe_interval_secs * 2, self.max_probe_interval_secs)
+        elif not changed and self.__image is not None and now - self.__full_decode_time < self.max_skip_secs:
+            self.__probe_interval_secs = self.probe_interval_secs
+            self.skipped_decodes += 1
+            return (self.__image, reduced)
+        elif changed and self.__reduced is not None:
+            self.__last_probe_time = now
+
+        image = frame.decode()
+        if image is not None:
+            self.__set_image(image, now)
+            self.__reduced = reduced
+        return (image, image)
+
+    def get_stats(self) -> str:
+        return "{} ROIs, {} full decodes ({} without a reduced one), {} skipped".format(
+            len(self.rois), self.full_decodes, self.direct_decodes, self.skipped_decodes)
+
+    def __set_image(self, image, now: float):
+        self.__image = image
+        self.__full_decode_time = now
+        self.full_decodes += 1
+
+
+def read_frames(socket, frames: FrameRing):
+    # receives the minicap stream into frames until the connection breaks
+    print("connecting to minicap server")
+    header = memoryview(bytearray(4))
+    read_into(socket, header[:2])
+    version = header[0]
+    banner_length = header[1]
+    print("Version {}".format(version))
+    read_into(socket, memoryview(bytearray(banner_length - 2)))
+    print("Banner length {}".format(banner_length))
+
+    while True:
+        read_into(socket, header)
+        read_into(socket, frames.get_write_buffer(int.from_bytes(header, "little")))
+        frames.publish()
 
 
 class MinicapServer(QRunnable):
@@ -42,9 +299,8 @@ class MinicapClient(QRunnable):
 
     def __init__(self):
         super().__init__()
+        self.frames = FrameRing()
         QThreadPool.globalInstance().start(self)
-        self.__last_frame = bytearray()
-        self.__last_frame_cond = threading.Condition()
 
     def run(self):
         print("run following commands manually, and keep it alive:")
@@ -56,8 +312,7 @@ class MinicapClient(QRunnable):
         while True:
             try:
                 self.__connect_minicap()
-                for frame in self.__read_frames(self.__connection):
-                    self.__set_last_frame(frame)
+                read_frames(self.__connection, self.frames)
             except:
                 print("minicap connect is broken... reconnecting")
 
@@ -93,34 +348,8 @@ class MinicapClient(QRunnable):
         time.sleep(1)
 
 
-    def __read_frames(self, socket):
-        print("connecting to minicap server")
-        version = read_bytes(socket, 1)[0]
-        print("Version {}".format(version))
-        banner_length = read_bytes(socket, 1)[0]
-        banner_rest = read_bytes(socket, banner_length - 2)
-        print("Banner length {}".format(banner_length))
-
-        while True:
-            frame_bytes = list(read_bytes(socket, 4))
-
-            total = 0
-            frame_bytes.reverse()
-            for byte in frame_bytes:
-                total = (total << 8) + byte
-
-            jpeg_data = read_bytes(socket, total)
-            yield jpeg_data
-
-
-    def __set_last_frame(self, frame):
-        with self.__last_frame_cond:
-            self.__last_frame[:] = frame
-            self.__last_frame_cond.notify_all()
+    def latest(self) -> Optional[Frame]:
+        return self.frames.latest()
 
-    def get_last_frame(self):
-        ret: bytearray = bytearray()
-        with self.__last_frame_cond:
-            self.__last_frame_cond.wait()
-            ret[:] = self.__last_frame
-        return ret
+    def wait_newer_than(self, seq: int, timeout: float = None) -> Optional[Frame]:
+        return self.frames.wait_newer_than(seq, timeout)
@@ -0,0 +1,197 @@
+import select
+import socket
+import subprocess
+import time
+from typing import List, Sequence, Tuple
+from device.health import Backoff, InputMetrics
+
+
+class MinitouchCommands:
+    # A batch of minitouch commands in screen coordinates, sent in one write: minitouch doesn't answer commands, so
+    # a batch is pipelined and the waits in it run on the device.
+
+    def __init__(self):
+        self.commands: List[Tuple] = []  # (command, args...)
+        self.duration_secs = 0.0  # of the waits
+
+    def down(self, contact: int, x, y) -> "MinitouchCommands":
+        self.commands.append(("d", contact, x, y))
+        return self
+
+    def move(self, contact: int, x, y) -> "MinitouchCommands":
+        self.commands.append(("m", contact, x, y))
+        return self
+
+    def up(self, contact: int) -> "MinitouchCommands":
+        self.commands.append(("u", contact))
+        return self
+
+    def commit(self) -> "MinitouchCommands":
+        self.commands.append(("c",))
+        return self
+
+    def wait(self, secs: float) -> "MinitouchCommands":
+        ms = int(round(secs * 1000))
+        if ms > 0:
+            self.commands.append(("w", ms))
+            self.duration_secs += ms / 1000
+        return self
+
+    def tap(self, x, y, hold_secs: float) -> "MinitouchCommands":
+        return self.down(0, x, y).commit().wait(hold_secs).up(0).commit()
+
+    def swipe(self, paths: Sequence[Tuple[float, float, float, float]], duration_secs: float, steps: int) \
+            -> "MinitouchCommands":
+        # paths: (x1, y1, x2, y2) per contact, all moving at the same time
+        for (contact, (x1, y1, _, _)) in enumerate(paths):
+            self.down(contact, x1, y1)
+        self.commit()
+        for step in range(1, steps + 1):
+            self.wait(duration_secs / steps)
+            for (contact, (x1, y1, x2, y2)) in enumerate(paths):
+                self.move(contact, x1 + (x2 - x1) * step / steps, y1 + (y2 - y1) * step / steps)
+            self.commit()
+        for contact in range(len(paths)):
+            self.up(contact)
+        return self.commit()
+
+    def encode(self, client: "MinitouchClient") -> bytes:
+        # with the touch panel coordinates of client, known once it's connected
+        lines = []
+        for command in self.commands:
+            if command[0] in ("d", "m"):
+                (x, y) = client.to_device(command[2], command[3])
+                lines.append("{} {} {} {} {}\n".format(command[0], command[1], x, y, client.pressure))
+            else:
+                lines.append(" ".join(str(v) for v in command) + "\n")
+        return "".join(lines).encode("ascii")
+
+
+class MinitouchClient:
+    # not thread-safe
+    #
+    # Input through a minitouch server on the device, over an adb forward like MinicapClient. Same gestures as
+    # MonkeyRunnerAdaptor, so DeviceController can use either (see device.ini). Gesture calls return once the device
+    # played them, like the monkeyrunner ones.
+
+    tap_hold_secs = 0.05
+    drag_secs = 0.1  # as MonkeyDevice.drag() in monkey_runner_target.py
+    drag_steps = 10
+
+    def __init__(self, port=1111, host="127.0.0.1", forward=True, screen_size=(2340, 1080), rotation=0):
+        # forward: adb forward port to the minitouch socket first; False for a server listening on host already
+        # rotation: of the screen relative to the touch panel, 0, 90, 180 or 270
+        self.host = host
+        self.port = port
+        self.forward = forward
+        self.screen_size = screen_size
+        self.rotation = rotation
+        self.__connection = None
+
+        # from the banner
+        self.max_contacts = 0
+        self.max_x = 0
+        self.max_y = 0
+        self.pressure = 0
+
+        self.metrics = InputMetrics()
+        self.__backoff = Backoff()
+
+    def send(self, batch: MinitouchCommands, wait=True, name="batch"):
+        # wait: until the waits of the batch passed on the device
+        # The connection is checked right before each send; minitouch has no request to heartbeat with.
+        while True:
+            start_time = time.time()
+            try:
+                if self.__connection is None:
+                    self.__connect()
+                self.__check_alive()
+                self.__connection.sendall(batch.encode(self))
+            except Exception as e:
+                print("minitouch connect is broken... reconnecting: " + str(e))
+                self.__close()
+                self.metrics.count("call failures")
+                self.__backoff.sleep()
+                continue
+            break
+        self.__backoff.reset()
+        self.metrics.record(name, time.time() - start_time)
+        self.metrics.count("commands", len(batch.commands))
+        if wait:
+            time.sleep(batch.duration_secs)
+
+    def touch(self, x, y):
+        self.send(MinitouchCommands().tap(x, y, self.tap_hold_secs), name="touch")
+
+    def drag(self, x1, y1, x2, y2):
+        self.send(MinitouchCommands().swipe([(x1, y1, x2, y2)], self.drag_secs, self.drag_steps), name="drag")
+
+    def run_gestures(self, gestures) -> bool:
+        # as MonkeyRunnerAdaptor.run_gestures(), in one batch
+        batch = MinitouchCommands()
+        for (name, *args) in gestures:
+            if name == "touch":
+                batch.tap(args[0], args[1], self.tap_hold_secs)
+            elif name == "drag":
+                batch.swipe([tuple(args[:4])], self.drag_secs, self.drag_steps)
+            else:
+                raise ValueError("unknown gesture '{}'".format(name))
+            batch.wait(args[-1])
+        self.send(batch, name="run_gestures")
+        return True
+
+    def to_device(self, x, y) -> Tuple[int, int]:
+        # screen pixels to touch panel coordinates
+        (nx, ny) = (x / self.screen_size[0], y / self.screen_size[1])
+        if self.rotation == 90:
+            (nx, ny) = (1 - ny, nx)
+        elif self.rotation == 180:
+            (nx, ny) = (1 - nx, 1 - ny)
+        elif self.rotation == 270:
+            (nx, ny) = (ny, 1 - nx)
+        return (min(max(int(round(nx * self.max_x)), 0), self.max_x),
+                min(max(int(round(ny * self.max_y)), 0), self.max_y))
+
+    def get_stats(self) -> str:
+        return self.metrics.get_stats()
+
+    def __connect(self):
+        if self.forward:
+            print("run following command manually, and keep it alive:")
+            print("adb shell /data/local/tmp/minitouch")
+            subprocess.call("adb forward tcp:{} localabstract:minitouch".format(self.port), shell=True)
+        self.__connection = socket.create_connection((self.host, self.port))
+        self.__connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.__read_banner()
+
+    def __read_banner(self):
+        # "v <version>", "^ <max contacts> <max x> <max y> <max pressure>", "$ <pid>"
+        f = self.__connection.makefile("r", encoding="ascii")
+        while True:
+            line = f.readline()
+            if line == "":
+                raise ConnectionAbortedError()
+            fields = line.split()
+            if fields[0] == "^":
+                (self.max_contacts, self.max_x, self.max_y, max_pressure) = [int(v) for v in fields[1:5]]
+                self.pressure = min(50, max_pressure)
+            elif fields[0] == "$":
+                print("minitouch: {} contacts, {}x{}, pid {}".format(
+                    self.max_contacts, self.max_x, self.max_y, fields[1]))
+                return
+
+    def __check_alive(self):
+        # minitouch sends nothing after the banner, so a readable socket is a closed one. Writing to it would only
+        # fail on the write after, with the batch lost.
+        (readable, _, _) = select.select([self.__connection], [], [], 0)
+        if readable and self.__connection.recv(1, socket.MSG_PEEK) == b"":
+            raise ConnectionAbortedError()
+
+    def __close(self):
+        if self.__connection is not None:
+            try:
+                self.__connection.close()
+            except:
+                pass
+            self.__connection = None
+        self.metrics.count("reconnects")
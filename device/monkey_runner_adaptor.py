@@ -1,9 +1,11 @@
 import xmlrpc.client
 
 import subprocess
+import threading
 import time
 from PyQt5.QtCore import QRunnable, QThreadPool
 from PyQt5.sip import delete
+from device.health import Backoff, Heartbeat, InputMetrics
 
 class MonkeyRunnerTargetRunner(QRunnable):
     def run(self) -> None:
@@ -13,32 +15,97 @@ class MonkeyRunnerTargetRunner(QRunnable):
         print("monkey runner died")
 
 class MonkeyRunnerAdaptor:
+    # thread-safe: calls take turns on one connection, the target serves one connection at a time
+
     __server = MonkeyRunnerTargetRunner()
     __client = None
 
+    # the target checks the device when a gesture fails, and on heartbeats this often, also while gestures run
+    heartbeat_interval_secs = 2.0
 
-    def __init__(self):
-        QThreadPool.globalInstance().start(self.__server)
+    def __init__(self, url="http://localhost:13728", start_target=True):
+        # start_target: run monkey_runner_target.py; False to talk to a server started elsewhere
+        self.url = url
+        self.metrics = InputMetrics()
+        self.__backoff = Backoff()
+        self.__lock = threading.Lock()
+        if start_target:
+            QThreadPool.globalInstance().start(self.__server)
+        self.__target_reconnects = 0  # as the target last reported it
+        self.__heartbeat = Heartbeat(self.__check_target, self.heartbeat_interval_secs, self.metrics)
 
-    def __invoke(self, f):
+    def __invoke(self, name: str, f):
+        # one keep-alive connection for every call, reopened after a failure with exponential backoff
         while True:
+            (ok, result) = self.__call(name, f)
+            if ok:
+                self.__backoff.reset()
+                return result
+            self.__backoff.sleep()
+
+    def __call(self, name: str, f):
+        # (whether it succeeded, result)
+        with self.__lock:
+            start_time = time.time()
             try:
-                self.__client = xmlrpc.client.ServerProxy("http://localhost:13728")
-                f()
+                if self.__client is None:
+                    self.__client = xmlrpc.client.ServerProxy(self.url)
+                result = f()
             except Exception as e:
                 print("failed to connect monkeyrunner target: " + str(e))
-                time.sleep(0.1)
-                continue
-            break
+                self.__close()
+                self.metrics.count("call failures")
+                return (False, None)
+            self.metrics.record(name, time.time() - start_time)
+            return (True, result)
+
+    def close(self):
+        # stops the heartbeats and closes the connection
+        self.__heartbeat.stop()
+        with self.__lock:
+            if self.__client is not None:
+                self.__client("close")()
+                self.__client = None
+
+    def __close(self):
+        try:
+            self.__client("close")()
+        except:
+            pass
+        self.__client = None
+        self.metrics.count("reconnects")
+
+    def __check_target(self) -> bool:
+        # from the heartbeat thread; Heartbeat backs off when it fails
+        (ok, result) = self.__call("heartbeat", lambda: self.__client.heartbeat())
+        if not ok:
+            return False
+        (healthy, target_reconnects) = result
+        # the target counts from 0 again when it restarts
+        if target_reconnects < self.__target_reconnects:
+            self.metrics.count("target restarts")
+            self.__target_reconnects = 0
+        self.metrics.count("device reconnects", target_reconnects - self.__target_reconnects)
+        self.__target_reconnects = target_reconnects
+        return healthy
 
     def touch(self, x, y):
-        self.__invoke(lambda: self.__client.touch_down_and_up(int(x), int(y)))
+        self.__invoke("touch", lambda: self.__client.touch_down_and_up(int(x), int(y)))
 
     def drag(self, x1, y1, x2, y2):
-        self.__invoke(lambda: self.__client.drag(int(x1),int(y1),int(x2),int(y2)))
+        self.__invoke("drag", lambda: self.__client.drag(int(x1),int(y1),int(x2),int(y2)))
 
     def take_snapshot(self, path, format):
-        self.__invoke(lambda: self.__client.take_snapshot(path, format))
+        self.__invoke("take_snapshot", lambda: self.__client.take_snapshot(path, format))
+
+    def run_gestures(self, gestures) -> bool:
+        # gestures: ("touch", x, y, secs to wait after it) or ("drag", x1, y1, x2, y2, secs to wait after it), run in
+        # one call, paced on the target; returns whether every gesture ran
+        gestures = [[name] + [int(v) for v in args[:-1]] + [float(args[-1])] for (name, *args) in gestures]
+        return self.__invoke("run_gestures", lambda: self.__client.run_gestures(gestures))
+
+    def get_stats(self) -> str:
+        return self.metrics.get_stats()
 
 if __name__ == "__main__":
     o = MonkeyRunnerAdaptor()
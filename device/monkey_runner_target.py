@@ -7,6 +7,7 @@ from SimpleXMLRPCServer import SimpleXMLRPCServer
 from SimpleXMLRPCServer import SimpleXMLRPCRequestHandler
 
 device = None
+reconnects = 0
 
 
 def connect_device():
@@ -21,24 +22,42 @@ def connect_device():
 def is_healthy():
     if device is None:
         return False
-    print("checking device healthy by calling clock.realtime...")
-    v = device.getProperty("clock.realtime")
-    print("got clock.realtime: " + str(v))
+    try:
+        v = device.getProperty("clock.realtime")
+    except Exception as e:
+        print("clock.realtime failed: " + str(e))
+        return False
+    if not v > 0:
+        print("got clock.realtime: " + str(v))
     return v > 0
 
 
-def perform_until_healthy(f):
-    global device
-    while True:
-        if device is not None:
-            f(device)
-        if is_healthy():
-            break
-        device = connect_device()
+def reconnect():
+    global device, reconnects
+    device = connect_device()
+    reconnects += 1
+
+
+def perform(f, retry=True):
+    # The device is only checked when f fails, and by heartbeat() every few seconds: checking after every gesture
+    # doubled the round trips. retry: run f again after reconnecting. Returns whether f ran without failing.
+    if device is None:
+        reconnect()
+    try:
+        f(device)
+        return True
+    except Exception as e:
+        print("device call failed: " + str(e))
+    reconnect()
+    if retry:
+        f(device)
+    return False
 
 
 class RequestHandler(SimpleXMLRPCRequestHandler):
     rpc_paths = ('/RPC2',)
+    # keep-alive, so MonkeyRunnerAdaptor sends every call over one connection
+    protocol_version = "HTTP/1.1"
 
 
 server = SimpleXMLRPCServer(("localhost", 13728),
@@ -54,8 +73,19 @@ def noop():
 server.register_function(noop, "noop")
 
 
+def heartbeat():
+    # checks the device and reconnects if it's broken; returns (healthy before, reconnects so far)
+    healthy = is_healthy()
+    if not healthy:
+        reconnect()
+    return (healthy, reconnects)
+
+
+server.register_function(heartbeat, "heartbeat")
+
+
 def touch_down_and_up(x, y):
-    perform_until_healthy(lambda device: device.touch(
+    perform(lambda device: device.touch(
         x, y, MonkeyDevice.DOWN_AND_UP))
 
 
@@ -63,7 +93,7 @@ server.register_function(touch_down_and_up, "touch_down_and_up")
 
 
 def drag(x1, y1, x2, y2):
-    perform_until_healthy(lambda device: device.drag(
+    perform(lambda device: device.drag(
         (x1, y1), (x2, y2), 0.1))
 
 
@@ -71,11 +101,31 @@ server.register_function(drag, "drag")
 
 
 def take_snapshot(path, format):
-    perform_until_healthy(lambda device:
+    perform(lambda device:
         device.takeSnapshot().writeToFile(path, format))
 
 
 server.register_function(take_snapshot, "take_snapshot")
 
+
+gestures_by_name = {
+    "touch": lambda device, x, y: device.touch(x, y, MonkeyDevice.DOWN_AND_UP),
+    "drag": lambda device, x1, y1, x2, y2: device.drag((x1, y1), (x2, y2), 0.1),
+}
+
+
+def run_gestures(gestures):
+    # gestures: [name, args..., secs to wait after it], e.g. ["drag", x1, y1, x2, y2, 0.3]. A batch stops at a failed
+    # gesture and isn't replayed after the reconnect: the gestures already done changed the screen. Returns whether
+    # every gesture ran.
+    for gesture in gestures:
+        if not perform(lambda device: gestures_by_name[gesture[0]](device, *gesture[1:-1]), retry=False):
+            return False
+        time.sleep(gesture[-1])
+    return True
+
+
+server.register_function(run_gestures, "run_gestures")
+
 print("starting rpc server")
 server.serve_forever()
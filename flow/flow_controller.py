@@ -12,15 +12,26 @@ from PyQt5 import QtCore
 from PyQt5.QtCore import QObject, QRunnable, QThread, QThreadPool
 
 from actions import actions
+from actions import find_images
+from actions.game_state_classifier import GameStateClassifier
+from actions.strategy_profile import StrategyProfile
 from log.logger import Logger
 from device.device_controller import DeviceController
 from dataset.images_manager import ImagesManager
-from board.board_image_parser import BoardImageParser
+from board.board_image_parser import BoardImageParser, HpParser
+from board.solver_worker import BoardSolverWorker
+from flow.waits import TransitionStats, Wait
 
 
 class ActionEntry:
+    # run() of an action yields:
+    # - an action, to run before resuming
+    # - None, to be called back on a later tick
+    # - a Wait, to be resumed once it's over
     action: BaseAction = None
     state: Iterable[BaseAction] = None
+    wait: Wait = None
+    called_back = False  # yielded None last time
 
     def __init__(self, action: BaseAction):
         super().__init__()
@@ -31,6 +42,12 @@ class ActionEntry:
             self.action.start_time = time.time()
             self.state = self.action.run(context)
 
+        if self.wait is not None:
+            if not self.wait.poll(context):
+                list.appendleft(self)
+                return
+            self.wait = None
+
         try:
             new_action = next(self.state)
         except StopIteration:
@@ -41,9 +58,20 @@ class ActionEntry:
             return
 
         list.appendleft(self)
-        if new_action is not None:
+        self.called_back = new_action is None
+        if isinstance(new_action, Wait):
+            self.wait = new_action
+            self.wait.start(context)
+        elif new_action is not None:
             list.appendleft(ActionEntry(new_action))
 
+    def block(self, context: ActionRunningContext, max_secs: float):
+        # until the next step() has something to do, at most max_secs
+        if self.wait is not None:
+            self.wait.block(context, max_secs)
+        elif self.called_back:
+            time.sleep(max_secs)
+
 
 class FlowController(QObject):
     __enabled = False
@@ -56,18 +84,45 @@ class FlowController(QObject):
     device: DeviceController = DeviceController()
     logger: Logger = Logger()
 
-    board_ai: BoardAI = BoardAI()
+    # solves with the walker, or the transposition table search when the strategy profile ranks with refill rollouts
+    # (they rank its candidates); all rank boards by the profile's scoring
+    __profile: StrategyProfile = StrategyProfile.get_active()
+    board_ai: BoardAI = BoardAI(cache_db_path=BoardAI.default_cache_db_path,
+                                use_transposition_table=__profile.refill_rollouts > 0,
+                                scoring=__profile.scoring, rank_walker_by_scoring=True,
+                                refill_rollouts=__profile.refill_rollouts, refill_weight=__profile.refill_weight)
     board_stable_checker: BoardStableChecker() = BoardStableChecker()
 
     images_manager: ImagesManager = ImagesManager()
 
+    transition_stats: TransitionStats = TransitionStats()
+
+    # how long wait_for_next_tick() sleeps when disabled or called back, and at most for a Wait, to keep the UI and
+    # enable() responsive
+    idle_poll_secs = 0.1
+    max_block_secs = 0.5
+
     # signal to update UI
     update_actions = QtCore.pyqtSignal(list)
 
     def __init__(self):
         super().__init__()
         self.__actions.appendleft(ActionEntry(actions.ActionOpenPvpForever()))
-        self.board_image_parse = BoardImageParser()
+        self.board_image_parse = BoardImageParser(incremental=True)
+        find_images.template_registry.load_all(self.logger)
+        self.__declare_rois()
+        self.game_state_classifier = GameStateClassifier(actions.ActionParseGameState.oneofs, self.logger)
+        self.board_solver_worker = BoardSolverWorker(self.board_ai)
+
+    def __declare_rois(self):
+        # every screenshot region the actions read, so frames that change none of them skip the full decode.
+        # Specs without expect_pos are searched on the full screen only to calibrate parameters.ini; left out.
+        checker = self.board_stable_checker
+        self.device.declare_roi("board", checker.pos_x1, checker.pos_y1, checker.pos_x2, checker.pos_y2)
+        self.device.declare_roi("hp", HpParser.x1, HpParser.y1, HpParser.x2, HpParser.y2)
+        for templates in find_images.template_registry.get_loaded():
+            if templates.spec.has_expect_pos():
+                self.device.declare_roi(templates.spec.name, *templates.get_search_window(*self.device.screen_size))
 
     def connect_ui(self, update_actions, update_state, update_screenshot, append_log):
         self.update_actions.connect(update_actions)
@@ -91,17 +146,34 @@ class FlowController(QObject):
             self.__action_context.board_stable_checker = self.board_stable_checker
             self.__action_context.images_manager = self.images_manager
             self.__action_context.board_ai = self.board_ai
+            self.__action_context.game_state_classifier = self.game_state_classifier
+            self.__action_context.board_solver_worker = self.board_solver_worker
+            self.__action_context.transition_stats = self.transition_stats
 
             next_action = self.__actions.popleft()
             next_action.step(self.__actions, self.__action_context)
 
         self.update_ui()
 
+    def wait_for_next_tick(self):
+        # sleeps until the action at the front can make progress: right away after it yielded an action, when a
+        # frame arrives or its time is up for a Wait
+        if not self.is_enabled() or len(self.__actions) == 0:
+            time.sleep(self.idle_poll_secs)
+            return
+        entry = self.__actions[0]
+        if entry.called_back:
+            entry.block(self.__action_context, self.idle_poll_secs)
+        else:
+            entry.block(self.__action_context, self.max_block_secs)
+
     def update_ui(self):
         readable_actions = []
         for entry in self.__actions:
-            readable_actions.append(str(entry.action))
-            pass
+            readable = str(entry.action)
+            if entry.wait is not None:
+                readable += "\n  " + str(entry.wait)
+            readable_actions.append(readable)
 
         self.update_actions.emit(readable_actions)
 
@@ -109,10 +181,16 @@ class FlowController(QObject):
 class FlowRunner(QRunnable):
     flow = FlowController()
 
+    # ticks follow frames now, so collect at most this often
+    gc_interval_secs = 1.0
+
     def run(self):
         #QThreadPool.globalInstance().start(self.flow.device.minicap_client)
 
+        last_gc_time = 0.0
         while (True):
             self.flow.tick()
-            gc.collect()
-            time.sleep(0.1)  # avoid busy loop
+            if time.time() - last_gc_time >= self.gc_interval_secs:
+                gc.collect()
+                last_gc_time = time.time()
+            self.flow.wait_for_next_tick()
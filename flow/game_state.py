@@ -71,6 +71,7 @@ class EnemyStatus:
 class GameState:
     def __init__(self):
         self.main_state = MainState.UNKNOWN
+        self.main_state_spec : str = None  # the spec main_state was recognized by
         self.skills_state = SkillsState.UNKNOWN
         self.skill_state : Dict[Skill, SkillState] = dict()
         self.skill_click_count = 0
@@ -0,0 +1,191 @@
+import time
+from collections import defaultdict, deque
+from typing import Dict, Sequence, Tuple
+from actions import find_images
+from device.minicap_client import FrameRing, rois_changed
+
+
+class Wait:
+    # Yielded by BaseAction.run() to be resumed once the wait is over, instead of sleeping on the flow thread.
+    # FlowRunner sleeps in block() until the wait may be over; the action can read timed_out and get_elapsed_secs()
+    # when it's resumed.
+
+    def __init__(self, timeout_secs: float):
+        self.timeout_secs = timeout_secs
+        self.start_time = None
+        self.end_time = None
+        self.timed_out = False
+
+    def start(self, context):
+        self.start_time = time.time()
+
+    def poll(self, context) -> bool:
+        # whether the wait is over
+        if self.end_time is None:
+            if self.is_met(context):
+                self.end_time = time.time()
+            elif self.get_remaining_secs() <= 0:
+                self.end_time = time.time()
+                self.timed_out = True
+        return self.end_time is not None
+
+    def is_met(self, context) -> bool:
+        return False
+
+    def block(self, context, max_secs: float):
+        # returns when the wait may be over, at most max_secs later
+        time.sleep(max(0.0, min(self.get_remaining_secs(), max_secs)))
+
+    def get_remaining_secs(self) -> float:
+        return self.start_time + self.timeout_secs - time.time()
+
+    def get_elapsed_secs(self) -> float:
+        return (self.end_time or time.time()) - self.start_time
+
+    def __str__(self) -> str:
+        if self.start_time is None:
+            return self.__class__.__name__
+        return "{} {:.1f} / {:.1f} seconds".format(self.__class__.__name__, self.get_elapsed_secs(), self.timeout_secs)
+
+
+class WaitSecs(Wait):
+    # a fixed delay, timed_out when it's over
+    pass
+
+
+class WaitForNewFrame(Wait):
+    # a minicap frame newer than the last captured screenshot. minicap only sends frames when the screen changes.
+
+    def start(self, context):
+        super().start(context)
+        self.seq = context.device.last_captured_frame_seq
+
+    def is_met(self, context) -> bool:
+        frame = context.device.get_latest_frame()
+        return frame is not None and frame.seq > self.seq
+
+    def block(self, context, max_secs: float):
+        context.device.wait_for_frame_after(self.seq, max(0.0, min(self.get_remaining_secs(), max_secs)))
+
+
+class WaitForScreenChange(WaitForNewFrame):
+    # a frame differing from the screen at start() in one of rois (the whole screen by default), compared at
+    # reduced scale like DeviceController's ROI decode gating: max per-channel difference of a reduced pixel
+
+    def __init__(self, timeout_secs: float, rois: Sequence[Tuple[int, int, int, int]] = None, threshold=24):
+        super().__init__(timeout_secs)
+        self.rois = rois
+        self.threshold = threshold
+        self.baseline = None
+        self.frame = None  # the last frame checked
+        self.changed_time = None  # when the last frame differing from the one before it was received
+
+    def start(self, context):
+        super().start(context)
+        frame = context.device.get_latest_frame()
+        if frame is not None:
+            self.seq = frame.seq
+            self.baseline = frame.decode_reduced()
+
+    def is_met(self, context) -> bool:
+        return self.check_new_frame(context)
+
+    def check_new_frame(self, context) -> bool:
+        # whether the latest frame, if not checked yet, differs from the baseline; it's the baseline from then on
+        frame = context.device.get_latest_frame()
+        if frame is None or frame.seq <= self.seq:
+            return False
+        reduced = frame.decode_reduced()
+        if reduced is None:
+            return False
+        if self.baseline is None:
+            self.baseline = reduced
+        self.seq = frame.seq
+        self.frame = frame
+        scale = FrameRing.reduced_scale
+        rois = self.rois or [(0, 0, reduced.shape[1] * scale, reduced.shape[0] * scale)]
+        if not rois_changed(self.baseline, reduced, rois, self.threshold):
+            return False
+        self.baseline = reduced
+        self.changed_time = frame.timestamp
+        return True
+
+
+class WaitForScreenSettle(WaitForScreenChange):
+    # the screen changes in rois, then stays the same for quiet_secs: the animation the change started is over
+
+    def __init__(self, timeout_secs: float, rois: Sequence[Tuple[int, int, int, int]] = None, threshold=24,
+                 quiet_secs=0.15):
+        super().__init__(timeout_secs, rois, threshold)
+        self.quiet_secs = quiet_secs
+
+    def is_met(self, context) -> bool:
+        self.check_new_frame(context)
+        return self.changed_time is not None and time.time() - self.changed_time >= self.quiet_secs
+
+    def block(self, context, max_secs: float):
+        if self.changed_time is not None:
+            max_secs = min(max_secs, self.changed_time + self.quiet_secs - time.time())
+        super().block(context, max_secs)
+
+
+class WaitForSpec(WaitForScreenChange):
+    # spec_name found (appear) or gone (not appear) in a new frame. Only frames where the spec's search window changed
+    # since the last captured screenshot, or the last frame matched, are decoded in full and matched, so the wait costs
+    # a reduced decode per frame otherwise. The frames are matched in place, without capturing a screenshot: the flow
+    # captures the screen it acts on once the wait is over.
+
+    def __init__(self, spec_name: str, appear: bool, timeout_secs: float, threshold=24):
+        super().__init__(timeout_secs, threshold=threshold)
+        self.spec_name = spec_name
+        self.appear = appear
+
+    def start(self, context):
+        self.rois = [find_images.template_registry.get(self.spec_name).get_search_window(*context.device.screen_size)]
+        # the screenshot the state was recognized on, before the click: the spec may be gone by now
+        captured = context.device.get_captured_reduced()
+        super().start(context)
+        if captured is not None:
+            (self.seq, self.baseline) = (context.device.last_captured_frame_seq, captured)
+        elif self.__matches(context, context.device.get_latest_frame()):
+            # minicap replaced that frame; match the latest one, it may not change again
+            self.end_time = time.time()
+
+    def is_met(self, context) -> bool:
+        return self.check_new_frame(context) and self.__matches(context, self.frame)
+
+    def __matches(self, context, frame) -> bool:
+        # decoded once per frame: FrameRing keeps the image for a capture of the same frame
+        image = None if frame is None else frame.decode()
+        if image is None:
+            return False
+        result = find_images.find_image(self.spec_name, image, context.logger)
+        return result.found == self.appear
+
+    def __str__(self) -> str:
+        return "{} for '{}' to {}".format(super().__str__(), self.spec_name, "appear" if self.appear else "disappear")
+
+
+class TransitionStats:
+    # how long the waits for screen transitions took, per state they started from, to tune their timeouts
+
+    def __init__(self, history=100):
+        self.__durations: Dict[object, deque] = defaultdict(lambda: deque(maxlen=history))
+        self.__timeouts: Dict[object, int] = defaultdict(int)
+        self.__counts: Dict[object, int] = defaultdict(int)
+
+    def add(self, state, wait: Wait):
+        self.__counts[state] += 1
+        if wait.timed_out:
+            self.__timeouts[state] += 1
+        else:
+            self.__durations[state].append(wait.get_elapsed_secs())
+
+    def get_stats(self, state) -> str:
+        durations = sorted(self.__durations[state])
+        if durations:
+            (p50, p90) = (durations[len(durations) // 2], durations[min(len(durations) * 9 // 10, len(durations) - 1)])
+            out = "p50 {:.2f} / p90 {:.2f} / max {:.2f} secs".format(p50, p90, durations[-1])
+        else:
+            out = "no completed transitions"
+        return "{}, {} of {} timed out".format(out, self.__timeouts[state], self.__counts[state])
@@ -0,0 +1,147 @@
+import glob
+import math
+import os
+import time
+import cv2
+import numpy
+from board import board_image_parser
+from board.board_image_parser import BoardImageParser, compare_grid_image, grid_diff_score
+from board.grid_feature_classifier import GridFeatureClassifier
+
+# trains the GridFeatureClassifier from board/grid_types/* and benchmarks it against template matching
+
+screenshot_patterns = ["actions/*/_temp_last_screenshot.png", "board/hp/*.png", "_temp_last_screenshot.png"]
+
+
+def leave_one_out(grid_types, classifier: GridFeatureClassifier):
+    imgs = []
+    labels = []
+    for grid_type in grid_types.grid_types:
+        for img in grid_type.images:
+            imgs.append(img)
+            labels.append(grid_type.value)
+
+    start_time = time.time()
+    template_correct = 0
+    for i, img in enumerate(imgs):
+        min_score = math.inf
+        min_label = None
+        for j, seed in enumerate(imgs):
+            if i == j:
+                continue
+            score = grid_diff_score(img, seed)
+            if score < min_score:
+                min_score = score
+                min_label = labels[j]
+        template_correct += min_label == labels[i]
+    template_secs = (time.time()-start_time) / len(imgs)
+
+    # only valid when the classifier was trained on exactly these images, in this order
+    start_time = time.time()
+    features = numpy.stack([GridFeatureClassifier.extract_features(img) for img in imgs])
+    results = classifier.classify_features(features, exclude=numpy.arange(len(imgs)))
+    feature_secs = (time.time()-start_time) / len(imgs)
+    feature_correct = sum(value == label for ((value, _, _), label) in zip(results, labels))
+
+    print("leave-one-out on {} labeled grid images:".format(len(imgs)))
+    print("  template matching: accuracy {:.3f}, {:.2f} ms/image".format(template_correct / len(imgs), template_secs * 1000))
+    print("  feature classifier: accuracy {:.3f}, {:.2f} ms/image".format(feature_correct / len(imgs), feature_secs * 1000))
+
+
+def load_boards(parser: BoardImageParser):
+    # (cell images, template matching result) per screenshot with a recognizable board
+    paths = sorted(sum([glob.glob(pattern) for pattern in screenshot_patterns], []))
+    ret = []
+    for path in paths:
+        img = cv2.imread(path)
+        if img is None or img.shape[0] < 1080:
+            continue
+        img_grids = [board_image_parser.cv_roi(img, *board_image_parser.get_grid_rect(x, y))
+                     for x in range(7) for y in range(5)]
+        reference = parser.grid_classifier.classify(img_grids)
+        if max(score for (_, score) in reference) > 0.2:
+            continue  # no recognizable board on this screenshot
+        ret.append((img_grids, reference))
+    return ret
+
+
+def is_accepted(confidence, distance):
+    return confidence >= BoardImageParser.feature_min_confidence and distance <= BoardImageParser.feature_max_distance
+
+
+def calibrate(boards, classifier: GridFeatureClassifier):
+    # least squares fit of template matching scores by distance, over the cells the parser takes from the classifier
+    distances = []
+    scores = []
+    for (img_grids, reference) in boards:
+        for ((_, score), (_, confidence, distance)) in zip(reference, classifier.classify(img_grids)):
+            if is_accepted(confidence, distance):
+                distances.append(distance)
+                scores.append(score)
+    if not distances:
+        print("no board screenshots found; keeping score_per_distance {}".format(classifier.score_per_distance))
+        return
+
+    distances = numpy.array(distances)
+    classifier.score_per_distance = float(numpy.sum(numpy.array(scores) * distances) / numpy.sum(distances ** 2))
+    print("score_per_distance {:.4f} from {} cells".format(classifier.score_per_distance, len(distances)))
+
+
+def benchmark_boards(boards, parser: BoardImageParser, classifier: GridFeatureClassifier):
+    if not boards:
+        print("no board screenshots found")
+        return
+
+    cells = 0
+    agreed = 0
+    accepted = 0
+    accepted_agreed = 0
+    max_score_diff = 0.0
+    secs = {"compare_grid_image": 0.0, "BatchGridClassifier": 0.0, "GridFeatureClassifier": 0.0}
+    for (img_grids, reference) in boards:
+        start_time = time.time()
+        for img_grid in img_grids:
+            compare_grid_image(img_grid, parser.grid_types)
+        secs["compare_grid_image"] += time.time() - start_time
+
+        start_time = time.time()
+        parser.grid_classifier.classify(img_grids)
+        secs["BatchGridClassifier"] += time.time() - start_time
+
+        start_time = time.time()
+        results = classifier.classify(img_grids)
+        secs["GridFeatureClassifier"] += time.time() - start_time
+
+        for ((grid_type, score), (value, confidence, distance)) in zip(reference, results):
+            cells += 1
+            agreed += grid_type.value == value
+            if is_accepted(confidence, distance):
+                accepted += 1
+                accepted_agreed += grid_type.value == value
+                max_score_diff = max(max_score_diff, abs(classifier.get_score(distance) - score))
+
+    print("{} boards, {} cells, template matching as reference:".format(len(boards), cells))
+    print("  feature classifier agrees on {:.3f} of cells".format(agreed / cells))
+    print("  {:.3f} of cells have confidence >= {} and distance <= {}, agreeing on {:.3f} of them; "
+          "the rest fall back to template matching".format(
+        accepted / cells, BoardImageParser.feature_min_confidence, BoardImageParser.feature_max_distance,
+        accepted_agreed / max(accepted, 1)))
+    print("  estimated scores of those cells are off by at most {:.3f}".format(max_score_diff))
+    for (name, total) in secs.items():
+        print("  {}: {:.1f} ms/board".format(name, total / len(boards) * 1000))
+
+
+if __name__ == "__main__":
+    parser = BoardImageParser()
+
+    classifier = GridFeatureClassifier.train(parser.grid_types, include_recorded=False)
+    leave_one_out(parser.grid_types, classifier)
+
+    boards = load_boards(parser)
+    classifier = GridFeatureClassifier.train(parser.grid_types)
+    calibrate(boards, classifier)
+    classifier.save()
+    print("saved {} samples to {} ({} bytes)".format(
+        len(classifier.labels), GridFeatureClassifier.model_path, os.path.getsize(GridFeatureClassifier.model_path)))
+
+    benchmark_boards(boards, parser, classifier)
@@ -1,7 +1,7 @@
 import sys
 from PyQt5.QtCore import QThreadPool
 from PyQt5.QtWidgets import QApplication, QLabel, QListWidget, QListWidgetItem, QMainWindow, QScrollArea
-from PyQt5.QtGui import QPixmap
+from PyQt5.QtGui import QImage, QPixmap
 from PyQt5 import uic
 
 from flow import flow_controller
@@ -58,12 +58,11 @@ class Window(QMainWindow):
 
     def btn2Clicked(self):
         self.flow.flow.device.capture_screenshot()
-        self.update_screenshot()
+        if self.flow.flow.device.last_thumbnail is not None:
+            self.update_screenshot(self.flow.flow.device.last_thumbnail)
 
-    def update_screenshot(self):
-        pixmap = QPixmap()
-        pixmap.load(self.flow.flow.device.last_captured_screenshot_path)
-        pixmap = pixmap.scaledToHeight(250)
+    def update_screenshot(self, thumbnail: QImage):
+        pixmap = QPixmap.fromImage(thumbnail)
         self.label1.setPixmap(pixmap)
         self.label1.setFixedSize(pixmap.size())
 